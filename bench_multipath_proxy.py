@@ -0,0 +1,424 @@
+"""Benchmark suite for multipath_proxy.py.
+
+Runs MultiNICSOCKSProxy against local servers and reports, per scenario:
+
+    bulk     - bulk download throughput and proxy CPU time per GB for each
+               relay mode
+    connect  - short SOCKS5 connections: connections/s, time to first byte
+               (p50/p99) and how the connections spread over the NICs
+    http     - the same for HTTP forward-proxy requests (Connection: close)
+
+    python bench_multipath_proxy.py --size-mb 2048 --streams 4
+    python bench_multipath_proxy.py --scenarios connect http --nics 3 --weights 1 2 3
+    python bench_multipath_proxy.py --json new.json --compare old.json
+
+The "NICs" are loopback aliases (127.0.0.1, 127.0.0.2, ...), which Linux
+routes without any setup; elsewhere add them to the loopback interface
+first.  The servers record the source IP of every connection, so the NIC
+distribution is measured on the wire and compared with the weights.
+
+The proxy runs in a child process so its CPU time and RSS are measured on
+their own; the servers and the load generator live in the parent.
+Everything stays on loopback, so the numbers show the proxy's own cost
+rather than any link.  --json writes the results together with the
+parameters and platform, and --compare prints the change against such a
+file.
+"""
+from __future__ import annotations
+
+import argparse
+import collections
+import json
+import multiprocessing as mp
+import os
+import platform
+import socket
+import struct
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+import multipath_proxy
+
+_CHUNK = 256 * 1024
+SCENARIOS = ("bulk", "connect", "http")
+
+
+# ---------------------------------------------------------------------
+# Local servers
+# ---------------------------------------------------------------------
+def _serve_forever(srv: socket.socket, serve, peers: Optional[collections.Counter]):
+    def accept_loop():
+        while True:
+            conn, addr = srv.accept()
+            if peers is not None:
+                peers[addr[0]] += 1
+            threading.Thread(target=serve, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+
+
+def _listener() -> socket.socket:
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(1024)
+    return srv
+
+
+def _start_source_server(peers: Optional[collections.Counter] = None) -> int:
+    """Serve '<8-byte size>' requests by streaming that many zero bytes."""
+    srv = _listener()
+    payload = bytes(_CHUNK)
+
+    def serve(conn: socket.socket):
+        with conn:
+            hdr = _recv_exact(conn, 8)
+            remaining = struct.unpack("!Q", hdr)[0]
+            view = memoryview(payload)
+            while remaining:
+                n = min(remaining, _CHUNK)
+                conn.sendall(view[:n])
+                remaining -= n
+
+    _serve_forever(srv, serve, peers)
+    return srv.getsockname()[1]
+
+
+def _start_http_server(body_size: int, peers: Optional[collections.Counter] = None) -> int:
+    """Answer every request with a body_size-byte 200 response and close."""
+    srv = _listener()
+    response = (b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\nConnection: close\r\n\r\n" % body_size
+                + bytes(body_size))
+
+    def serve(conn: socket.socket):
+        with conn:
+            data = b""
+            while b"\r\n\r\n" not in data:
+                chunk = conn.recv(4096)
+                if not chunk:
+                    return
+                data += chunk
+            conn.sendall(response)
+
+    _serve_forever(srv, serve, peers)
+    return srv.getsockname()[1]
+
+
+def _recv_exact(sock: socket.socket, n: int) -> bytes:
+    buf = b""
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("unexpected EOF")
+        buf += chunk
+    return buf
+
+
+def _socks_connect(proxy_port: int, host: str, port: int) -> socket.socket:
+    sock = socket.create_connection(("127.0.0.1", proxy_port))
+    sock.sendall(b"\x05\x01\x00")
+    if _recv_exact(sock, 2) != b"\x05\x00":
+        raise ConnectionError("SOCKS5 greeting rejected")
+    sock.sendall(b"\x05\x01\x00\x01" + socket.inet_aton(host) + struct.pack("!H", port))
+    reply = _recv_exact(sock, 10)
+    if reply[1] != 0:
+        raise ConnectionError(f"SOCKS5 connect failed: {reply[1]}")
+    return sock
+
+
+def _drain(sock: socket.socket, n: Optional[int], buf: bytearray) -> int:
+    """Read n bytes (None: until EOF); return how many arrived."""
+    got = 0
+    while n is None or got < n:
+        k = sock.recv_into(buf)
+        if not k:
+            break
+        got += k
+    return got
+
+
+def loopback_nics(count: int) -> List[str]:
+    """127.0.0.1 .. 127.0.0.<count>, checking that each one can be bound."""
+    ips = [f"127.0.0.{i}" for i in range(1, count + 1)]
+    for ip in ips:
+        try:
+            with socket.socket() as s:
+                s.bind((ip, 0))
+        except OSError as e:
+            raise SystemExit(f"cannot bind {ip} ({e}); add it as a loopback alias first") from None
+    return ips
+
+
+# ---------------------------------------------------------------------
+# Proxy child process
+# ---------------------------------------------------------------------
+def _rss_kb() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _peak_rss_kb() -> Optional[int]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak  # bytes on macOS, KiB elsewhere
+
+
+def _proxy_child(ip_weights, options: Dict, port_q, ctl):
+    proxy = multipath_proxy.MultiNICSOCKSProxy("127.0.0.1", 0, ip_weights, quiet=True, **options)
+    proxy.start()
+    port_q.put(proxy._server.getsockname()[1])
+    cpu0 = time.process_time()
+    ctl.recv()  # wait until the parent is done
+    port_q.put({"proxy_cpu_s": round(time.process_time() - cpu0, 3),
+                "proxy_rss_kb": _rss_kb(), "proxy_peak_rss_kb": _peak_rss_kb()})
+    proxy.stop()
+
+
+class _ProxyProcess:
+    """MultiNICSOCKSProxy in a child process, for `with` blocks."""
+
+    def __init__(self, ip_weights, **options):
+        self._q = mp.Queue()
+        self._ctl, child_ctl = mp.Pipe()
+        self._child = mp.Process(target=_proxy_child, args=(ip_weights, options, self._q, child_ctl),
+                                 daemon=True)
+        self.stats: Dict = {}
+
+    def __enter__(self) -> int:
+        self._child.start()
+        return self._q.get(timeout=10)
+
+    def __exit__(self, *exc):
+        self._ctl.send("stop")
+        self.stats = self._q.get(timeout=10)
+        self._child.join(timeout=5)
+
+
+# ---------------------------------------------------------------------
+# Benchmarks
+# ---------------------------------------------------------------------
+def run_relay_bench(relay: str, size: int, streams: int, engine: str = "threads") -> Dict:
+    """Bulk download through one NIC with the given relay mode."""
+    src_port = _start_source_server()
+    per_stream = size // streams
+    proxy = _ProxyProcess([("127.0.0.1", 1)], engine=engine, relay=relay)
+    with proxy as proxy_port:
+
+        def download(results: List[int]):
+            sock = _socks_connect(proxy_port, "127.0.0.1", src_port)
+            with sock:
+                sock.sendall(struct.pack("!Q", per_stream))
+                results.append(_drain(sock, per_stream, bytearray(_CHUNK)))
+
+        results: List[int] = []
+        workers = [threading.Thread(target=download, args=(results,)) for _ in range(streams)]
+        t0 = time.perf_counter()
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        elapsed = time.perf_counter() - t0
+
+    total = sum(results)
+    gb = total / 1e9
+    cpu = proxy.stats["proxy_cpu_s"]
+    return {
+        "scenario": "bulk",
+        "relay": relay,
+        "engine": engine,
+        "streams": streams,
+        "bytes": total,
+        "seconds": round(elapsed, 3),
+        "throughput_mbps": round(total * 8 / 1e6 / elapsed, 1),
+        "cpu_s_per_gb": round(cpu / gb, 3) if gb else None,
+        **proxy.stats,
+    }
+
+
+def run_load_bench(protocol: str, ip_weights, requests: int, concurrency: int,
+                   response_bytes: int, engine: str = "threads", scheduler: str = "wrr") -> Dict:
+    """Many short connections ("connect": SOCKS5, "http": forward proxy),
+    `concurrency` at a time, each fetching response_bytes."""
+    peers: collections.Counter = collections.Counter()
+    if protocol == "http":
+        port = _start_http_server(response_bytes, peers)
+        request = b"GET http://127.0.0.1:%d/ HTTP/1.1\r\nHost: 127.0.0.1:%d\r\nConnection: close\r\n\r\n" % (
+            port, port)
+    else:
+        port = _start_source_server(peers)
+    proxy = _ProxyProcess(ip_weights, engine=engine, scheduler=scheduler)
+    with proxy as proxy_port:
+        remaining = iter(range(requests))
+        lock = threading.Lock()
+        ttfb: List[float] = []
+        errors = [0]
+
+        def one(buf: bytearray) -> float:
+            t0 = time.perf_counter()
+            if protocol == "http":
+                sock = socket.create_connection(("127.0.0.1", proxy_port))
+                sock.sendall(request)
+            else:
+                sock = _socks_connect(proxy_port, "127.0.0.1", port)
+                sock.sendall(struct.pack("!Q", response_bytes))
+            with sock:
+                if not sock.recv_into(buf):
+                    raise ConnectionError("no response")
+                first = time.perf_counter() - t0
+                _drain(sock, None, buf)
+            return first
+
+        def client():
+            buf = bytearray(65536)
+            while True:
+                with lock:
+                    if next(remaining, None) is None:
+                        return
+                try:
+                    t = one(buf)
+                except OSError:
+                    with lock:
+                        errors[0] += 1
+                    continue
+                with lock:
+                    ttfb.append(t)
+
+        workers = [threading.Thread(target=client) for _ in range(concurrency)]
+        t0 = time.perf_counter()
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        elapsed = time.perf_counter() - t0
+
+    ttfb.sort()
+    return {
+        "scenario": protocol,
+        "engine": engine,
+        "scheduler": scheduler,
+        "concurrency": concurrency,
+        "requests": len(ttfb),
+        "errors": errors[0],
+        "seconds": round(elapsed, 3),
+        "conn_per_s": round(len(ttfb) / elapsed, 1),
+        "ttfb_p50_ms": _percentile_ms(ttfb, 0.50),
+        "ttfb_p99_ms": _percentile_ms(ttfb, 0.99),
+        **_distribution(ip_weights, peers),
+        **proxy.stats,
+    }
+
+
+def _percentile_ms(sorted_values: List[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    k = min(len(sorted_values) - 1, max(0, round(q * len(sorted_values)) - 1))  # nearest rank
+    return round(sorted_values[k] * 1000, 3)
+
+
+def _distribution(ip_weights, peers: collections.Counter) -> Dict:
+    """Observed share of connections per NIC against the weight share."""
+    total = sum(peers.values()) or 1
+    weight_total = sum(w for _, w in ip_weights)
+    shares = {ip: {"connections": peers.get(ip, 0),
+                   "share": round(peers.get(ip, 0) / total, 4),
+                   "expected": round(w / weight_total, 4)}
+              for ip, w in ip_weights}
+    return {"nics": shares,
+            # largest deviation from the configured share, in percentage points
+            "distribution_error_pp": round(max(abs(s["share"] - s["expected"]) for s in shares.values()) * 100, 2)}
+
+
+# ---------------------------------------------------------------------
+# Reporting
+# ---------------------------------------------------------------------
+_COMPARED = ("throughput_mbps", "cpu_s_per_gb", "conn_per_s", "ttfb_p50_ms", "ttfb_p99_ms",
+             "distribution_error_pp", "proxy_peak_rss_kb")
+
+
+def _key(r: Dict) -> tuple:
+    return r["scenario"], r.get("relay"), r["engine"], r.get("scheduler")
+
+
+def compare(old: List[Dict], new: List[Dict]):
+    """Print the relative change of each metric against an earlier run."""
+    before = {_key(r): r for r in old}
+    for r in new:
+        o = before.get(_key(r))
+        if o is None:
+            continue
+        changes = []
+        for m in _COMPARED:
+            if o.get(m) and r.get(m) is not None:
+                changes.append(f"{m} {(r[m] - o[m]) / o[m] * 100:+.1f}%")
+        print(f"{'/'.join(str(k) for k in _key(r) if k)}: " + ", ".join(changes))
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark multipath_proxy")
+    p.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=SCENARIOS,
+                   help="What to run (default: all)")
+    p.add_argument("--size-mb", type=int, default=1024, help="bulk: total bytes to download per mode (MiB)")
+    p.add_argument("--streams", type=int, default=1, help="bulk: parallel download streams")
+    p.add_argument("--modes", nargs="+", default=None, choices=("copy", "splice"),
+                   help="bulk: relay modes to compare (default: every mode available here)")
+    p.add_argument("--nics", type=int, default=3, help="connect/http: loopback NICs 127.0.0.1..N (default 3)")
+    p.add_argument("--weights", type=int, nargs="+", default=None,
+                   help="connect/http: NIC weights (default 1 2 3 ...)")
+    p.add_argument("--requests", type=int, default=2000, help="connect/http: connections to make (default 2000)")
+    p.add_argument("--concurrency", type=int, default=16, help="connect/http: parallel clients (default 16)")
+    p.add_argument("--response-bytes", type=int, default=1024,
+                   help="connect/http: bytes fetched per connection (default 1024)")
+    p.add_argument("--engine", choices=multipath_proxy.ENGINES, default="threads")
+    p.add_argument("--scheduler", choices=tuple(multipath_proxy.SCHEDULERS), default="wrr")
+    p.add_argument("--json", metavar="PATH", help="Also write the results to a JSON file")
+    p.add_argument("--compare", metavar="PATH", help="Print the change against an earlier --json file")
+    args = p.parse_args()
+
+    results = []
+    if "bulk" in args.scenarios:
+        modes = args.modes or (["copy", "splice"] if multipath_proxy._SPLICE_AVAILABLE else ["copy"])
+        size = args.size_mb * 1024 * 1024
+        print(f"{'relay':8} {'streams':>7} {'MB':>8} {'Mb/s':>10} {'CPU s':>8} {'CPU s/GB':>9} {'RSS MB':>7}")
+        for mode in modes:
+            r = run_relay_bench(mode, size, args.streams, args.engine)
+            results.append(r)
+            print(f"{r['relay']:8} {r['streams']:7d} {r['bytes'] / 1e6:8.0f} "
+                  f"{r['throughput_mbps']:10.1f} {r['proxy_cpu_s']:8.2f} {r['cpu_s_per_gb']:9.3f} "
+                  f"{(r['proxy_peak_rss_kb'] or 0) / 1024:7.1f}")
+    load = [s for s in args.scenarios if s != "bulk"]
+    if load:
+        weights = args.weights or list(range(1, args.nics + 1))
+        if len(weights) != args.nics:
+            p.error("--weights needs one value per NIC")
+        ip_weights = list(zip(loopback_nics(args.nics), weights))
+        print(f"{'scenario':8} {'conn/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>6} {'dist pp':>7} "
+              f"{'CPU s':>7} {'RSS MB':>7}")
+        for protocol in load:
+            r = run_load_bench(protocol, ip_weights, args.requests, args.concurrency,
+                               args.response_bytes, args.engine, args.scheduler)
+            results.append(r)
+            print(f"{protocol:8} {r['conn_per_s']:8.1f} {r['ttfb_p50_ms'] or 0:8.3f} {r['ttfb_p99_ms'] or 0:8.3f} "
+                  f"{r['errors']:6d} {r['distribution_error_pp']:7.2f} {r['proxy_cpu_s']:7.2f} "
+                  f"{(r['proxy_peak_rss_kb'] or 0) / 1024:7.1f}")
+            print("         " + "  ".join(f"{ip} {s['share']:.1%} (want {s['expected']:.1%})"
+                                          for ip, s in r["nics"].items()))
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f)["results"], results)
+    if args.json:
+        meta = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                "platform": platform.platform(), "cpus": os.cpu_count(), "args": vars(args)}
+        with open(args.json, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,11 +4,45 @@ import subprocess
 import threading
 import socket
 import re
+import ipaddress
+import time
+from collections import deque
 import customtkinter as ctk
 from tkinter import messagebox
 import psutil
-import time
 from nic_bar_graph import BarGraph, MiniLineGraph
+from nic_sampler import NICSampler
+from multipath_proxy import AUTO_WEIGHT_MODES, PROFILE_PRESETS, SCHEDULERS, MultiNICSOCKSProxy, SocketProfile
+
+ENGINE_GO = "go-dispatch-proxy"
+ENGINE_PYTHON = "Python (multipath_proxy)"
+# MultiNICSOCKSProxy on background threads of the GUI process: no subprocess,
+# stats come from proxy.metrics instead of parsed output
+ENGINE_INPROC = "Python (in-process)"
+PYTHON_ENGINES = (ENGINE_PYTHON, ENGINE_INPROC)
+
+# "[HEALTH] <ip> <state>" lines printed by multipath_proxy.NICHealth
+HEALTH_LINE = re.compile(r"\[HEALTH\] (\S+) (up|down|probing)\b")
+HEALTH_COLORS = {"up": "#2ECC71", "probing": "#F39C12", "down": "#E74C3C"}
+
+# Output log: reader threads append to a deque, one Tk callback per
+# LOG_FLUSH_MS inserts everything queued, and the textbox keeps at most
+# LOG_MAX_LINES lines. The queue is bounded the same way, so a flood (or a
+# long pause) drops the oldest lines instead of growing memory.
+LOG_FLUSH_MS = 100
+LOG_MAX_LINES = 5000
+LOG_LEVEL = re.compile(r"\[(INFO|WARN|ERR|HEALTH)\]")
+# lines without a level tag (GUI messages) are always shown
+LOG_FILTERS = {"All": None, "Warnings": ("WARN", "ERR", "HEALTH"), "Errors": ("ERR",)}
+
+# NIC counters are sampled by a background thread every STATS_INTERVAL
+# seconds; the stats panel redraws at the same pace
+STATS_INTERVAL = 0.5
+# top talkers panel (in-process engine): sketch size per NIC, rows shown per
+# NIC and refresh period in seconds
+TALKERS_CAPACITY = 64
+TALKERS_SHOWN = 5
+TALKERS_INTERVAL = 2.0
 
 class GoDispatchProxyGUI(ctk.CTk):
     def __init__(self):
@@ -25,8 +59,15 @@ class GoDispatchProxyGUI(ctk.CTk):
         
         # State variables
         self.proxy_process = None
+        self.inproc_proxy = None
         self.running = False
         self.selected_ips = []
+        # NIC health reported by the Python engine ("[HEALTH] <ip> <state>"), keyed by IP
+        self.nic_health = {}
+        # open connections per proxy IP (in-process engine only)
+        self.nic_conns = {}
+        self.ip_to_nic = {}
+        self.log_queue = deque(maxlen=LOG_MAX_LINES)
         
         # Create the main layout
         self.create_layout()
@@ -35,10 +76,12 @@ class GoDispatchProxyGUI(ctk.CTk):
         self.load_ip_addresses()
         
         # Initialize NIC statistics and start update loop
-        self.nic_prev_counters = {}
-        self.last_stats_time = time.time()
+        self.sampler = NICSampler(STATS_INTERVAL)
+        self.sampler.start()
+        self.stats_seq = -1
         self.nic_stat_labels = {}
         self.update_nic_stats()
+        self.flush_output()
         
         # Handle window close event
         self.protocol("WM_DELETE_WINDOW", self.on_closing)
@@ -105,6 +148,53 @@ class GoDispatchProxyGUI(ctk.CTk):
         quiet_switch = ctk.CTkSwitch(options_frame, text="Quiet Mode", variable=self.quiet_var)
         quiet_switch.grid(row=2, column=1, padx=5, pady=5, sticky="w")
         
+        # Engine: go-dispatch-proxy.exe or the Python multipath_proxy.py
+        ctk.CTkLabel(options_frame, text="Engine:").grid(row=3, column=0, padx=5, pady=5, sticky="w")
+        self.engine_var = ctk.StringVar(value=ENGINE_GO)
+        engine_menu = ctk.CTkOptionMenu(
+            options_frame,
+            values=[ENGINE_GO, ENGINE_PYTHON, ENGINE_INPROC],
+            variable=self.engine_var,
+            command=self.on_engine_change
+        )
+        engine_menu.grid(row=3, column=1, padx=5, pady=5, sticky="ew")
+        
+        # NIC scheduler (Python engine only)
+        ctk.CTkLabel(options_frame, text="Scheduler:").grid(row=4, column=0, padx=5, pady=5, sticky="w")
+        self.scheduler_var = ctk.StringVar(value="wrr")
+        self.scheduler_menu = ctk.CTkOptionMenu(
+            options_frame,
+            values=list(SCHEDULERS),
+            variable=self.scheduler_var,
+            state="disabled"
+        )
+        self.scheduler_menu.grid(row=4, column=1, padx=5, pady=5, sticky="ew")
+        
+        # Adaptive weights (Python engine only): sliders act as priors or caps
+        ctk.CTkLabel(options_frame, text="Auto weights:").grid(row=5, column=0, padx=5, pady=5, sticky="w")
+        self.auto_weights_var = ctk.StringVar(value="off")
+        self.auto_weights_menu = ctk.CTkOptionMenu(
+            options_frame,
+            values=list(AUTO_WEIGHT_MODES),
+            variable=self.auto_weights_var,
+            state="disabled"
+        )
+        self.auto_weights_menu.grid(row=5, column=1, padx=5, pady=5, sticky="ew")
+        
+        # Bandwidth caps in Mb/s (Python engine only, empty = unlimited);
+        # per-NIC caps are set next to each NIC's weight slider
+        ctk.CTkLabel(options_frame, text="Client cap (Mb/s):").grid(row=6, column=0, padx=5, pady=5, sticky="w")
+        self.client_rate_var = ctk.StringVar(value="")
+        self.client_rate_entry = ctk.CTkEntry(options_frame, textvariable=self.client_rate_var,
+                                              placeholder_text="unlimited", state="disabled")
+        self.client_rate_entry.grid(row=6, column=1, padx=5, pady=5, sticky="ew")
+        
+        ctk.CTkLabel(options_frame, text="Bulk cap (Mb/s):").grid(row=7, column=0, padx=5, pady=5, sticky="w")
+        self.bulk_rate_var = ctk.StringVar(value="")
+        self.bulk_rate_entry = ctk.CTkEntry(options_frame, textvariable=self.bulk_rate_var,
+                                            placeholder_text="unlimited", state="disabled")
+        self.bulk_rate_entry.grid(row=7, column=1, padx=5, pady=5, sticky="ew")
+        
         # Interface list label
         interfaces_label = ctk.CTkLabel(self.left_frame, text="Available physical interfaces:", anchor="w")
         interfaces_label.grid(row=3, column=0, padx=10, pady=(20, 5), sticky="w")
@@ -171,6 +261,7 @@ class GoDispatchProxyGUI(ctk.CTk):
         self.right_frame.grid_rowconfigure(0, weight=0)  # Title
         self.right_frame.grid_rowconfigure(1, weight=3)  # Output textbox
         self.right_frame.grid_rowconfigure(2, weight=2)  # Stats panel
+        self.right_frame.grid_rowconfigure(3, weight=1)  # Top talkers
         
         # Panel title
         output_title = ctk.CTkLabel(
@@ -179,6 +270,15 @@ class GoDispatchProxyGUI(ctk.CTk):
             font=ctk.CTkFont(size=16, weight="bold")
         )
         output_title.grid(row=0, column=0, padx=10, pady=10, sticky="w")
+
+        # Level filter and pause for the output log
+        log_controls = ctk.CTkFrame(self.right_frame, fg_color="transparent")
+        log_controls.grid(row=0, column=0, padx=10, pady=10, sticky="e")
+        self.log_filter_var = ctk.StringVar(value="All")
+        ctk.CTkOptionMenu(log_controls, values=list(LOG_FILTERS), variable=self.log_filter_var,
+                          width=110).grid(row=0, column=0, padx=5)
+        self.log_pause_var = ctk.BooleanVar(value=False)
+        ctk.CTkSwitch(log_controls, text="Pause", variable=self.log_pause_var).grid(row=0, column=1, padx=5)
         
         # Textbox for output
         self.output_textbox = ctk.CTkTextbox(self.right_frame, wrap="word")
@@ -202,9 +302,38 @@ class GoDispatchProxyGUI(ctk.CTk):
         self.stats_content = ctk.CTkScrollableFrame(self.stats_frame)
         self.stats_content.grid(row=1, column=0, sticky="nsew")
         self.stats_content.grid_columnconfigure(0, weight=1)
+
+        # --- Top talkers panel (in-process engine only) ---
+        talkers_frame = ctk.CTkFrame(self.right_frame)
+        talkers_frame.grid(row=3, column=0, padx=10, pady=(0, 10), sticky="nsew")
+        talkers_frame.grid_columnconfigure(0, weight=1)
+        talkers_frame.grid_rowconfigure(1, weight=1)
+        talkers_title = ctk.CTkLabel(
+            talkers_frame,
+            text="Top talkers",
+            font=ctk.CTkFont(size=14, weight="bold")
+        )
+        talkers_title.grid(row=0, column=0, padx=5, pady=2, sticky="w")
+        self.talkers_textbox = ctk.CTkTextbox(talkers_frame, wrap="none", height=90,
+                                              font=ctk.CTkFont(family="Courier", size=11))
+        self.talkers_textbox.grid(row=1, column=0, padx=5, pady=(0, 5), sticky="nsew")
+        self.talkers_text = None
+        self.talkers_next = 0.0
+        self.show_talkers("Destination hosts and clients per NIC, with the in-process engine.")
     
     def change_theme(self, theme):
-        ctk.set_appearance_mode(theme)    
+        ctk.set_appearance_mode(theme)
+
+    def on_engine_change(self, engine):
+        """Scheduler, auto-weight, bandwidth cap and socket profile settings only apply to the Python engines"""
+        state = "normal" if engine in PYTHON_ENGINES else "disabled"
+        self.scheduler_menu.configure(state=state)
+        self.auto_weights_menu.configure(state=state)
+        self.client_rate_entry.configure(state=state)
+        self.bulk_rate_entry.configure(state=state)
+        for entry in self.nic_rate_entries + self.nic_profile_menus:
+            entry.configure(state=state)
+    
     def load_ip_addresses(self):
         # Clear existing checkboxes
         for checkbox in self.ip_checkboxes:
@@ -212,18 +341,24 @@ class GoDispatchProxyGUI(ctk.CTk):
         
         self.ip_vars = []
         self.ip_checkboxes = []
+        self.nic_rate_entries = []
+        self.nic_profile_menus = []
+        rate_state = "normal" if self.engine_var.get() in PYTHON_ENGINES else "disabled"
         
         try:
             # Get local IP addresses with interface name
             interfaces = self.get_network_interfaces()
             # Store physical NIC names for stats filtering
             self.physical_nics = [name for _, name in interfaces]
+            self.ip_to_nic = {ip: name for ip, name in interfaces}
             
             # Create a checkbox + Spinbox for each IP address
             for i, (ip, interface_name) in enumerate(interfaces):
                 var = ctk.BooleanVar(value=False)
                 weight_var = ctk.IntVar(value=1)
-                self.ip_vars.append((var, ip, weight_var))
+                rate_var = ctk.StringVar(value="")
+                profile_var = ctk.StringVar(value="default")
+                self.ip_vars.append((var, ip, weight_var, rate_var, profile_var))
 
                 # Frame for checkbox + slider
                 row_frame = ctk.CTkFrame(self.ip_scrollable_frame)
@@ -258,6 +393,18 @@ class GoDispatchProxyGUI(ctk.CTk):
                 # Synchronize label when slider value changes
                 weight_slider.configure(command=lambda value, wv=weight_var, vl=value_label: slider_callback(value, wv, vl))
 
+                # Bandwidth cap for this NIC in Mb/s (Python engine only)
+                rate_entry = ctk.CTkEntry(row_frame, textvariable=rate_var, width=60,
+                                          placeholder_text="Mb/s", state=rate_state)
+                rate_entry.grid(row=0, column=3, padx=(8,0), sticky="e")
+                self.nic_rate_entries.append(rate_entry)
+
+                # Socket tuning preset for this NIC's link type (Python engine only)
+                profile_menu = ctk.CTkOptionMenu(row_frame, values=list(PROFILE_PRESETS), variable=profile_var,
+                                                 width=90, state=rate_state)
+                profile_menu.grid(row=0, column=4, padx=(8,0), sticky="e")
+                self.nic_profile_menus.append(profile_menu)
+
                 self.ip_checkboxes.append(row_frame)
             
             # If there are no interfaces
@@ -295,11 +442,15 @@ class GoDispatchProxyGUI(ctk.CTk):
                     # Exclude common virtual interfaces
                     if not self.is_virtual_interface(interface):
                         for addr in addrs:
-                            # Consider only IPv4 addresses
-                            if addr.family == socket.AF_INET:
+                            # IPv4 and IPv6 addresses (IPv6 is used by the Python engine only)
+                            if addr.family in (socket.AF_INET, socket.AF_INET6):
                                 # Exclude loopback and link-local addresses
-                                ip = addr.address
-                                if not (ip.startswith('127.') or ip.startswith('169.254.')):
+                                ip = addr.address.split('%')[0]
+                                try:
+                                    parsed = ipaddress.ip_address(ip)
+                                except ValueError:
+                                    continue
+                                if not (parsed.is_loopback or parsed.is_link_local):
                                     interfaces.append((ip, interface))
             
             # If we don't find interfaces, try the proxy -list command
@@ -350,31 +501,76 @@ class GoDispatchProxyGUI(ctk.CTk):
         # Mark that any future process termination is not intentional until user stops it
         self._intentional_stop = False
         # Extract selected interfaces and weights
-        selected_items = [(ip, weight_var.get()) for var, ip, weight_var in self.ip_vars if var.get()]
+        selected_items = [(ip, weight_var.get()) for var, ip, weight_var, _, _ in self.ip_vars if var.get()]
 
         if not selected_items:
             messagebox.showerror("Error", "Select at least one IP address!")
             return
 
         # Prepare command
-        command = ["go-dispatch-proxy.exe"]
+        engine = self.engine_var.get()
+        python_engine = engine in PYTHON_ENGINES
+        if not python_engine:
+            ipv6 = [ip for ip, _ in selected_items if ':' in ip]
+            if ipv6:
+                self.update_output(f"IPv6 addresses need the Python engine, skipping: {', '.join(ipv6)}\n")
+                selected_items = [item for item in selected_items if ':' not in item[0]]
+                if not selected_items:
+                    messagebox.showerror("Error", "go-dispatch-proxy only supports IPv4 addresses.\n"
+                                         "Select an IPv4 address or switch to the Python engine.")
+                    return
+        if python_engine:
+            try:
+                nic_rates = {ip: float(rate_var.get()) for var, ip, _, rate_var, _ in self.ip_vars
+                             if var.get() and rate_var.get().strip()}
+                client_rate = float(self.client_rate_var.get() or 0)
+                bulk_rate = float(self.bulk_rate_var.get() or 0)
+            except ValueError:
+                messagebox.showerror("Error", "Bandwidth caps must be numbers in Mb/s (leave empty for unlimited).")
+                return
+            if engine == ENGINE_PYTHON and getattr(sys, "frozen", False):
+                messagebox.showerror("Error", "The Python engine needs multipath_proxy.py and a Python interpreter;\n"
+                                     "it is not available in the packaged executable. Use the in-process engine.")
+                return
+            script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "multipath_proxy.py")
+            # -u: unbuffered, so read_output sees log lines as they are printed
+            command = [sys.executable, "-u", script]
+            if self.lhost_var.get():
+                command.extend(["--lhost", self.lhost_var.get()])
+            if self.lport_var.get():
+                command.extend(["--lport", self.lport_var.get()])
+            command.extend(["--scheduler", self.scheduler_var.get()])
+            command.extend(["--auto-weights", self.auto_weights_var.get()])
+            if nic_rates:
+                command.extend(["--nic-rate", ",".join(f"{ip}={rate}" for ip, rate in nic_rates.items())])
+            if client_rate > 0:
+                command.extend(["--client-rate", str(client_rate)])
+            if bulk_rate > 0:
+                command.extend(["--bulk-rate", str(bulk_rate)])
+            if self.quiet_var.get():
+                command.append("--quiet")
+        else:
+            command = ["go-dispatch-proxy.exe"]
 
-        # Add options first (before IP addresses)
-        if self.lhost_var.get():
-            command.extend(["-lhost", self.lhost_var.get()])
+            # Add options first (before IP addresses)
+            if self.lhost_var.get():
+                command.extend(["-lhost", self.lhost_var.get()])
 
-        if self.lport_var.get():
-            command.extend(["-lport", self.lport_var.get()])
+            if self.lport_var.get():
+                command.extend(["-lport", self.lport_var.get()])
 
-        if self.tunnel_var.get():
-            command.append("-tunnel")
-        
-        if self.quiet_var.get():
-            command.append("-quiet")
+            if self.tunnel_var.get():
+                command.append("-tunnel")
+            
+            if self.quiet_var.get():
+                command.append("-quiet")
 
         # Add interface-specific arguments (IP[@weight] format) after options
+        profiles = {ip: profile_var.get() for _, ip, _, _, profile_var in self.ip_vars}
         for ip, weight in selected_items:
             arg = f"{ip}@{weight}" if weight != 1 else ip  # weight 1 can be omitted
+            if python_engine and profiles.get(ip, "default") != "default":
+                arg += f"/{profiles[ip]}"
             command.append(arg)
         
 
@@ -384,8 +580,16 @@ class GoDispatchProxyGUI(ctk.CTk):
                 messagebox.showerror("Port in use", f"The port {self.lport_var.get()} is already in use.\nChoose another port or stop the program using it.")
                 return
 
+        if engine == ENGINE_INPROC:
+            self.start_inproc_proxy(selected_items, profiles, nic_rates, client_rate, bulk_rate)
+            return
+
         # --- Kill any existing go-dispatch-proxy.exe processes (zombie) ---
-        self.kill_existing_proxy_processes()
+        if not python_engine:
+            self.kill_existing_proxy_processes()
+
+        # The Python engine reports per-NIC health; every selected NIC starts "up"
+        self.nic_health = {ip: "up" for ip, _ in selected_items} if python_engine else {}
 
         try:
             # Update the interface to show that we are starting the proxy
@@ -422,9 +626,48 @@ class GoDispatchProxyGUI(ctk.CTk):
             self.update_output(f"Unable to start proxy: {str(e)}")
             messagebox.showerror("Error", f"Unable to start proxy: {str(e)}")
     
+    def start_inproc_proxy(self, selected_items, profiles, nic_rates, client_rate, bulk_rate):
+        """Run MultiNICSOCKSProxy on background threads of the GUI process."""
+        mbit = 1_000_000 / 8  # Mb/s to bytes/s
+        shaping = None
+        if nic_rates or client_rate > 0 or bulk_rate > 0:
+            shaping = {"nic_rates": {ip: rate * mbit for ip, rate in nic_rates.items()},
+                       "client_rate": client_rate * mbit, "bulk_rate": bulk_rate * mbit}
+        try:
+            proxy = MultiNICSOCKSProxy(
+                self.lhost_var.get() or "127.0.0.1", int(self.lport_var.get() or 8080),
+                selected_items, quiet=self.quiet_var.get(),
+                scheduler=self.scheduler_var.get(), auto_weights=self.auto_weights_var.get(),
+                shaping=shaping,
+                profiles={ip: SocketProfile.parse(profiles[ip]) for ip, _ in selected_items
+                          if profiles.get(ip, "default") != "default"},
+                top_talkers=TALKERS_CAPACITY,
+                log=lambda line: self.update_output(line + "\n"))
+            proxy.start()
+        except (OSError, ValueError) as e:
+            self.update_output(f"Unable to start proxy: {e}\n")
+            messagebox.showerror("Error", f"Unable to start proxy: {e}")
+            return
+        self.inproc_proxy = proxy
+        self.running = True
+        self.start_button.configure(text="Stop Proxy", fg_color="#C41E3A", hover_color="#E32636")
+
     def stop_proxy(self):
         # Indicate that we are intentionally stopping the proxy so read_output won't treat it as crash
         self._intentional_stop = True
+        if self.inproc_proxy is not None:
+            proxy, self.inproc_proxy = self.inproc_proxy, None
+            try:
+                proxy.stop()
+            except Exception as e:
+                self.update_output(f"\nError stopping proxy: {str(e)}")
+            self.clear_output()
+            self.update_output("Proxy stopped.\n")
+            self.running = False
+            self.nic_health = {}
+            self.nic_conns = {}
+            self.start_button.configure(text="Start Proxy", fg_color=["#3B8ED0", "#1F6AA5"], hover_color=["#36719F", "#144870"])
+            return
         if self.proxy_process:
             try:
                 # Terminate the process
@@ -446,6 +689,7 @@ class GoDispatchProxyGUI(ctk.CTk):
                 # Reset state
                 self.running = False
                 self.proxy_process = None
+                self.nic_health = {}
                 self.start_button.configure(text="Start Proxy", fg_color=["#3B8ED0", "#1F6AA5"], hover_color=["#36719F", "#144870"])
     
     def read_output(self):
@@ -456,6 +700,10 @@ class GoDispatchProxyGUI(ctk.CTk):
         while self.proxy_process.poll() is None:  # While the process is running
             line = self.proxy_process.stdout.readline()
             if line:
+                match = HEALTH_LINE.match(line)
+                if match:
+                    # nic_health is only touched on the Tk thread
+                    self.after(0, self.set_nic_health, match.group(1), match.group(2))
                 self.update_output(line)
         
         # Read any remaining output
@@ -467,6 +715,7 @@ class GoDispatchProxyGUI(ctk.CTk):
         if self.running and not getattr(self, "_intentional_stop", False):
             self.running = False
             self.proxy_process = None
+            self.after(0, self.nic_health.clear)
             
             # Update the button in the user interface (thread-safe)
             self.after(0, lambda: self.start_button.configure(
@@ -478,17 +727,33 @@ class GoDispatchProxyGUI(ctk.CTk):
             self.update_output("\nThe proxy has unexpectedly stopped.\n")
     
     def update_output(self, text):
-        """Update the output textbox in a thread-safe manner"""
-        def _update():
-            self.output_textbox.configure(state="normal")
-            self.output_textbox.insert("end", text)
-            self.output_textbox.see("end")
-            self.output_textbox.configure(state="disabled")
-        # Ensure that the interface update happens in the main thread
-        self.after(0, _update)
+        """Queue text for the output textbox; safe from any thread (flush_output inserts it)"""
+        self.log_queue.append(text)
+
+    def flush_output(self):
+        """Insert everything queued since the last flush in one batch, then trim the textbox."""
+        queue = self.log_queue
+        if queue and not self.log_pause_var.get():
+            chunks = [queue.popleft() for _ in range(len(queue))]
+            text = "".join(chunks)
+            levels = LOG_FILTERS.get(self.log_filter_var.get())
+            if levels:
+                text = "".join(line for line in text.splitlines(keepends=True)
+                               if not (m := LOG_LEVEL.search(line)) or m.group(1) in levels)
+            if text:
+                box = self.output_textbox
+                box.configure(state="normal")
+                box.insert("end", text)
+                lines = int(box.index("end-1c").split(".")[0])
+                if lines > LOG_MAX_LINES:
+                    box.delete("1.0", f"{lines - LOG_MAX_LINES + 1}.0")
+                box.see("end")
+                box.configure(state="disabled")
+        self.after(LOG_FLUSH_MS, self.flush_output)
 
     def clear_output(self):
         """Clear the proxy output textbox in a thread-safe way"""
+        self.log_queue.clear()
         def _clear():
             self.output_textbox.configure(state="normal")
             self.output_textbox.delete("1.0", "end")
@@ -499,13 +764,13 @@ class GoDispatchProxyGUI(ctk.CTk):
     # NIC statistics update
     # --------------------------------------------------
     def update_nic_stats(self):
-        """Update NIC statistics table every second (physical NICs only)."""
+        """Update the NIC statistics table from the sampler thread (physical NICs only)."""
         try:
-            counters = psutil.net_io_counters(pernic=True)
+            self.poll_engine_stats()
 
             # Build header once
             if not hasattr(self, "_stats_header_built"):
-                headers = ["Interface", "▲ Mb/s", "▼ Mb/s", "TX GB", "RX GB"]
+                headers = ["Interface", "▲ Mb/s", "▼ Mb/s", "TX GB", "RX GB", "Conns", "Health"]
                 for col, text in enumerate(headers):
                     lbl = ctk.CTkLabel(self.stats_content, text=text, font=ctk.CTkFont(size=12, weight="bold"))
                     lbl.grid(row=0, column=col, padx=4, pady=(0,2), sticky="w" if col==0 else "e")
@@ -516,18 +781,14 @@ class GoDispatchProxyGUI(ctk.CTk):
 
             row_idx = 1  # start after header
             nic_index = 0
+            # graphs only move when the sampler has something new
+            seq = self.sampler.seq
+            new_sample, self.stats_seq = seq != self.stats_seq, seq
             for nic in getattr(self, "physical_nics", []):
-                data = counters.get(nic)
+                data = self.sampler.latest(nic)
                 if data is None:
                     continue
-
-                prev_sent, prev_recv = self.nic_prev_counters.get(nic, (data.bytes_sent, data.bytes_recv))
-                elapsed = max(time.time() - self.last_stats_time, 1e-6)
-                up_rate = (data.bytes_sent - prev_sent) * 8 / 1_000_000 / elapsed
-                down_rate = (data.bytes_recv - prev_recv) * 8 / 1_000_000 / elapsed
-
-                # Store current counters for next calculation
-                self.nic_prev_counters[nic] = (data.bytes_sent, data.bytes_recv)
+                up_rate, down_rate, bytes_sent, bytes_recv = data
 
                 # Create or update labels for this NIC
                 if nic not in self.nic_stat_labels:
@@ -562,39 +823,110 @@ class GoDispatchProxyGUI(ctk.CTk):
                     rx_lbl = ctk.CTkLabel(self.stats_content, text="0.0", font=ctk.CTkFont(size=11))
                     rx_lbl.grid(row=row_idx, column=4, padx=4, pady=1, sticky="e")
 
+                    # Open proxy connections (in-process engine only)
+                    conns_lbl = ctk.CTkLabel(self.stats_content, text="–", font=ctk.CTkFont(size=11))
+                    conns_lbl.grid(row=row_idx, column=5, padx=4, pady=1, sticky="e")
+
+                    # Circuit-breaker state (Python engine only)
+                    health_lbl = ctk.CTkLabel(self.stats_content, text="–", font=ctk.CTkFont(size=11))
+                    health_lbl.grid(row=row_idx, column=6, padx=4, pady=1, sticky="e")
+
                     self.nic_stat_labels[nic] = {
                         'name': name_lbl, 'up': up_lbl, 'down': down_lbl, 
-                        'tx': tx_lbl, 'rx': rx_lbl, 'bar': bar_graph, 'line': line_graph
+                        'tx': tx_lbl, 'rx': rx_lbl, 'conns': conns_lbl, 'health': health_lbl,
+                        'bar': bar_graph, 'line': line_graph, 'texts': {}
                     }
 
-                # Update values
+                # Update values (labels are only reconfigured when their text changes)
                 labels = self.nic_stat_labels[nic]
-                labels['up'].configure(text=f"{up_rate:.1f}")
-                labels['down'].configure(text=f"{down_rate:.1f}")
-                labels['tx'].configure(text=f"{data.bytes_sent / 1_000_000_000:.1f}")
-                labels['rx'].configure(text=f"{data.bytes_recv / 1_000_000_000:.1f}")
+                conns = [n for ip, n in self.nic_conns.items() if self.ip_to_nic.get(ip) == nic]
+                health = self.nic_health_state(nic)
+                texts = {
+                    'up': f"{up_rate:.1f}",
+                    'down': f"{down_rate:.1f}",
+                    'tx': f"{bytes_sent / 1_000_000_000:.1f}",
+                    'rx': f"{bytes_recv / 1_000_000_000:.1f}",
+                    'conns': str(sum(conns)) if conns else "–",
+                    'health': health or "–",
+                }
+                for key, text in texts.items():
+                    if labels['texts'].get(key) != text:
+                        labels['texts'][key] = text
+                        if key == 'health':
+                            labels[key].configure(text=text, text_color=HEALTH_COLORS.get(health, ["gray10", "#DCE4EE"]))
+                        else:
+                            labels[key].configure(text=text)
                 
                 # Update graphs
-                labels['bar'].set_value(down_rate, 100.0)
-                labels['line'].add_value(down_rate, 100.0)
+                if new_sample:
+                    labels['bar'].set_value(down_rate, 100.0)
+                    line = labels['line']
+                    times, rates = self.sampler.history(nic, line.max_points)
+                    line.set_series(times, rates, line.max_points * STATS_INTERVAL, 100.0)
 
                 row_idx += 2  # Skip one row for bar graph
                 nic_index += 1
 
-            # Update timestamp for next calculation
-            self.last_stats_time = time.time()
-
         except Exception as e:
             self.update_output(f"[NIC stats error] {e}\n")
         
-        self.after(1000, self.update_nic_stats)
+        self.after(int(STATS_INTERVAL * 1000), self.update_nic_stats)
 
     
     # ----------------------- Helper methods -----------------------
+    def poll_engine_stats(self):
+        """Per-IP connections and health straight from the in-process proxy."""
+        if self.inproc_proxy is None:
+            self.nic_conns = {}
+            return
+        nics = self.inproc_proxy.metrics.nics()
+        self.nic_conns = {n["ip"]: n["active"] for n in nics}
+        self.nic_health = {n["ip"]: n["health"] for n in nics}
+        now = time.monotonic()
+        if now >= self.talkers_next and self.inproc_proxy.talkers is not None:
+            self.talkers_next = now + TALKERS_INTERVAL
+            self.show_talkers(self.format_talkers(self.inproc_proxy.talkers.top(TALKERS_SHOWN)))
+
+    def format_talkers(self, top):
+        """One block per NIC: hosts and clients side by side, in MB (recent traffic weighs most)."""
+        lines = []
+        for nic in top:
+            if not nic["hosts"]:
+                continue
+            lines.append(f"{nic['ip']} ({self.ip_to_nic.get(nic['ip'], '?')})")
+            for k in range(max(len(nic["hosts"]), len(nic["clients"]))):
+                host = nic["hosts"][k] if k < len(nic["hosts"]) else ("", 0, 0)
+                client = nic["clients"][k] if k < len(nic["clients"]) else ("", 0, 0)
+                lines.append(f"  {host[0][:32]:<32} {host[1] / 1e6:8.1f}   {client[0][:20]:<20} {client[1] / 1e6:8.1f}")
+        return "\n".join(lines) or "No traffic yet."
+
+    def show_talkers(self, text):
+        if text == self.talkers_text:
+            return
+        self.talkers_text = text
+        box = self.talkers_textbox
+        box.configure(state="normal")
+        box.delete("1.0", "end")
+        box.insert("end", text)
+        box.configure(state="disabled")
+
+    def set_nic_health(self, ip, state):
+        """Record a [HEALTH] transition parsed from the proxy output (Tk thread only)."""
+        self.nic_health[ip] = state
+
+    def nic_health_state(self, nic):
+        """Worst health state among the proxy IPs that belong to this NIC."""
+        states = [state for ip, state in self.nic_health.items() if self.ip_to_nic.get(ip) == nic]
+        for state in ("down", "probing", "up"):
+            if state in states:
+                return state
+        return None
+
     def is_port_in_use(self, host: str, port: int) -> bool:
         """Return True if the given host:port is already in use."""
         try:
-            test_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            family = socket.AF_INET6 if ':' in host else socket.AF_INET
+            test_sock = socket.socket(family, socket.SOCK_STREAM)
             test_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             test_sock.bind((host, port))
             test_sock.close()
@@ -616,6 +948,7 @@ class GoDispatchProxyGUI(ctk.CTk):
         """Handle application closing"""
         if self.running:
             self.stop_proxy()
+        self.sampler.stop()
         
         self.destroy()
 
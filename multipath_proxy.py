@@ -1,209 +1,4970 @@
-"""Simple multi-NIC SOCKS5 proxy (TCP only).
+"""Simple multi-NIC SOCKS5 and HTTP proxy.
 
 Run manually for quick test:
     python multipath_proxy.py -lhost 127.0.0.1 -lport 1080 192.168.225.100 172.20.10.2@2
 
-Positional arguments are "ip[@weight]" pairs. Weights default to 1.
+Positional arguments are "ip[@weight][/profile]" entries. Weights default to 1.
 
 For each outgoing connection the proxy chooses a source IP from the list
-provided at start() and binds() the socket accordingly. A round-robin
-algorithm with optional integer weights is used.
+provided at start() and binds() the socket accordingly. The choice is made
+by a pluggable scheduler (--scheduler):
+    wrr          - smooth weighted round-robin (default)
+    least-conn   - fewest active connections per unit of weight
+    least-bytes  - fewest bytes relayed by still-open connections per unit
+                   of weight, so long-lived downloads spread across NICs
 
-Only basic SOCKS5 (no authentication, CONNECT command) is implemented.
-This keeps the implementation lightweight and dependency-free.
+Only basic SOCKS5 (no authentication; CONNECT and UDP ASSOCIATE commands)
+is implemented.  This keeps the implementation lightweight and
+dependency-free.  Each UDP association gets a relay socket bound to a
+scheduled source IP; one shared selector thread moves the datagrams of
+every association (QUIC, DNS, games) and expires idle ones.
+
+The same port also serves HTTP/1.1 proxy clients, told apart by the first
+byte (0x05 for SOCKS5, an ASCII method name for HTTP).  CONNECT is
+tunnelled like a SOCKS5 CONNECT; absolute-URI requests (GET http://...)
+are forwarded over keep-alive upstream connections pooled per NIC.
+
+On Linux the thread engine relays TCP payloads with os.splice() through a
+kernel pipe so the data never enters userspace; other platforms (or
+--relay copy) use a portable recv_into()/send() loop over pooled buffers.
+Both honour backpressure and half-close: an EOF from one side is passed
+on with shutdown(SHUT_WR) while the other direction keeps flowing.
+
+Domain names (SOCKS atyp 3) are resolved by DNSResolver: an LRU cache with
+per-record TTLs and negative caching, where concurrent lookups of the same
+name share a single query.  It uses the system resolver by default or
+queries a given DNS server directly over UDP (--dns-server).
+
+With --hedge-delay the upstream connect is hedged (happy-eyeballs style):
+if the scheduled NIC has not completed the TCP handshake within the delay,
+a second attempt starts on another NIC and whichever connects first is
+kept, so one slow or lossy link no longer stalls a connection for the full
+connect timeout.
+
+NICHealth tracks every source IP with a circuit breaker: real connect
+errors that point at the path (timeouts, unreachable network, address not
+available) and optional active probes (--probe-target) open the breaker
+and take the NIC out of rotation; after a cooldown it is tried again and
+a success brings it back.  Transitions are logged as
+    [HEALTH] <ip> up|down|probing
+
+With --auto-weights the NIC weights follow what the links deliver:
+AdaptiveWeights keeps an EWMA of each NIC's relayed throughput and connect
+RTT and periodically rescales the scheduler weights to each link's
+measured capacity, treating the manual ip@weight values as priors or caps.
+
+With --affinity-ttl the (client IP, destination host) pair is pinned to
+one NIC through a weighted consistent-hash ring, so the connections of
+one session leave from the same public IP.  Adding or removing a NIC only
+moves the flows that hashed to it.
+
+Each NIC can carry a SocketProfile for its upstream sockets, written as
+ip@weight/profile: a preset (fibre, lte, satellite) and/or options for
+buffer sizes, congestion control, TCP Fast Open, keepalive and connect
+timeout, so a long-RTT link gets windows that fill its pipe and mobile
+links notice dead NAT mappings.
+
+Source IPs may be IPv4 or IPv6 and the listener may be "::" (dual-stack).
+SOCKS5 IPv6 targets (atyp 4) are supported and host names resolve to both
+A and AAAA records.  For hosts reachable over both families
+FamilyPreference tracks the connect time of each and leads with the
+faster one, falling back to the other family on failure.
+
+With --workers N the proxy forks N processes that all listen on the port
+with SO_REUSEPORT and the kernel balances clients across them.  Per-NIC
+load and health are kept in a shared-memory SharedNICTable so scheduling
+stays global; a supervisor restarts workers that die (POSIX only).
+
+Every proxy keeps Metrics: bytes per NIC and direction, connection and
+error counts, scheduler decisions and handshake/DNS/connect latency
+histograms.  Read them with proxy.metrics.snapshot() or, with
+--metrics-port, scrape them in the Prometheus text format.
+
+With --accelerate-hosts or --accelerate-min-size large plain-HTTP
+downloads are split across the NICs: RangeDownload fetches chunks over
+parallel Range requests (streams spread by NIC weight), reassembles them
+in order within a bounded window and lets idle streams steal the tail of
+chunks still in flight on slower links.  proxy.download(url, file) does
+the same from Python.
+
+With --nic-rate, --client-rate or --bulk-rate a Shaper caps bandwidth with
+token buckets per NIC, per client IP and for bulk connections.  Relays are
+charged once per chunk and pause reading while a bucket is empty, so
+senders are slowed by TCP flow control; connections past their first
+256 KiB count as bulk and leave a reserve for interactive ones.
+
+With --top-talkers N a TopTalkers sketch ranks destination hosts and client
+IPs by bytes per NIC: space-saving counters, at most N per NIC and kind,
+fed every 256 KiB a connection relays and decaying with a 30 s half-life.
+Read it with proxy.talkers.top() or at /talkers next to the metrics.
+
+With --access-log every upstream connection leaves one JSON line (client,
+destination, NIC, connect latency, bytes each way, duration, close
+reason).  Records are queued when a connection ends and written in
+batches by a background thread; the file rotates by size or age, and
+records are dropped rather than ever making a relay wait.
+
+Two engines are available:
+    threads  - one thread per client connection (default)
+    asyncio  - handshake, connect and relay run as coroutines on a single
+               event loop; use this for thousands of concurrent connections
 
 Tested on Windows 10+ and Python 3.9+.
 """
 from __future__ import annotations
 
-import socket
-import struct
-import threading
-import itertools
-import select
-from typing import List, Tuple
+import asyncio
+import bisect
+import errno
+import fnmatch
+import hashlib
+import os
+import random
+import socket
+import struct
+import sys
+import threading
+import itertools
+import json
+import mmap
+import signal
+import time
+import traceback
+import select
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Set, Tuple
+
+SOCKS_VERSION = 5
+
+ENGINES = ("threads", "asyncio")
+RELAY_MODES = ("auto", "copy", "splice")
+ADMISSION_MODES = ("queue", "reject")
+
+# SOCKS5 reply: general SOCKS server failure, bound address 0.0.0.0:0
+_REPLY_FAILURE = b"\x05\x01\x00\x01" + bytes(6)
+_CONNECT_TIMEOUT = 10
+# connect_ex() results that mean "handshake in progress" (10035 = WSAEWOULDBLOCK)
+_CONNECT_PENDING = {0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY, 10035}
+# how long stop() waits in total for connection threads/tasks to unwind
+_STOP_GRACE = 1.0
+# asyncio engine: how long a queued client may wait for a free slot
+_QUEUE_TIMEOUT = 30
+
+# os.splice() is Linux-only and appeared in Python 3.10
+_SPLICE_AVAILABLE = hasattr(os, "splice") and hasattr(os, "SPLICE_F_NONBLOCK")
+_SPLICE_CHUNK = 256 * 1024
+# copy relay: per-direction buffer sizes; a direction whose reads fill its
+# buffer moves up to the next size, so bulk flows end up with 256 KiB reads
+_COPY_SIZES = (16 * 1024, 64 * 1024, 256 * 1024)
+
+# asyncio engine tuning: StreamReader buffer limit per socket, relay chunk
+# size and idle timeout (same 60 s as the select() loop of the thread engine)
+_ASYNC_READ_LIMIT = 64 * 1024
+_ASYNC_CHUNK = 16 * 1024
+_ASYNC_BACKLOG = 1024
+_IDLE_TIMEOUT = 60
+# UDP associations without a datagram in either direction for this long are closed
+_UDP_IDLE_TIMEOUT = 120
+# socket buffers of the UDP relay: absorb bursts while the relay thread is busy
+_UDP_SOCKBUF = 4 * 1024 * 1024
+
+_CMD_CONNECT = 1
+_CMD_UDP_ASSOCIATE = 3
+
+
+def _family(ip: str) -> int:
+    """Address family of an IP literal."""
+    return socket.AF_INET6 if ":" in ip else socket.AF_INET
+
+
+def _normalize_ip(ip: str) -> str:
+    """Canonical text form, so "2001:db8:0::1" matches getsockname()."""
+    try:
+        return socket.inet_ntop(_family(ip), socket.inet_pton(_family(ip), ip))
+    except (OSError, ValueError):
+        return ip
+
+
+def _unmap(ip: str) -> str:
+    """Strip the ::ffff: prefix a dual-stack socket puts on IPv4 peers."""
+    return ip[7:] if ip.startswith("::ffff:") and "." in ip else ip
+
+
+def _socks5_addr(host: str, port: int) -> bytes:
+    """ATYP + address + port of a SOCKS5 reply or UDP header."""
+    if _family(host) == socket.AF_INET6:
+        return b"\x04" + socket.inet_pton(socket.AF_INET6, host) + struct.pack("!H", port)
+    return b"\x01" + socket.inet_aton(host) + struct.pack("!H", port)
+
+
+class _Lease:
+    """A connection's claim on a NIC, returned by NICScheduler.acquire()."""
+
+    __slots__ = ("ip", "index", "family", "bytes", "uploaded", "client", "host", "port",
+                 "connect_time", "started", "reason", "reported", "_sched")
+
+    def __init__(self, sched: "NICScheduler", index: int):
+        self._sched = sched
+        self.index = index
+        self.ip = sched.ips[index]
+        self.family = sched.families[index]
+        self.bytes = 0
+        self.uploaded = 0  # client -> destination part of bytes
+        self.client = ""  # client IP, set by the relay for per-client shaping
+        # destination, set once the upstream is connected (or has failed to)
+        self.host = ""
+        self.port = 0
+        self.connect_time: Optional[float] = None  # None: pooled connection or failed
+        self.started = time.monotonic()
+        self.reason = ""  # why the connection ended; empty means a normal close
+        self.reported = 0  # part of bytes already passed to TopTalkers
+
+    def add_bytes(self, n: int, upload: bool = False):
+        """Account n relayed bytes to this NIC; upload marks the client to
+        destination direction."""
+        self._sched._add_bytes(self, n, upload)
+
+    def fail(self, exc: BaseException):
+        """Record the first error that ends this connection (for the AccessLog)."""
+        if not self.reason:
+            self.reason = _error_cause(exc)
+
+    def release(self):
+        """Return the claim; call exactly once when the connection closes."""
+        self._sched._release(self)
+
+
+class NICScheduler:
+    """Base class of the source-IP selection strategies.
+
+    The base class keeps per-NIC load - active connections and bytes
+    relayed by still-open connections - under one lock, so acquire() is
+    safe from any number of client threads.  Subclasses only implement
+    _choose(candidates), which runs with the lock held and returns one of
+    the candidate indices into self.ips.
+    """
+
+    name = ""
+
+    def __init__(self, ip_weights: List[Tuple[str, int]]):
+        if not ip_weights:
+            raise ValueError("at least one source IP is required")
+        self.ips = [_normalize_ip(ip) for ip, _ in ip_weights]
+        # IPv4 and IPv6 source addresses can be mixed; acquire(family=...) picks one kind
+        self.families = [_family(ip) for ip in self.ips]
+        self._by_family: Dict[int, List[int]] = {}
+        for i, family in enumerate(self.families):
+            self._by_family.setdefault(family, []).append(i)
+        self.weights = [max(1, int(w)) for _, w in ip_weights]
+        self.active = [0] * len(self.ips)
+        self.inflight = [0] * len(self.ips)
+        self.total_bytes = [0] * len(self.ips)  # monotonic, for rate sampling
+        self.uploaded = [0] * len(self.ips)  # client -> destination part of total_bytes
+        self.picks = [0] * len(self.ips)  # acquire() decisions per NIC
+        self._lock = threading.Lock()
+        self._tiebreak = -1
+        self._all = list(range(len(self.ips)))
+        # NICs taken out of rotation by NICHealth
+        self._unavailable: frozenset = frozenset()
+        self._available = self._all
+        # destination affinity, see enable_affinity()
+        self.affinity: Optional[AffinityRing] = None
+        # counters shared with other worker processes, see share()
+        self._shared: Optional[SharedNICTable] = None
+        self._down: Optional[memoryview] = None
+        # heavy-hitter sketch fed from _add_bytes/_release, see TopTalkers
+        self.talkers: Optional[TopTalkers] = None
+        # gets one record per released lease that reached a destination
+        self.access_log: Optional[AccessLog] = None
+
+    def share(self, table: "SharedNICTable", worker: int):
+        """Keep this process's load counters in its row of `table` and
+        schedule by the totals of all worker processes."""
+        if table.nics != len(self.ips):
+            raise ValueError(f"shared table has {table.nics} NICs, scheduler has {len(self.ips)}")
+        with self._lock:
+            self.active = table.row("active", worker)
+            self.inflight = table.row("inflight", worker)
+            self.total_bytes = table.row("total_bytes", worker)
+            self._down = table.row("down", worker)
+            self._shared = table
+
+    def load(self, field: str) -> List[int]:
+        """Per-NIC "active", "inflight" or "total_bytes" counts, summed over
+        all workers when the scheduler is shared."""
+        if self._shared is None:
+            return getattr(self, field)
+        return self._shared.total(field)
+
+    def enable_affinity(self, ttl: float, max_entries: int = 65536):
+        """Pin acquire(key=...) calls with the same key to one NIC."""
+        self.affinity = AffinityRing(self.ips, self.weights, ttl, max_entries)
+
+    def set_unavailable(self, indices):
+        """Take NICs out of rotation; an empty set puts all of them back."""
+        self._unavailable = frozenset(indices)
+        self._available = [i for i in self._all if i not in self._unavailable]
+        if self._down is not None:
+            for i in self._all:
+                self._down[i] = int(i in self._unavailable)
+
+    def _rotation(self) -> Tuple[frozenset, List[int]]:
+        """The unavailable and available NIC indices."""
+        if self._shared is None:
+            return self._unavailable, self._available
+        # a NIC is out of rotation while any worker's health checker has it down
+        down = self._shared.total("down")
+        return (frozenset(i for i in self._all if down[i]),
+                [i for i in self._all if not down[i]])
+
+    def set_weights(self, weights: List[int]):
+        """Replace the NIC weights (e.g. from AdaptiveWeights)."""
+        with self._lock:
+            self.weights = [max(1, int(w)) for w in weights]
+        if self.affinity is not None:
+            self.affinity.rebuild(self.weights)
+
+    def acquire(self, exclude=(), key=None, family=None) -> Optional[_Lease]:
+        """Claim a NIC, skipping the indices in exclude.
+
+        NICs marked unavailable are skipped too, unless that would leave
+        nothing: with every NIC down it is better to keep trying than to
+        refuse all traffic.  family (AF_INET/AF_INET6) restricts the choice
+        to source addresses of that kind.  Returns None only when exclude
+        or family leaves no NIC.  With affinity enabled, calls passing the
+        same key (e.g. client IP and destination host) get the same NIC
+        while it stays available.
+        """
+        unavailable, available = self._rotation()
+        if family is None:
+            pool, candidates = self._all, available or self._all
+        else:
+            pool = self._by_family.get(family, [])
+            candidates = [i for i in pool if i not in unavailable] or pool
+        if exclude:
+            candidates = [i for i in candidates if i not in exclude] or \
+                [i for i in pool if i not in exclude]
+        if not candidates:
+            return None
+        affinity = self.affinity
+        with self._lock:
+            if affinity is not None and key is not None:
+                i = affinity.lookup(key, candidates)
+            else:
+                i = self._choose(candidates)
+            self.active[i] += 1
+            self.picks[i] += 1
+        return _Lease(self, i)
+
+    def _choose(self, candidates: List[int]) -> int:
+        raise NotImplementedError
+
+    def _add_bytes(self, lease: _Lease, n: int, upload: bool):
+        talkers = self.talkers
+        with self._lock:
+            lease.bytes += n
+            self.inflight[lease.index] += n
+            self.total_bytes[lease.index] += n
+            if upload:
+                self.uploaded[lease.index] += n
+                lease.uploaded += n
+            pending = lease.bytes - lease.reported
+            if talkers is None or pending < _TALKER_STEP:
+                return
+            lease.reported = lease.bytes
+        talkers.add(lease, pending)
+
+    def _release(self, lease: _Lease):
+        with self._lock:
+            self.active[lease.index] -= 1
+            self.inflight[lease.index] -= lease.bytes
+            total, pending = lease.bytes, lease.bytes - lease.reported
+            lease.bytes = lease.reported = 0
+        if self.talkers is not None and pending > 0:
+            self.talkers.add(lease, pending)
+        if self.access_log is not None and lease.host:
+            self.access_log.record(lease, total)
+
+    def _least(self, load: List[int], candidates: List[int]) -> int:
+        """Candidate with the lowest load/weight; ties rotate between NICs."""
+        n = len(candidates)
+        start = self._tiebreak = (self._tiebreak + 1) % n
+        best, best_score = candidates[start], None
+        for k in range(n):
+            i = candidates[(start + k) % n]
+            score = load[i] / self.weights[i]
+            if best_score is None or score < best_score:
+                best, best_score = i, score
+        return best
+
+
+class SmoothWeightedRoundRobin(NICScheduler):
+    """Smooth weighted round-robin (as in nginx).
+
+    Each pick adds every NIC's weight to its running score, takes the
+    highest and subtracts the weight total from it.  Weights 5/1/1 yield
+    a,a,b,a,c,a,a rather than bursts of a, in O(number of NICs) per pick
+    and without expanding the weights into a list.
+    """
+
+    name = "wrr"
+
+    def __init__(self, ip_weights: List[Tuple[str, int]]):
+        super().__init__(ip_weights)
+        self._current = [0] * len(self.ips)
+
+    def _choose(self, candidates: List[int]) -> int:
+        current, weights = self._current, self.weights
+        best = candidates[0]
+        total = 0
+        for i in candidates:
+            w = weights[i]
+            total += w
+            current[i] += w
+            if current[i] > current[best]:
+                best = i
+        current[best] -= total
+        return best
+
+
+class LeastConnections(NICScheduler):
+    """Pick the NIC with the fewest active connections per unit of weight."""
+
+    name = "least-conn"
+
+    def _choose(self, candidates: List[int]) -> int:
+        return self._least(self.load("active"), candidates)
+
+
+class LeastBytes(NICScheduler):
+    """Pick the NIC whose open connections have relayed the fewest bytes
+    per unit of weight, so a NIC carrying a long download is avoided."""
+
+    name = "least-bytes"
+
+    def _choose(self, candidates: List[int]) -> int:
+        return self._least(self.load("inflight"), candidates)
+
+
+SCHEDULERS = {cls.name: cls for cls in (SmoothWeightedRoundRobin, LeastConnections, LeastBytes)}
+
+
+def make_scheduler(scheduler, ip_weights: List[Tuple[str, int]]) -> NICScheduler:
+    """Build a scheduler from a SCHEDULERS name, or pass an instance through."""
+    if isinstance(scheduler, NICScheduler):
+        return scheduler
+    try:
+        return SCHEDULERS[scheduler](ip_weights)
+    except KeyError:
+        raise ValueError(f"unknown scheduler {scheduler!r}, expected one of {tuple(SCHEDULERS)}") from None
+
+
+class AffinityRing:
+    """Weighted consistent-hash ring (ketama style) with a sticky table.
+
+    Each NIC owns a number of points on a 32-bit ring proportional to its
+    weight, derived from its IP, so adding or removing a NIC only moves
+    the keys that land on its points.  A lookup hashes the key and
+    bisects the sorted points: O(log points).  The NIC chosen for a key
+    is also remembered for `ttl` seconds after its last use, so weight
+    changes (e.g. from AdaptiveWeights) do not move live sessions; only a
+    NIC going out of rotation does.
+
+    Not thread-safe by itself: NICScheduler.acquire() calls lookup() with
+    its lock held.
+    """
+
+    POINTS = 160  # points for the heaviest NIC
+
+    def __init__(self, ips: List[str], weights: List[int], ttl: float,
+                 max_entries: int = 65536):
+        self.ips = ips
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._sticky: "OrderedDict[object, List]" = OrderedDict()  # key -> [index, expires]
+        self._hashes: List[int] = []
+        self._owners: List[int] = []
+        self.rebuild(weights)
+
+    def rebuild(self, weights: List[int]):
+        top = max(weights)
+        points = []
+        for i, (ip, w) in enumerate(zip(self.ips, weights)):
+            vnodes = max(1, round(self.POINTS * w / top))
+            # every md5 digest yields four 32-bit points, as in ketama
+            for v in range((vnodes + 3) // 4):
+                digest = hashlib.md5(f"{ip}-{v}".encode()).digest()
+                for k in range(min(4, vnodes - 4 * v)):
+                    points.append((int.from_bytes(digest[4 * k:4 * k + 4], "little"), i))
+        points.sort()
+        # swap both lists in one assignment so lookups never see a mix
+        self._hashes, self._owners = [h for h, _ in points], [i for _, i in points]
+
+    def lookup(self, key, candidates: List[int]) -> int:
+        now = time.monotonic()
+        entry = self._sticky.get(key)
+        if entry is not None and entry[1] > now and entry[0] in candidates:
+            entry[1] = now + self.ttl
+            self._sticky.move_to_end(key)
+            return entry[0]
+        index = self._ring_lookup(key, candidates)
+        self._sticky[key] = [index, now + self.ttl]
+        self._sticky.move_to_end(key)
+        if len(self._sticky) > self.max_entries:
+            # drop the least recently used entry; expired ones age out the same way
+            self._sticky.popitem(last=False)
+        return index
+
+    def _ring_lookup(self, key, candidates: List[int]) -> int:
+        hashes, owners = self._hashes, self._owners
+        h = int.from_bytes(hashlib.md5(repr(key).encode()).digest()[:4], "little")
+        pos = bisect.bisect(hashes, h)
+        n = len(hashes)
+        if len(candidates) == len(self.ips):
+            return owners[pos % n]
+        # walk clockwise to the first point owned by an available NIC
+        allowed = set(candidates)
+        for k in range(n):
+            owner = owners[(pos + k) % n]
+            if owner in allowed:
+                return owner
+        return candidates[0]
+
+
+class SharedNICTable:
+    """Per-NIC scheduler state shared by the processes of WorkerSupervisor.
+
+    An anonymous shared mapping, created before the workers are forked,
+    holds one row per worker for each field: active connections, bytes of
+    open connections, bytes relayed, and whether that worker's NICHealth
+    has the NIC down.  A worker only ever writes its own rows, so no lock
+    is shared between processes; readers sum the rows.  A dead worker's
+    rows are cleared by the supervisor (total_bytes stays monotonic).
+    """
+
+    FIELDS = ("active", "inflight", "total_bytes", "down")
+
+    def __init__(self, nics: int, workers: int):
+        self.nics = nics
+        self.workers = workers
+        # anonymous mappings are MAP_SHARED: forked children see the same pages
+        self._mm = mmap.mmap(-1, 8 * len(self.FIELDS) * workers * nics)
+        view = memoryview(self._mm).cast("q")
+        self._rows = {
+            field: [view[(k * workers + w) * nics:(k * workers + w + 1) * nics] for w in range(workers)]
+            for k, field in enumerate(self.FIELDS)}
+
+    def row(self, field: str, worker: int) -> memoryview:
+        return self._rows[field][worker]
+
+    def total(self, field: str) -> List[int]:
+        return [sum(col) for col in zip(*self._rows[field])]
+
+    def reset(self, worker: int):
+        """Clear the load and health rows of a worker that has exited."""
+        for field in ("active", "inflight", "down"):
+            row = self._rows[field][worker]
+            for i in range(self.nics):
+                row[i] = 0
+
+
+# ---------------------------------------------------------------------
+# Upstream socket profiles
+# ---------------------------------------------------------------------
+# Python does not export TCP_FASTOPEN_CONNECT (Linux 4.11+, value 30)
+_TCP_FASTOPEN_CONNECT = getattr(socket, "TCP_FASTOPEN_CONNECT",
+                                30 if sys.platform.startswith("linux") else None)
+# macOS spells TCP_KEEPIDLE as TCP_KEEPALIVE (0x10)
+_TCP_KEEPIDLE = getattr(socket, "TCP_KEEPIDLE", 0x10 if sys.platform == "darwin" else None)
+_MiB = 1024 * 1024
+
+# ip@weight/<preset> on the CLI; the GUI offers the same names
+PROFILE_PRESETS = {
+    "default": {},
+    # a few ms of RTT: the kernel's buffer autotuning is plenty
+    "fibre": {"keepalive": 60, "keepintvl": 10, "keepcnt": 5, "connect_timeout": 5},
+    # 30-80 ms RTT with deep, variable queues; carrier NATs drop idle
+    # mappings after a few minutes, so keepalives come well before that
+    "lte": {"sndbuf": 4 * _MiB, "rcvbuf": 4 * _MiB, "congestion": "bbr", "fastopen": True,
+            "keepalive": 30, "keepintvl": 10, "keepcnt": 3, "connect_timeout": 15},
+    # up to 600 ms RTT (GEO): windows of several BDP-MB and a patient connect
+    "satellite": {"sndbuf": 16 * _MiB, "rcvbuf": 16 * _MiB, "congestion": "bbr", "fastopen": True,
+                  "keepalive": 60, "keepintvl": 20, "keepcnt": 4, "connect_timeout": 30},
+}
+
+
+class SocketProfile:
+    """Socket options for the upstream connections of one NIC.
+
+    sndbuf/rcvbuf (bytes, 0 = kernel autotuning), congestion (a
+    TCP_CONGESTION algorithm such as "bbr"), fastopen (TCP Fast Open:
+    connect() returns at once and the SYN carries the first payload, so
+    connect errors surface on the first send instead), keepalive idle
+    seconds with keepintvl/keepcnt (0 = off) and connect_timeout.
+
+    Options the platform lacks are skipped; apply() reports the ones
+    that could not be set.
+    """
+
+    def __init__(self, sndbuf: int = 0, rcvbuf: int = 0, congestion: str = "",
+                 fastopen: bool = False, keepalive: float = 0, keepintvl: float = 0,
+                 keepcnt: int = 0, connect_timeout: float = _CONNECT_TIMEOUT):
+        self.sndbuf = int(sndbuf)
+        self.rcvbuf = int(rcvbuf)
+        self.congestion = congestion
+        self.fastopen = bool(fastopen)
+        self.keepalive = float(keepalive)
+        self.keepintvl = float(keepintvl)
+        self.keepcnt = int(keepcnt)
+        self.connect_timeout = float(connect_timeout)
+
+    @classmethod
+    def parse(cls, spec: str) -> "SocketProfile":
+        """Build a profile from "preset,key=value,...", e.g. "lte,cc=cubic".
+
+        Keys: sndbuf, rcvbuf, buf (both; sizes take a K or M suffix),
+        cc, tfo (on/off), keepalive (IDLE[/INTVL[/COUNT]] seconds, 0 = off)
+        and timeout (connect timeout in seconds).  Later items override
+        earlier ones.  Raises ValueError for anything else.
+        """
+        options: Dict = {}
+        for item in filter(None, (i.strip() for i in spec.split(","))):
+            key, sep, value = item.partition("=")
+            key = key.lower()
+            if not sep:
+                if key in PROFILE_PRESETS:
+                    options.update(PROFILE_PRESETS[key])
+                elif key == "tfo":
+                    options["fastopen"] = True
+                else:
+                    raise ValueError(f"unknown socket profile {key!r}, expected one of "
+                                     f"{', '.join(PROFILE_PRESETS)} or key=value")
+                continue
+            try:
+                if key in ("sndbuf", "rcvbuf", "buf"):
+                    size = _parse_size(value)
+                    for field in (("sndbuf", "rcvbuf") if key == "buf" else (key,)):
+                        options[field] = size
+                elif key == "cc":
+                    options["congestion"] = value
+                elif key == "tfo":
+                    options["fastopen"] = value.lower() in ("1", "on", "yes", "true")
+                elif key == "keepalive":
+                    parts = (value.split("/") + ["0", "0"])[:3]
+                    options["keepalive"], options["keepintvl"] = float(parts[0]), float(parts[1])
+                    options["keepcnt"] = int(parts[2])
+                elif key == "timeout":
+                    options["connect_timeout"] = float(value)
+                else:
+                    raise KeyError(key)
+            except KeyError:
+                raise ValueError(f"unknown socket profile option {key!r}") from None
+            except ValueError:
+                raise ValueError(f"bad value in socket profile option {item!r}") from None
+        return cls(**options)
+
+    def __str__(self) -> str:
+        parts = []
+        if self.sndbuf or self.rcvbuf:
+            parts.append(f"buffers {self.sndbuf // 1024}K/{self.rcvbuf // 1024}K")
+        if self.congestion:
+            parts.append(f"cc {self.congestion}")
+        if self.fastopen:
+            parts.append("fast open")
+        if self.keepalive:
+            parts.append(f"keepalive {self.keepalive:g}/{self.keepintvl:g}/{self.keepcnt}")
+        parts.append(f"connect timeout {self.connect_timeout:g}s")
+        return ", ".join(parts)
+
+    def apply(self, sock: socket.socket) -> List[str]:
+        """Set the options on a socket before connect(); returns the failures."""
+        failed = []
+
+        def setopt(name: str, level: int, option: Optional[int], value):
+            if option is None:
+                failed.append(f"{name} (unsupported on this platform)")
+                return
+            try:
+                sock.setsockopt(level, option, value)
+            except OSError as e:
+                failed.append(f"{name} ({e.strerror or e})")
+
+        for name, option, size, limit in (("sndbuf", socket.SO_SNDBUF, self.sndbuf, "wmem_max"),
+                                          ("rcvbuf", socket.SO_RCVBUF, self.rcvbuf, "rmem_max")):
+            if not size:
+                continue
+            # Linux silently clamps to net.core.[rw]mem_max, and any explicit
+            # size turns autotuning off: a clamped buffer is worse than none
+            cap = _sysctl_int(f"/proc/sys/net/core/{limit}")
+            if cap is not None and size > cap:
+                failed.append(f"{name} (above net.core.{limit}={cap}, left to autotuning)")
+                continue
+            setopt(name, socket.SOL_SOCKET, option, size)
+        if self.congestion:
+            setopt(f"cc {self.congestion}", socket.IPPROTO_TCP,
+                   getattr(socket, "TCP_CONGESTION", None), self.congestion.encode())
+        if self.fastopen:
+            setopt("tfo", socket.IPPROTO_TCP, _TCP_FASTOPEN_CONNECT, 1)
+        if self.keepalive:
+            setopt("keepalive", socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            if _TCP_KEEPIDLE is None and hasattr(socket, "SIO_KEEPALIVE_VALS"):
+                try:  # Windows without the TCP_KEEP* options
+                    sock.ioctl(socket.SIO_KEEPALIVE_VALS, (1, int(self.keepalive * 1000),
+                                                           int((self.keepintvl or 1) * 1000)))
+                except OSError as e:
+                    failed.append(f"keepalive ({e})")
+            else:
+                setopt("keepidle", socket.IPPROTO_TCP, _TCP_KEEPIDLE, max(1, int(self.keepalive)))
+                if self.keepintvl:
+                    setopt("keepintvl", socket.IPPROTO_TCP, getattr(socket, "TCP_KEEPINTVL", None),
+                           max(1, int(self.keepintvl)))
+                if self.keepcnt:
+                    setopt("keepcnt", socket.IPPROTO_TCP, getattr(socket, "TCP_KEEPCNT", None),
+                           self.keepcnt)
+        return failed
+
+
+def _parse_size(value: str) -> int:
+    """"512K", "4M" or a plain byte count."""
+    value = value.strip().upper().rstrip("B")
+    scale = {"K": 1024, "M": _MiB}.get(value[-1:], 1)
+    return int(float(value[:-1] if scale > 1 else value) * scale)
+
+
+_SYSCTL_CACHE: Dict[str, Optional[int]] = {}
+
+
+def _sysctl_int(path: str) -> Optional[int]:
+    """Integer value of a /proc/sys file, None where there is none."""
+    if path not in _SYSCTL_CACHE:
+        try:
+            with open(path) as f:
+                _SYSCTL_CACHE[path] = int(f.read().split()[0])
+        except (OSError, ValueError, IndexError):
+            _SYSCTL_CACHE[path] = None
+    return _SYSCTL_CACHE[path]
+
+
+# ---------------------------------------------------------------------
+# NIC health
+# ---------------------------------------------------------------------
+HEALTH_UP, HEALTH_DOWN, HEALTH_PROBING = "up", "down", "probing"
+
+# connect errors that say something about the local path rather than the
+# destination (ECONNREFUSED, for instance, proves the link works)
+_PATH_ERRNOS = {errno.ETIMEDOUT, errno.ENETUNREACH, errno.EHOSTUNREACH,
+                errno.ENETDOWN, errno.EADDRNOTAVAIL, errno.ENETRESET,
+                10050, 10051, 10060, 10065}  # WSAENETDOWN/UNREACH, WSAETIMEDOUT, WSAEHOSTUNREACH
+
+
+def _is_path_error(exc: Optional[BaseException]) -> bool:
+    return isinstance(exc, (socket.timeout, asyncio.TimeoutError)) or \
+        (isinstance(exc, OSError) and exc.errno in _PATH_ERRNOS)
+
+
+class NICHealth:
+    """Circuit breaker per source IP, fed by real connects and probes.
+
+    up       - in rotation; failure_threshold consecutive path errors
+               open the breaker
+    down     - out of rotation for `cooldown` seconds (doubling on each
+               failed retry, capped at max_cooldown)
+    probing  - back in rotation on trial: the next success closes the
+               breaker, the next failure opens it again
+
+    With probe_target=(host, port) a background thread also opens a TCP
+    connection through every NIC each probe_interval seconds; a successful
+    probe brings a down NIC back without waiting for the cooldown.
+    """
+
+    def __init__(self, scheduler: "NICScheduler", log=print,
+                 probe_target: Optional[Tuple[str, int]] = None,
+                 probe_interval: float = 10, probe_timeout: float = 3,
+                 failure_threshold: int = 3, cooldown: float = 5,
+                 max_cooldown: float = 120):
+        self.scheduler = scheduler
+        self.probe_target = probe_target
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.failure_threshold = max(1, failure_threshold)
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._log = log
+        n = len(scheduler.ips)
+        self.state = [HEALTH_UP] * n
+        self.failures = [0] * n          # consecutive path errors
+        self.total_failures = [0] * n
+        self._cooldown = [cooldown] * n
+        self._retry_at = [0.0] * n
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ---- lifecycle -------------------------------------------------------
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.probe_timeout + 1)
+            self._thread = None
+
+    def states(self) -> Dict[str, str]:
+        """Current breaker state per source IP."""
+        return dict(zip(self.scheduler.ips, self.state))
+
+    # ---- observations ----------------------------------------------------
+    def observe(self, index: int, error: Optional[BaseException] = None):
+        """Record the outcome of a connect made through NIC `index`."""
+        if error is not None and not _is_path_error(error):
+            error = None  # the NIC delivered the packets; the peer said no
+        with self._lock:
+            if error is None:
+                self.failures[index] = 0
+                if self.state[index] != HEALTH_UP:
+                    self._cooldown[index] = self.base_cooldown
+                    self._set(index, HEALTH_UP, "")
+                return
+            self.failures[index] += 1
+            self.total_failures[index] += 1
+            state = self.state[index]
+            if state == HEALTH_PROBING or (
+                    state == HEALTH_UP and self.failures[index] >= self.failure_threshold):
+                if state == HEALTH_PROBING:
+                    self._cooldown[index] = min(self._cooldown[index] * 2, self.max_cooldown)
+                self._retry_at[index] = time.monotonic() + self._cooldown[index]
+                self._set(index, HEALTH_DOWN, f" ({self.failures[index]} consecutive failures: {error})")
+
+    def observe_connected(self, index: int, sock: socket.socket):
+        """Record a successful connect, unless it went out on the default
+        route because binding to the NIC failed."""
+        try:
+            local_ip = sock.getsockname()[0]
+        except OSError:
+            return
+        if _normalize_ip(local_ip) == self.scheduler.ips[index]:
+            self.observe(index)
+
+    def _set(self, index: int, state: str, detail: str):
+        """Change state and refresh the scheduler; call with the lock held."""
+        self.state[index] = state
+        self.scheduler.set_unavailable(i for i, st in enumerate(self.state) if st == HEALTH_DOWN)
+        self._log(f"[HEALTH] {self.scheduler.ips[index]} {state}{detail}")
+
+    # ---- background work -------------------------------------------------
+    def _loop(self):
+        next_probe = time.monotonic()
+        while not self._stop.wait(min(1.0, self.probe_interval)):
+            now = time.monotonic()
+            with self._lock:
+                for i, state in enumerate(self.state):
+                    if state == HEALTH_DOWN and now >= self._retry_at[i]:
+                        self._set(i, HEALTH_PROBING, "")
+            if self.probe_target is not None and now >= next_probe:
+                next_probe = now + self.probe_interval
+                for i, error in self._probe_all().items():
+                    self.observe(i, error)
+
+    def _probe_targets(self) -> Dict[int, tuple]:
+        """probe_target per address family; a host name with A and AAAA
+        records lets IPv4 and IPv6 NICs be probed alike."""
+        host, port = self.probe_target
+        try:
+            infos = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        except OSError:
+            return {}
+        targets: Dict[int, tuple] = {}
+        for family, _, _, _, sockaddr in infos:
+            targets.setdefault(family, sockaddr)
+        return targets
+
+    def _probe_all(self) -> Dict[int, Optional[BaseException]]:
+        """Connect to probe_target through every NIC at once.
+
+        NICs of a family the target has no address in are left out.
+        """
+        targets = self._probe_targets()
+        results: Dict[int, Optional[BaseException]] = {}
+        pending: Dict[socket.socket, int] = {}
+        for i, ip in enumerate(self.scheduler.ips):
+            target = targets.get(self.scheduler.families[i])
+            if target is None:
+                continue
+            results[i] = None
+            sock = socket.socket(self.scheduler.families[i], socket.SOCK_STREAM)
+            sock.setblocking(False)
+            try:
+                sock.bind((ip, 0))
+                err = sock.connect_ex(target)
+                if err not in _CONNECT_PENDING:
+                    raise OSError(err, os.strerror(err))
+                pending[sock] = i
+            except OSError as e:
+                results[i] = e
+                sock.close()
+        deadline = time.monotonic() + self.probe_timeout
+        while pending:
+            remaining = deadline - time.monotonic()
+            ready = _wait_writable(list(pending), remaining) if remaining > 0 else []
+            if not ready:
+                break
+            for sock in ready:
+                err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err:
+                    results[pending[sock]] = OSError(err, os.strerror(err))
+                del pending[sock]
+                sock.close()
+        for sock, i in pending.items():
+            results[i] = socket.timeout("probe timed out")
+            sock.close()
+        return results
+
+
+# ---------------------------------------------------------------------
+# Adaptive weights
+# ---------------------------------------------------------------------
+AUTO_WEIGHT_MODES = ("off", "prior", "cap")
+
+
+class AdaptiveWeights:
+    """Rescale scheduler weights to each link's measured capacity.
+
+    Every `interval` seconds the bytes each NIC relayed (from the
+    scheduler's counters) are turned into a rate.  Rates of busy intervals
+    feed an EWMA; the capacity estimate is the larger of that EWMA and a
+    slowly decaying peak, so a link keeps credit for throughput it has
+    shown even while demand is low.  Connect RTTs are tracked the same way
+    and stand in for capacity on links with no throughput samples yet
+    (a link with half the RTT is assumed to move twice the data).
+
+    New weights are scaled to 1..SCALE and combined with the manual
+    weights according to mode:
+        prior - start from the manual weights and move to the measured
+                ones as samples accumulate
+        cap   - measured weights, but never above the manual share
+    """
+
+    SCALE = 100
+    PEAK_HALF_LIFE = 600.0  # seconds
+    CONFIDENT_SAMPLES = 10
+
+    def __init__(self, scheduler: "NICScheduler", mode: str = "prior",
+                 interval: float = 5, alpha: float = 0.3, log=print):
+        if mode not in AUTO_WEIGHT_MODES[1:]:
+            raise ValueError(f"unknown auto-weight mode {mode!r}")
+        self.scheduler = scheduler
+        self.mode = mode
+        self.interval = interval
+        self.alpha = alpha
+        self._log = log
+        n = len(scheduler.ips)
+        self.manual = list(scheduler.weights)
+        self.throughput = [0.0] * n   # EWMA, bytes/s
+        self.peak = [0.0] * n
+        self.rtt: List[Optional[float]] = [None] * n  # EWMA, seconds
+        self.samples = [0] * n
+        self._last_bytes = list(scheduler.load("total_bytes"))
+        self._last_time = time.monotonic()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def record_rtt(self, index: int, rtt: float):
+        """Feed one TCP handshake time measured through NIC `index`."""
+        prev = self.rtt[index]
+        self.rtt[index] = rtt if prev is None else prev + self.alpha * (rtt - prev)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.update()
+
+    def update(self) -> List[int]:
+        """Take one throughput sample and push new weights to the scheduler."""
+        now = time.monotonic()
+        dt = max(now - self._last_time, 1e-6)
+        decay = 0.5 ** (dt / self.PEAK_HALF_LIFE)
+        total = list(self.scheduler.load("total_bytes"))
+        for i, b in enumerate(total):
+            rate = (b - self._last_bytes[i]) / dt
+            self.peak[i] *= decay
+            if rate > 0:
+                prev = self.throughput[i]
+                self.throughput[i] = rate if not self.samples[i] else prev + self.alpha * (rate - prev)
+                self.peak[i] = max(self.peak[i], rate)
+                self.samples[i] += 1
+        self._last_bytes, self._last_time = total, now
+
+        weights = self._combine(self._measured())
+        if weights != self.scheduler.weights:
+            self.scheduler.set_weights(weights)
+            self._log("[WEIGHTS] " + " ".join(f"{ip}={w}" for ip, w in zip(self.scheduler.ips, weights)))
+        return weights
+
+    def _measured(self) -> List[Optional[float]]:
+        """Capacity estimate per NIC in bytes/s, None if nothing is known."""
+        capacity: List[Optional[float]] = [
+            max(t, p) if n else None for t, p, n in zip(self.throughput, self.peak, self.samples)]
+        # links without throughput data: scale a measured link's capacity by the RTT ratio
+        ref = [(c, r) for c, r in zip(capacity, self.rtt) if c and r]
+        if ref:
+            ref_cap, ref_rtt = max(ref)
+            for i, c in enumerate(capacity):
+                if c is None and self.rtt[i]:
+                    capacity[i] = ref_cap * ref_rtt / self.rtt[i]
+        return capacity
+
+    def _combine(self, capacity: List[Optional[float]]) -> List[int]:
+        top_manual = max(self.manual)
+        prior = [self.SCALE * m / top_manual for m in self.manual]
+        known = [c for c in capacity if c]
+        if not known:
+            return [max(1, round(p)) for p in prior]
+        top = max(known)
+        weights = []
+        for i, c in enumerate(capacity):
+            measured = self.SCALE * c / top if c else prior[i]
+            if self.mode == "cap":
+                w = min(measured, prior[i])
+            else:
+                # an RTT-only estimate counts as half-way confident
+                samples = self.samples[i] or (self.CONFIDENT_SAMPLES / 2 if c else 0)
+                beta = min(1.0, samples / self.CONFIDENT_SAMPLES)
+                w = (1 - beta) * prior[i] + beta * measured
+            weights.append(max(1, round(w)))
+        return weights
+
+
+# ---------------------------------------------------------------------
+# Traffic shaping
+# ---------------------------------------------------------------------
+# a connection is interactive until it has relayed this many bytes; after
+# that it is bulk and yields to interactive flows
+_QOS_INTERACTIVE_BYTES = 256 * 1024
+# bucket depth: this many seconds of traffic at the configured rate, but
+# never less than _QOS_MIN_BURST so the largest relay read fits the reserve
+_QOS_BURST = 0.25
+_QOS_MIN_BURST = 1024 * 1024
+# share of every bucket that only interactive flows may draw down
+_QOS_RESERVE = 0.25
+# client buckets untouched for this long are dropped once there are many
+_QOS_CLIENT_IDLE = 60
+_QOS_MAX_CLIENTS = 1024
+
+
+class TokenBucket:
+    """Byte-rate limiter charged once per relayed chunk, not per byte.
+
+    take(n) withdraws n tokens even when that overdraws the bucket and
+    returns how long the caller should hold off its next read so the
+    average stays at `rate` bytes/s.  A caller passing a reserve only
+    proceeds while that share of the bucket is left untouched, which
+    keeps headroom for the callers that pass none.
+    """
+
+    def __init__(self, rate: float):
+        self.rate = float(rate)
+        self.burst = max(self.rate * _QOS_BURST, _QOS_MIN_BURST)
+        self.level = self.burst
+        self.stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, n: int, reserve: float = 0.0) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self.level = min(self.burst, self.level + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.level -= n
+            floor = reserve * self.burst
+            return 0.0 if self.level >= floor else (floor - self.level) / self.rate
+
+
+class Shaper:
+    """Hierarchical token buckets: per NIC, per client IP and for bulk flows.
+
+    Every chunk a connection relays is charged to the bucket of its NIC,
+    of its client IP and, once the connection has moved more than
+    _QOS_INTERACTIVE_BYTES, to the shared bulk bucket; the relay then
+    pauses reading from that connection for the longest of the returned
+    delays, which pushes back on the sender through TCP flow control.
+    Bulk connections must leave _QOS_RESERVE of the NIC and client
+    buckets untouched, so SSH or a video call keeps low latency next to
+    a saturating download.  Rates are bytes/s; 0 means uncapped.
+    """
+
+    def __init__(self, ips: List[str], nic_rates: Optional[Dict[str, float]] = None,
+                 client_rate: float = 0, bulk_rate: float = 0):
+        nic_rates = nic_rates or {}
+        unknown = set(nic_rates) - set(ips)
+        if unknown:
+            raise ValueError(f"rate given for unknown NIC(s) {', '.join(sorted(unknown))}")
+        self.nics = [TokenBucket(nic_rates[ip]) if nic_rates.get(ip) else None for ip in ips]
+        self.client_rate = float(client_rate)
+        self.bulk = TokenBucket(bulk_rate) if bulk_rate else None
+        self._clients: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def charge(self, lease: _Lease, n: int) -> float:
+        """Account n bytes read for lease's connection; returns the pause in seconds."""
+        bulk = lease.bytes >= _QOS_INTERACTIVE_BYTES
+        reserve = _QOS_RESERVE if bulk else 0.0
+        delay = 0.0
+        bucket = self.nics[lease.index]
+        if bucket is not None:
+            delay = bucket.take(n, reserve)
+        if self.client_rate and lease.client:
+            delay = max(delay, self._client(lease.client).take(n, reserve))
+        if bulk and self.bulk is not None:
+            delay = max(delay, self.bulk.take(n))
+        return delay
+
+    def _client(self, ip: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._clients.get(ip)
+            if bucket is None:
+                if len(self._clients) >= _QOS_MAX_CLIENTS:
+                    cutoff = time.monotonic() - _QOS_CLIENT_IDLE
+                    for key in [k for k, b in self._clients.items() if b.stamp < cutoff]:
+                        del self._clients[key]
+                bucket = self._clients[ip] = TokenBucket(self.client_rate)
+            return bucket
+
+
+# ---------------------------------------------------------------------
+# Top talkers
+# ---------------------------------------------------------------------
+# a lease passes its bytes to TopTalkers in steps of at least this much (and
+# the rest at release), so relay reads in between only compare two ints
+_TALKER_STEP = 256 * 1024
+# counts halve every this many seconds, so the ranking follows current traffic
+_TALKER_HALF_LIFE = 30.0
+
+
+class SpaceSaving:
+    """Space-saving heavy-hitter sketch with at most `capacity` counters.
+
+    An untracked key takes over the smallest counter and inherits its count
+    as error: a reported count overestimates by at most that error, and
+    every key holding more than 1/capacity of the total is guaranteed to be
+    tracked.  Not thread-safe; TopTalkers holds the lock.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, int(capacity))
+        self.counts: Dict[str, List[float]] = {}  # key -> [count, error]
+
+    def add(self, key: str, n: float):
+        entry = self.counts.get(key)
+        if entry is not None:
+            entry[0] += n
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = [n, 0.0]
+        else:
+            # O(capacity), but only for new keys and at most once per _TALKER_STEP
+            victim = min(self.counts, key=lambda k: self.counts[k][0])
+            floor = self.counts.pop(victim)[0]
+            self.counts[key] = [floor + n, floor]
+
+    def scale(self, factor: float):
+        for entry in self.counts.values():
+            entry[0] *= factor
+            entry[1] *= factor
+
+    def top(self, n: int) -> List[Tuple[str, int, int]]:
+        """The n largest (key, count, error) triples."""
+        ranked = sorted(self.counts.items(), key=lambda kv: kv[1][0], reverse=True)[:n]
+        return [(key, int(count), int(error)) for key, (count, error) in ranked]
+
+
+class TopTalkers:
+    """Per-NIC SpaceSaving sketches of bytes by destination host and by
+    client IP.
+
+    NICScheduler feeds it from _add_bytes and _release, so memory stays at
+    2 * capacity counters per NIC however many hosts and clients pass
+    through.  Counts decay exponentially (_TALKER_HALF_LIFE).
+    """
+
+    def __init__(self, ips: List[str], capacity: int = 64):
+        self.ips = list(ips)
+        self.hosts = [SpaceSaving(capacity) for _ in self.ips]
+        self.clients = [SpaceSaving(capacity) for _ in self.ips]
+        self._lock = threading.Lock()
+        self._decayed = time.monotonic()
+
+    def add(self, lease: _Lease, n: int):
+        with self._lock:
+            self._decay()
+            # UDP associations have no single destination host
+            self.hosts[lease.index].add(lease.host or "-", n)
+            self.clients[lease.index].add(lease.client or "-", n)
+
+    def _decay(self):
+        now = time.monotonic()
+        elapsed = now - self._decayed
+        if elapsed < 1.0:
+            return
+        self._decayed = now
+        factor = 0.5 ** (elapsed / _TALKER_HALF_LIFE)
+        for sketch in self.hosts + self.clients:
+            sketch.scale(factor)
+
+    def top(self, n: int = 10) -> List[Dict]:
+        """Per NIC the n heaviest hosts and clients as (key, bytes, error)."""
+        with self._lock:
+            self._decay()
+            return [{"ip": ip, "hosts": hosts.top(n), "clients": clients.top(n)}
+                    for ip, hosts, clients in zip(self.ips, self.hosts, self.clients)]
+
+
+# ---------------------------------------------------------------------
+# Access log
+# ---------------------------------------------------------------------
+class AccessLog:
+    """One JSON line per upstream connection, written by a background thread.
+
+    record() runs on the relay threads/event loop when a lease is
+    released: it appends a tuple to a deque and returns, so a slow disk
+    never stalls a relay.  Once max_queue records are waiting, new ones
+    are dropped and counted; the writer notes the loss as a
+    {"dropped": n} line.  Every flush_interval the writer formats what is
+    queued and writes it with one write() call.
+
+    The file is rotated like logging.handlers.RotatingFileHandler (path.1
+    is the newest of `backups` old files) once it reaches max_bytes or has
+    been open for rotate_interval seconds; 0 disables either trigger.
+
+    Fields: ts (end, Unix time), client, host, port, nic, connect_ms (null
+    for a pooled HTTP connection or a failed connect), up and down (bytes),
+    duration_ms and reason ("closed" or the error cause of Metrics.errors).
+    """
+
+    def __init__(self, path: str, max_bytes: int = 0, rotate_interval: float = 0,
+                 backups: int = 5, max_queue: int = 65536, flush_interval: float = 0.5,
+                 log=print):
+        self.path = path
+        self.max_bytes = max(0, int(max_bytes))
+        self.rotate_interval = max(0.0, float(rotate_interval))
+        self.backups = max(1, int(backups))
+        self.max_queue = max(1, int(max_queue))
+        self.flush_interval = flush_interval
+        self.dropped = 0  # may undercount a little under contention; never blocks
+        self._reported = 0
+        self._queue = deque()
+        self._log = log
+        self._file = None
+        self._opened = 0.0
+        self._failing = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, lease: _Lease, total: int):
+        if len(self._queue) >= self.max_queue:
+            self.dropped += 1
+            return
+        now = time.monotonic()
+        self._queue.append((time.time(), lease.client, lease.host, lease.port, lease.ip,
+                            lease.connect_time, lease.uploaded, total - lease.uploaded,
+                            now - lease.started, lease.reason or "closed"))
+
+    def start(self):
+        self._open()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="access-log")
+        self._thread.start()
+
+    def close(self):
+        """Write what is queued and close the file."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=_STOP_GRACE)
+            self._thread = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self._flush()
+        self._flush()
+
+    def _flush(self):
+        queue = self._queue
+        lines = []
+        for _ in range(len(queue)):
+            ts, client, host, port, nic, connect, up, down, duration, reason = queue.popleft()
+            lines.append(json.dumps({
+                "ts": round(ts, 3), "client": client, "host": host, "port": port, "nic": nic,
+                "connect_ms": None if connect is None else round(connect * 1000, 1),
+                "up": up, "down": down, "duration_ms": round(duration * 1000, 1),
+                "reason": reason}))
+        dropped = self.dropped
+        if dropped != self._reported:
+            lines.append(json.dumps({"ts": round(time.time(), 3), "dropped": dropped - self._reported}))
+            self._reported = dropped
+        try:
+            if lines:
+                self._file.write("\n".join(lines) + "\n")
+                self._file.flush()
+            if (self.max_bytes and self._file.tell() >= self.max_bytes) or \
+                    (self.rotate_interval and time.monotonic() - self._opened >= self.rotate_interval):
+                self._rotate()
+            self._failing = False
+        except (OSError, ValueError) as e:
+            # a full or vanished disk loses these records, not the relay
+            if not self._failing:
+                self._failing = True
+                self._log(f"[WARN] access log {self.path}: {e}")
+            if self._file is None or self._file.closed:
+                try:
+                    self._open()
+                except OSError:
+                    pass
+
+    def _open(self):
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._opened = time.monotonic()
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+        self._open()
+
+
+# ---------------------------------------------------------------------
+# Metrics
+# ---------------------------------------------------------------------
+class Histogram:
+    """Fixed-bucket histogram of durations in seconds (Prometheus style)."""
+
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+               0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate the q-quantile by interpolating inside its bucket."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            if c and seen + c >= rank:
+                lo = self.buckets[i - 1] if i else 0.0
+                hi = self.buckets[i] if i < len(self.buckets) else lo
+                return lo + (hi - lo) * (rank - seen) / c
+            seen += c
+        return self.buckets[-1]
+
+    def snapshot(self) -> Dict:
+        return {"buckets": dict(zip(self.buckets + (float("inf"),), itertools.accumulate(self.counts))),
+                "sum": self.sum, "count": self.count,
+                "p50": self.quantile(0.5), "p99": self.quantile(0.99)}
+
+
+class Metrics:
+    """Counters and latency histograms of one MultiNICSOCKSProxy.
+
+    Byte counts are not recorded here: the scheduler already adds every
+    relayed chunk to its per-NIC counters under its lock, and snapshot()
+    reads them from there, so the relay loops pay nothing extra.  What is
+    recorded here happens once per connection (accepts, errors,
+    handshake/DNS/connect times) and takes one short lock.
+
+    snapshot() returns a dict for in-process readers, nics() just the
+    per-NIC part for pollers such as the GUI; render() formats the same
+    numbers in the Prometheus text format.
+    """
+
+    PREFIX = "multipath_proxy"
+
+    def __init__(self, proxy: "MultiNICSOCKSProxy"):
+        self.proxy = proxy
+        n = len(proxy.scheduler.ips)
+        self._lock = threading.Lock()
+        self.connections: Dict[str, int] = {}   # by kind: socks, udp, http
+        self.errors: Dict[str, int] = {}        # by cause
+        self.connect_failures = [0] * n
+        self.handshake = Histogram()
+        self.dns = Histogram()
+        self.connect = [Histogram() for _ in range(n)]
+
+    def connection(self, kind: str):
+        with self._lock:
+            self.connections[kind] = self.connections.get(kind, 0) + 1
+
+    def error(self, cause: str):
+        with self._lock:
+            self.errors[cause] = self.errors.get(cause, 0) + 1
+
+    def connect_failed(self, index: int):
+        with self._lock:
+            self.connect_failures[index] += 1
+
+    def observe(self, histogram: Histogram, seconds: float):
+        with self._lock:
+            histogram.observe(seconds)
+
+    def nics(self) -> List[Dict]:
+        """Per-NIC counters without the histograms: cheap enough to poll
+        every second (one short hold of each lock, no quantiles)."""
+        sched = self.proxy.scheduler
+        with sched._lock:
+            total, up = list(sched.total_bytes), list(sched.uploaded)
+            active, picks, weights = list(sched.active), list(sched.picks), list(sched.weights)
+        health = list(self.proxy.health.state)
+        with self._lock:
+            failures = list(self.connect_failures)
+        return [{"ip": ip, "weight": weights[i], "health": health[i],
+                 "active": active[i], "picks": picks[i],
+                 "bytes_up": up[i], "bytes_down": total[i] - up[i],
+                 "connect_failures": failures[i]}
+                for i, ip in enumerate(sched.ips)]
+
+    def snapshot(self) -> Dict:
+        """All current values as plain dicts and lists."""
+        proxy = self.proxy
+        nics = self.nics()
+        with self._lock:
+            for nic, hist in zip(nics, self.connect):
+                nic["connect"] = hist.snapshot()
+            return {"active_connections": proxy.active_connections(),
+                    "connections": dict(self.connections),
+                    "errors": dict(self.errors),
+                    "handshake": self.handshake.snapshot(),
+                    "dns": self.dns.snapshot(),
+                    "nics": nics,
+                    "top_talkers": proxy.talkers.top() if proxy.talkers is not None else []}
+
+    def render(self) -> str:
+        """The snapshot in the Prometheus text exposition format."""
+        snap = self.snapshot()
+        out: List[str] = []
+
+        def metric(name, kind, help_, samples):
+            name = f"{self.PREFIX}_{name}"
+            out.append(f"# HELP {name} {help_}")
+            out.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                out.append(f"{name}{_prom_labels(labels)} {value}")
+
+        def histogram(name, help_, series):
+            name = f"{self.PREFIX}_{name}"
+            out.append(f"# HELP {name} {help_}")
+            out.append(f"# TYPE {name} histogram")
+            for labels, h in series:
+                for le, count in h["buckets"].items():
+                    le = "+Inf" if le == float("inf") else repr(le)
+                    out.append(f"{name}_bucket{_prom_labels({**labels, 'le': le})} {count}")
+                out.append(f"{name}_sum{_prom_labels(labels)} {h['sum']}")
+                out.append(f"{name}_count{_prom_labels(labels)} {h['count']}")
+
+        nics = snap["nics"]
+        metric("active_connections", "gauge", "Client connections currently open.",
+               [({}, snap["active_connections"])])
+        metric("connections_total", "counter", "Client connections accepted, by kind.",
+               [({"kind": k}, v) for k, v in sorted(snap["connections"].items())])
+        metric("errors_total", "counter", "Failed client connections, by cause.",
+               [({"cause": k}, v) for k, v in sorted(snap["errors"].items())])
+        metric("nic_bytes_total", "counter", "Bytes relayed per NIC and direction.",
+               [({"nic": n["ip"], "direction": d}, n[f"bytes_{d}"]) for n in nics for d in ("up", "down")])
+        metric("nic_active_connections", "gauge", "Open connections per NIC.",
+               [({"nic": n["ip"]}, n["active"]) for n in nics])
+        metric("nic_picks_total", "counter", "Scheduler decisions per NIC.",
+               [({"nic": n["ip"]}, n["picks"]) for n in nics])
+        metric("nic_weight", "gauge", "Current scheduler weight per NIC.",
+               [({"nic": n["ip"]}, n["weight"]) for n in nics])
+        metric("nic_up", "gauge", "1 if the NIC is in rotation, 0 if its circuit breaker is open.",
+               [({"nic": n["ip"]}, int(n["health"] != HEALTH_DOWN)) for n in nics])
+        metric("nic_connect_failures_total", "counter", "Upstream connect failures per NIC.",
+               [({"nic": n["ip"]}, n["connect_failures"]) for n in nics])
+        histogram("handshake_seconds", "Time from accept to a parsed SOCKS5 request or HTTP head.",
+                  [({}, snap["handshake"])])
+        histogram("dns_seconds", "Host name resolution time, cache hits included.",
+                  [({}, snap["dns"])])
+        histogram("connect_seconds", "Upstream TCP handshake time per NIC.",
+                  [({"nic": n["ip"]}, n["connect"]) for n in nics])
+        return "\n".join(out) + "\n"
+
+
+def _prom_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+
+def _error_cause(exc: BaseException) -> str:
+    """Coarse cause of a failed client connection, for Metrics.errors."""
+    if isinstance(exc, socket.gaierror):
+        return "dns"
+    if isinstance(exc, (socket.timeout, asyncio.TimeoutError)):
+        return "timeout"
+    if isinstance(exc, ConnectionRefusedError):
+        return "refused"
+    if isinstance(exc, (ConnectionResetError, BrokenPipeError, ConnectionAbortedError)):
+        return "reset"
+    if isinstance(exc, OSError) and exc.errno in (errno.ENETUNREACH, errno.EHOSTUNREACH):
+        return "unreachable"
+    if isinstance(exc, (ValueError, UnicodeError)):
+        return "protocol"
+    return "other"
+
+
+class _MetricsServer:
+    """Serves Metrics.render() at /metrics and, when enabled, the top
+    talkers as JSON at /talkers over plain HTTP."""
+
+    def __init__(self, metrics: Metrics, host: str, port: int):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                talkers = metrics.proxy.talkers
+                if path == "/talkers" and talkers is not None:
+                    body, kind = json.dumps(talkers.top()).encode(), "application/json"
+                elif path in ("/", "/metrics"):
+                    body, kind = metrics.render().encode(), "text/plain; version=0.0.4; charset=utf-8"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", kind)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = type("Server", (ThreadingHTTPServer,), {"address_family": _family(host), "daemon_threads": True})
+        self._httpd = server((host, port), Handler)
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+# ---------------------------------------------------------------------
+# DNS resolution
+# ---------------------------------------------------------------------
+class _PendingLookup:
+    """A lookup in progress that other threads can wait on."""
+
+    __slots__ = ("done", "addrs", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.addrs: Optional[List[str]] = None
+        self.error: Optional[BaseException] = None
+
+
+def _is_ip_literal(host: str) -> bool:
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(family, host)
+            return True
+        except OSError:
+            pass
+    return False
+
+
+class DNSResolver:
+    """Hostname resolver shared by every connection of a proxy.
+
+    - LRU cache of at most max_entries names; each entry expires after its
+      record TTL (or default_ttl when the system resolver is used, since
+      getaddrinfo() does not report TTLs)
+    - failed lookups are cached for negative_ttl seconds
+    - concurrent lookups of the same name are coalesced into one query
+    - with nameserver=(host, port) queries go straight to that server over
+      UDP, which also makes the resolver testable against a local stub
+
+    stats() returns hit/miss/coalesced/negative-hit/failure counters.
+    """
+
+    def __init__(self, nameserver: Optional[Tuple[str, int]] = None,
+                 max_entries: int = 1024, default_ttl: float = 60,
+                 negative_ttl: float = 10, timeout: float = 5):
+        self.nameserver = nameserver
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        # host -> (expires_at, addrs or None for a cached failure)
+        self._cache: "OrderedDict[str, Tuple[float, Optional[List[str]]]]" = OrderedDict()
+        self._inflight: Dict[str, _PendingLookup] = {}
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.coalesced = self.negative_hits = self.failures = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced,
+                "negative_hits": self.negative_hits, "failures": self.failures,
+                "entries": len(self._cache)}
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    # ---- lookup ------------------------------------------------------------
+    def _cached(self, host: str) -> Optional[List[str]]:
+        """Return cached addresses, raise for a cached failure, None on miss.
+
+        Must be called with the lock held.
+        """
+        entry = self._cache.get(host)
+        if entry is None:
+            return None
+        expires, addrs = entry
+        if expires <= time.monotonic():
+            del self._cache[host]
+            return None
+        self._cache.move_to_end(host)
+        if addrs is None:
+            self.negative_hits += 1
+            raise socket.gaierror(socket.EAI_NONAME, f"{host}: name not found (cached)")
+        self.hits += 1
+        return addrs
+
+    def resolve(self, host: str) -> List[str]:
+        """Return the IPv4 and IPv6 addresses of host; blocks, safe from any thread."""
+        if _is_ip_literal(host):
+            return [host]
+        with self._lock:
+            addrs = self._cached(host)
+            if addrs is not None:
+                return addrs
+            pending = self._inflight.get(host)
+            owner = pending is None
+            if owner:
+                self.misses += 1
+                pending = self._inflight[host] = _PendingLookup()
+            else:
+                self.coalesced += 1
+        if not owner:
+            if not pending.done.wait(self.timeout + 1):
+                raise socket.timeout(f"DNS lookup for {host} timed out")
+            if pending.error is not None:
+                raise pending.error
+            return pending.addrs
+        try:
+            addrs, ttl = self._query(host)
+            pending.addrs = addrs
+            self._store(host, addrs, ttl)
+            return addrs
+        except OSError as e:
+            pending.error = e
+            self._store(host, None, self.negative_ttl)
+            raise
+        finally:
+            if pending.addrs is None and pending.error is None:
+                # anything but an OSError (a bug, KeyboardInterrupt): waiters
+                # must get an error, never addrs=None
+                pending.error = socket.gaierror(socket.EAI_FAIL, f"{host}: lookup failed")
+            with self._lock:
+                del self._inflight[host]
+                if pending.error is not None:
+                    self.failures += 1
+            pending.done.set()
+
+    async def resolve_async(self, host: str) -> List[str]:
+        """Coroutine version of resolve(): cache hits never leave the loop."""
+        if _is_ip_literal(host):
+            return [host]
+        with self._lock:
+            addrs = self._cached(host)
+        if addrs is not None:
+            return addrs
+        return await asyncio.get_running_loop().run_in_executor(None, self.resolve, host)
+
+    def _store(self, host: str, addrs: Optional[List[str]], ttl: float):
+        with self._lock:
+            self._cache[host] = (time.monotonic() + ttl, addrs)
+            self._cache.move_to_end(host)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def _query(self, host: str) -> Tuple[List[str], float]:
+        if self.nameserver is not None:
+            return _dns_query(host, self.nameserver, self.timeout)
+        infos = socket.getaddrinfo(host, None, 0, socket.SOCK_STREAM)
+        addrs = list(dict.fromkeys(info[4][0] for info in infos))
+        return addrs, self.default_ttl
+
+
+def _dns_query(host: str, server: Tuple[str, int], timeout: float) -> Tuple[List[str], float]:
+    """Send AAAA and A queries over UDP at once; return (addresses, minimum TTL).
+
+    IPv6 addresses come first, as in getaddrinfo()'s default ordering.  If
+    only one of the two answers arrives before the timeout it is used alone.
+    """
+    qname = b"".join(bytes([len(label)]) + label for label in host.rstrip(".").encode("idna").split(b".")) + b"\0"
+    qids = random.sample(range(1 << 16), 2)
+    qtypes = dict(zip(qids, (28, 1)))  # AAAA, A
+    family = socket.AF_INET6 if ":" in server[0] else socket.AF_INET
+    answers: Dict[int, bytes] = {}
+    with socket.socket(family, socket.SOCK_DGRAM) as sock:
+        sock.connect(server)
+        for qid, qtype in qtypes.items():
+            sock.send(struct.pack("!HHHHHH", qid, 0x0100, 1, 0, 0, 0) + qname + struct.pack("!HH", qtype, 1))
+        deadline = time.monotonic() + timeout
+        while len(answers) < len(qtypes):
+            sock.settimeout(max(0.01, deadline - time.monotonic()))
+            try:
+                data = sock.recv(4096)
+            except socket.timeout:
+                if answers:
+                    break
+                raise
+            if len(data) >= 12:
+                qid = struct.unpack_from("!H", data)[0]
+                if qid in qtypes:  # ignore stray/spoofed replies with the wrong id
+                    answers[qid] = data
+    addrs: List[str] = []
+    ttl = None
+    error: Optional[OSError] = None
+    for qid in qids:
+        if qid not in answers:
+            continue
+        try:
+            try:
+                found, found_ttl = _dns_parse_answer(host, answers[qid], qid, qname, qtypes[qid])
+            except (struct.error, IndexError, ValueError) as e:
+                raise socket.gaierror(socket.EAI_FAIL, f"{host}: malformed DNS response ({e})") from e
+        except OSError as e:
+            error = error or e
+            continue
+        addrs.extend(found)
+        ttl = found_ttl if ttl is None else min(ttl, found_ttl)
+    if not addrs:
+        raise error or socket.gaierror(socket.EAI_NODATA, f"{host}: no A/AAAA records")
+    return addrs, ttl
+
+
+def _dns_parse_answer(host: str, data: bytes, qid: int, qname: bytes,
+                      qtype: int) -> Tuple[List[str], float]:
+    """Addresses (A and AAAA records) and minimum TTL of a DNS response.
+
+    The reply must carry our id, be a response (QR), be complete (no TC; the
+    answer is not retried over TCP) and echo our question, otherwise its
+    records are not trusted.  Raises socket.gaierror for those and for
+    error rcodes; truncated data raises struct.error or IndexError.
+    """
+    rid, flags, qdcount, ancount = struct.unpack_from("!HHHH", data)
+    if rid != qid or not flags & 0x8000:
+        raise socket.gaierror(socket.EAI_FAIL, f"{host}: DNS reply is not an answer to our query")
+    if flags & 0x0200:
+        raise socket.gaierror(socket.EAI_AGAIN, f"{host}: truncated DNS reply")
+    rcode = flags & 0x000F
+    if rcode == 3:
+        raise socket.gaierror(socket.EAI_NONAME, f"{host}: NXDOMAIN")
+    if rcode != 0:
+        raise socket.gaierror(socket.EAI_FAIL, f"{host}: DNS error rcode {rcode}")
+    end = 12 + len(qname)
+    if qdcount != 1 or data[12:end].lower() != qname.lower() or \
+            struct.unpack_from("!HH", data, end) != (qtype, 1):
+        raise socket.gaierror(socket.EAI_FAIL, f"{host}: DNS reply does not echo our question")
+    offset = end + 4
+    addrs: List[str] = []
+    ttl = None
+    for _ in range(ancount):
+        offset = _dns_skip_name(data, offset)
+        rtype, _, rttl, rdlen = struct.unpack_from("!HHIH", data, offset)
+        offset += 10
+        if offset + rdlen > len(data):
+            raise IndexError("record data past the end of the reply")
+        if rtype == 1 and rdlen == 4:
+            addrs.append(socket.inet_ntoa(data[offset:offset + 4]))
+        elif rtype == 28 and rdlen == 16:
+            addrs.append(socket.inet_ntop(socket.AF_INET6, data[offset:offset + 16]))
+        else:
+            offset += rdlen
+            continue  # CNAME and friends
+        ttl = rttl if ttl is None else min(ttl, rttl)
+        offset += rdlen
+    if not addrs:
+        raise socket.gaierror(socket.EAI_NODATA, f"{host}: no address records")
+    return addrs, ttl
+
+
+def _dns_skip_name(data: bytes, offset: int) -> int:
+    """Return the offset just past a (possibly compressed) DNS name."""
+    while True:
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            return offset + 2  # compression pointer ends the name
+        offset += 1
+        if length == 0:
+            return offset
+        offset += length
+
+
+# ---------------------------------------------------------------------
+# Address family preference
+# ---------------------------------------------------------------------
+class FamilyPreference:
+    """Per-destination choice between IPv4 and IPv6.
+
+    order() drops addresses no NIC can originate and, for a host with
+    usable addresses in both families, puts the family with the lower
+    connect-RTT EWMA first.  Until both families have a sample IPv6 is
+    tried first and then IPv4 once; afterwards every EXPLORE-th connection
+    leads with the slower family so its estimate stays current.  A failed
+    connect counts as a _CONNECT_TIMEOUT sample.
+    """
+
+    ALPHA = 0.3
+    EXPLORE = 16
+
+    def __init__(self, families, max_entries: int = 4096):
+        self.families = frozenset(families)  # families some NIC can originate
+        self.max_entries = max_entries
+        # host -> [rtt AF_INET, rtt AF_INET6, connections]
+        self._hosts: "OrderedDict[str, List]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def order(self, host: str, addrs: List[str]) -> List[str]:
+        usable = [a for a in addrs if _family(a) in self.families]
+        if not usable:
+            raise OSError(errno.EAFNOSUPPORT, f"no NIC can reach {host} ({', '.join(addrs)})")
+        v4 = [a for a in usable if _family(a) == socket.AF_INET]
+        if not v4 or len(v4) == len(usable):
+            return usable
+        v6 = [a for a in usable if _family(a) == socket.AF_INET6]
+        with self._lock:
+            entry = self._hosts.get(host)
+            if entry is None:
+                entry = self._hosts[host] = [None, None, 0]
+                if len(self._hosts) > self.max_entries:
+                    self._hosts.popitem(last=False)
+            self._hosts.move_to_end(host)
+            entry[2] += 1
+            rtt4, rtt6, n = entry
+        if rtt6 is None:
+            v6_first = True
+        elif rtt4 is None:
+            v6_first = False
+        else:
+            v6_first = (rtt6 <= rtt4) != (n % self.EXPLORE == 0)
+        return v6 + v4 if v6_first else v4 + v6
+
+    def record(self, host: str, family: int, rtt: float):
+        """Feed the connect time of one attempt to host over family."""
+        slot = 1 if family == socket.AF_INET6 else 0
+        with self._lock:
+            entry = self._hosts.get(host)
+            if entry is None:
+                return  # single-family host or IP literal: nothing to choose
+            old = entry[slot]
+            entry[slot] = rtt if old is None else old + self.ALPHA * (rtt - old)
+
+    def failed(self, host: str, family: int):
+        self.record(host, family, _CONNECT_TIMEOUT)
+
+    def preferred(self, host: str) -> Optional[int]:
+        """The family currently leading for host, if both were measured."""
+        with self._lock:
+            entry = self._hosts.get(host)
+            if entry is None or None in entry[:2]:
+                return None
+            return socket.AF_INET6 if entry[1] <= entry[0] else socket.AF_INET
+
+
+# ---------------------------------------------------------------------
+# SOCKS5 protocol
+# ---------------------------------------------------------------------
+class _Socks5Parser:
+    """Incremental parser for the client side of a SOCKS5 handshake.
+
+    Received bytes go straight into a preallocated buffer
+    (recv_into(parser.space()), then received(n)), and parse() consumes
+    whatever complete messages are there, so every segmentation of the
+    stream parses the same.  A client that pipelines greeting, request
+    and first payload in one segment needs no extra reads; the bytes
+    past the request are left in `early` for the upstream.
+    """
+
+    GREETING, REQUEST, DONE = range(3)
+    SIZE = 1024  # the largest greeting (257 bytes) and request (262) fit together
+
+    __slots__ = ("buf", "view", "filled", "pos", "state", "methods", "cmd", "host", "port")
+
+    def __init__(self):
+        self.buf = bytearray(self.SIZE)
+        self.view = memoryview(self.buf)
+        self.filled = 0
+        self.pos = 0
+        self.state = self.GREETING
+        self.methods = b""
+        self.cmd = 0
+        self.host = ""
+        self.port = 0
+
+    def space(self) -> memoryview:
+        """Free part of the buffer for the next recv_into()."""
+        return self.view[self.filled:]
+
+    def received(self, n: int):
+        self.filled += n
+
+    def feed(self, data: bytes):
+        """Copy bytes read by other means (e.g. a StreamReader) into the buffer."""
+        n = min(len(data), self.SIZE - self.filled)
+        self.view[self.filled:self.filled + n] = data[:n]
+        self.filled += n
+        if n < len(data):
+            raise ValueError("SOCKS5 handshake too long")
+
+    @property
+    def early(self) -> bytes:
+        """Payload the client sent right behind its request."""
+        return bytes(self.view[self.pos:self.filled]) if self.state == self.DONE else b""
+
+    def parse(self) -> int:
+        """Consume complete messages and return the state reached:
+        REQUEST once the greeting is in, DONE once the request is.
+        Raises ValueError on anything that is not valid SOCKS5."""
+        if self.state == self.DONE:
+            return self.state
+        buf, pos, end = self.buf, self.pos, self.filled
+        if self.state == self.GREETING:
+            if end - pos < 2:
+                return self.state
+            if buf[pos] != SOCKS_VERSION:
+                raise ValueError("not a SOCKS5 greeting")
+            n = buf[pos + 1]
+            if end - pos < 2 + n:
+                return self.state
+            self.methods = bytes(buf[pos + 2:pos + 2 + n])
+            pos = self.pos = pos + 2 + n
+            self.state = self.REQUEST
+        if end - pos < 5:
+            return self.state
+        ver, cmd, _, atyp = buf[pos:pos + 4]
+        if ver != SOCKS_VERSION or cmd not in (_CMD_CONNECT, _CMD_UDP_ASSOCIATE):
+            raise ValueError("unsupported SOCKS5 request")
+        if atyp == 1:  # IPv4
+            start, size = pos + 4, 4
+        elif atyp == 3:  # domain
+            start, size = pos + 5, buf[pos + 4]
+        elif atyp == 4:  # IPv6
+            start, size = pos + 4, 16
+        else:
+            raise ValueError(f"unsupported SOCKS5 address type {atyp}")
+        if end < start + size + 2:
+            return self.state
+        raw = bytes(buf[start:start + size])
+        if atyp == 1:
+            self.host = socket.inet_ntoa(raw)
+        elif atyp == 3:
+            self.host = raw.decode()
+        else:
+            self.host = socket.inet_ntop(socket.AF_INET6, raw)
+        self.cmd = cmd
+        self.port = int.from_bytes(buf[start + size:start + size + 2], "big")
+        self.pos = start + size + 2
+        self.state = self.DONE
+        return self.state
+
+
+# ---------------------------------------------------------------------
+# HTTP proxy frontend
+# ---------------------------------------------------------------------
+# a client whose first byte is an ASCII capital letter is speaking HTTP
+_HTTP_METHOD_START = frozenset(range(ord("A"), ord("Z") + 1))
+_HTTP_MAX_HEAD = 64 * 1024
+_HTTP_ESTABLISHED = b"HTTP/1.1 200 Connection Established\r\n\r\n"
+_HTTP_CONTINUE = b"HTTP/1.1 100 Continue\r\n\r\n"
+# hop-by-hop fields (RFC 7230 6.1) plus the proxy-only ones; never forwarded
+_HTTP_HOP_HEADERS = frozenset(("connection", "keep-alive", "proxy-connection",
+                               "proxy-authorization", "proxy-authenticate",
+                               "te", "trailer", "upgrade"))
+# message body framing: a byte count, _BODY_CHUNKED, or None (until close)
+_BODY_CHUNKED = -1
+
+
+class _HTTPHead:
+    """Start line and header fields of an HTTP/1.x request or response."""
+
+    __slots__ = ("start", "headers")
+
+    def __init__(self, data: bytes):
+        lines = data.decode("latin-1").split("\n")
+        self.start = lines[0].rstrip("\r").split(" ", 2)
+        if len(self.start) == 2 and self.start[0].startswith("HTTP/"):
+            self.start.append("")  # status line without a reason phrase
+        if len(self.start) != 3:
+            raise ValueError(f"malformed HTTP start line {lines[0]!r}")
+        self.headers: List[Tuple[str, str]] = []
+        for line in lines[1:]:
+            line = line.rstrip("\r")
+            if not line:
+                continue
+            name, sep, value = line.partition(":")
+            if not sep or not name or name != name.strip():
+                raise ValueError(f"malformed HTTP header {line!r}")
+            self.headers.append((name, value.strip()))
+
+    def get(self, name: str) -> Optional[str]:
+        name = name.lower()
+        for n, v in reversed(self.headers):
+            if n.lower() == name:
+                return v
+        return None
+
+    def tokens(self, name: str) -> Set[str]:
+        """Lower-cased comma-separated values of every `name` field."""
+        name = name.lower()
+        return {t.strip().lower() for n, v in self.headers if n.lower() == name
+                for t in v.split(",") if t.strip()}
+
+    def keep_alive(self) -> bool:
+        version = self.start[0] if self.start[0].startswith("HTTP/") else self.start[2]
+        conn = self.tokens("connection") | self.tokens("proxy-connection")
+        if version == "HTTP/1.0":
+            return "keep-alive" in conn
+        return "close" not in conn
+
+    def rewrite(self, start: str, connection: str, extra=(), omit=()) -> bytes:
+        """Serialize with a new start line, hop-by-hop fields replaced by
+        `Connection: connection` and the fields in `extra` appended."""
+        drop = _HTTP_HOP_HEADERS | self.tokens("connection") | set(omit)
+        lines = [start]
+        lines.extend(f"{n}: {v}" for n, v in self.headers if n.lower() not in drop)
+        lines.extend(extra)
+        lines.append(f"Connection: {connection}")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def _http_target(method: str, target: str) -> Tuple[str, int, str]:
+    """Split a proxy request target into (host, port, origin-form path).
+
+    CONNECT takes an authority (host:port); every other method needs an
+    absolute http:// URI.  Raises ValueError for anything else.
+    """
+    if method == "CONNECT":
+        authority, path, default = target, "", None
+    else:
+        scheme, sep, rest = target.partition("://")
+        if not sep or scheme.lower() != "http":
+            raise ValueError(f"unsupported request target {target!r}")
+        end = len(rest)
+        for c in "/?#":
+            i = rest.find(c)
+            if i >= 0:
+                end = min(end, i)
+        authority, path = rest[:end], rest[end:].partition("#")[0]
+        if not path.startswith("/"):
+            path = "/" + path
+        default = 80
+    authority = authority.rpartition("@")[2]
+    if authority.startswith("["):
+        host, _, port = authority[1:].partition("]")
+        port = port[1:] if port.startswith(":") else ""
+    else:
+        host, _, port = authority.partition(":")
+    if not host or not (port or default):
+        raise ValueError(f"no host/port in request target {target!r}")
+    return host, int(port) if port else default, path
+
+
+def _http_upstream_head(head: _HTTPHead, path: str, host: str, port: int) -> bytes:
+    """The request head sent upstream: origin-form target, hop-by-hop
+    fields dropped and a keep-alive (or upgrade) Connection field."""
+    method, _, version = head.start
+    authority = f"[{host}]" if ":" in host else host
+    extra = [] if head.get("host") is not None else \
+        [f"Host: {authority}" if port == 80 else f"Host: {authority}:{port}"]
+    upgrade = head.get("upgrade")
+    if upgrade and "upgrade" in head.tokens("connection"):
+        extra.append(f"Upgrade: {upgrade}")
+        connection = "upgrade"
+    else:
+        connection = "keep-alive"
+    # 100-continue is answered by the proxy itself, see _handle_http()
+    return head.rewrite(f"{method} {path} {version}", connection, extra, omit=("expect",))
+
+
+def _http_request_body(head: _HTTPHead) -> int:
+    """Body length of a request; ValueError for framing we cannot relay."""
+    te = head.get("transfer-encoding")
+    if te is not None:
+        if te.rsplit(",", 1)[-1].strip().lower() != "chunked":
+            raise ValueError(f"unsupported transfer-encoding {te!r}")
+        return _BODY_CHUNKED
+    length = int(head.get("content-length") or 0)
+    if length < 0:
+        raise ValueError("negative content-length")
+    return length
+
+
+def _http_response_body(method: str, status: int, head: _HTTPHead) -> Optional[int]:
+    """Body length of a response (RFC 7230 3.3.3)."""
+    if method == "HEAD" or status < 200 or status in (204, 304):
+        return 0
+    te = head.get("transfer-encoding")
+    if te is not None:
+        chunked = te.rsplit(",", 1)[-1].strip().lower() == "chunked"
+        return _BODY_CHUNKED if chunked else None
+    length = head.get("content-length")
+    return int(length) if length is not None else None
+
+
+def _http_error(status: int, reason: str) -> bytes:
+    return (f"HTTP/1.1 {status} {reason}\r\nContent-Length: 0\r\n"
+            f"Connection: close\r\n\r\n").encode()
+
+
+class _SockReader:
+    """Buffered reader over a blocking socket, for the thread engine's
+    HTTP frontend (the asyncio engine uses StreamReader instead)."""
+
+    __slots__ = ("sock", "buf", "upload", "shaper")
+
+    def __init__(self, sock: socket.socket, upload: bool = False,
+                 shaper: Optional[Shaper] = None):
+        self.sock = sock
+        self.buf = bytearray()
+        self.upload = upload  # True for the client side: copies count as upload
+        self.shaper = shaper
+
+    def _fill(self) -> bool:
+        data = self.sock.recv(65536)
+        self.buf += data
+        return bool(data)
+
+    def read_head(self) -> Optional[bytes]:
+        """Return the next message head, or None on EOF between messages."""
+        start = 0
+        while True:
+            end = self.buf.find(b"\r\n\r\n", start)
+            if end >= 0:
+                head = bytes(self.buf[:end + 4])
+                del self.buf[:end + 4]
+                return head
+            if len(self.buf) > _HTTP_MAX_HEAD:
+                raise ValueError("HTTP head too large")
+            start = max(0, len(self.buf) - 3)
+            if not self._fill():
+                if self.buf:
+                    raise ConnectionResetError("connection closed inside an HTTP head")
+                return None
+
+    def readline(self) -> bytes:
+        start = 0
+        while True:
+            end = self.buf.find(b"\n", start)
+            if end >= 0:
+                line = bytes(self.buf[:end + 1])
+                del self.buf[:end + 1]
+                return line
+            if len(self.buf) > _HTTP_MAX_HEAD:
+                raise ValueError("HTTP line too long")
+            start = len(self.buf)
+            if not self._fill():
+                raise ConnectionResetError("connection closed inside a chunked body")
+
+    def copy_to(self, dst: socket.socket, length: Optional[int], lease: _Lease):
+        """Relay one message body to dst; length as from _http_*_body()."""
+        if length != _BODY_CHUNKED:
+            self._copy(dst.sendall, length, lease)
+            return
+        # pass the chunk framing through unchanged, parsing it only to find the end
+        while True:
+            line = self.readline()
+            dst.sendall(line)
+            size = int(line.split(b";", 1)[0], 16)
+            if size == 0:
+                break
+            self._copy(dst.sendall, size + 2, lease)
+        while True:  # trailer fields up to the empty line
+            line = self.readline()
+            dst.sendall(line)
+            if line in (b"\r\n", b"\n"):
+                return
+
+    def read_body(self, write, length: Optional[int], lease: _Lease):
+        """Pass one message body to write() with any chunk framing removed."""
+        if length != _BODY_CHUNKED:
+            self._copy(write, length, lease)
+            return
+        while True:
+            size = int(self.readline().split(b";", 1)[0], 16)
+            if size == 0:
+                break
+            self._copy(write, size, lease)
+            self.readline()  # CRLF closing the chunk
+        while self.readline() not in (b"\r\n", b"\n"):
+            pass
+
+    def _copy(self, send, n: Optional[int], lease: _Lease):
+        """Pass n bytes (None: until EOF) to send(), buffered bytes first."""
+        while n is None or n > 0:
+            if self.buf:
+                data = bytes(self.buf[:n])
+                del self.buf[:len(data)]
+            else:
+                data = self.sock.recv(65536 if n is None else min(n, 65536))
+                if not data:
+                    if n is None:
+                        return
+                    raise ConnectionResetError("connection closed inside an HTTP body")
+            send(data)
+            lease.add_bytes(len(data), self.upload)
+            if self.shaper is not None:
+                delay = self.shaper.charge(lease, len(data))
+                if delay:
+                    time.sleep(delay)
+            if n is not None:
+                n -= len(data)
+
+    def idle(self) -> bool:
+        """True if a pooled connection is still open with nothing unread."""
+        if self.buf:
+            return False
+        self.sock.setblocking(False)
+        try:
+            self.sock.recv(1, socket.MSG_PEEK)
+            return False  # EOF or unsolicited bytes
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+        finally:
+            self.sock.settimeout(_IDLE_TIMEOUT)
+
+
+class _UpstreamPool:
+    """Idle keep-alive upstream connections of the HTTP frontend.
+
+    Connections are keyed by (NIC index, host, port), so a reused one
+    always leaves through the NIC the scheduler picked for the request.
+    At most MAX_IDLE are kept per key, each for IDLE_TIMEOUT seconds;
+    `alive` vets a connection before it is handed out again.
+    """
+
+    MAX_IDLE = 8
+    IDLE_TIMEOUT = 30.0
+
+    def __init__(self, close, alive):
+        self._close = close
+        self._alive = alive
+        self._idle: Dict[tuple, List[Tuple[object, float]]] = {}
+        self._lock = threading.Lock()
+        self._next_sweep = 0.0
+
+    def get(self, key: tuple):
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                entries = self._idle.get(key)
+                if not entries:
+                    return None
+                conn, since = entries.pop()
+                if not entries:
+                    del self._idle[key]
+            if now - since < self.IDLE_TIMEOUT and self._alive(conn):
+                return conn
+            self._close(conn)
+
+    def put(self, key: tuple, conn):
+        now = time.monotonic()
+        stale = []
+        with self._lock:
+            entries = self._idle.setdefault(key, [])
+            entries.append((conn, now))
+            if len(entries) > self.MAX_IDLE:
+                stale.append(entries.pop(0)[0])
+            if now >= self._next_sweep:
+                # keys nobody asks for again would otherwise keep their sockets
+                self._next_sweep = now + self.IDLE_TIMEOUT
+                for k, entries in list(self._idle.items()):
+                    fresh = [e for e in entries if now - e[1] < self.IDLE_TIMEOUT]
+                    stale.extend(e[0] for e in entries if now - e[1] >= self.IDLE_TIMEOUT)
+                    if fresh:
+                        self._idle[k] = fresh
+                    else:
+                        del self._idle[k]
+        for c in stale:
+            self._close(c)
+
+    def close_all(self):
+        with self._lock:
+            conns = [e[0] for entries in self._idle.values() for e in entries]
+            self._idle.clear()
+        for c in conns:
+            self._close(c)
+
+
+# ---------------------------------------------------------------------
+# Download accelerator
+# ---------------------------------------------------------------------
+_ACCEL_CHUNK = 2 * 1024 * 1024
+# how far (in chunks) fetching may run ahead of the bytes sent to the client
+_ACCEL_WINDOW = 16
+# work stealing only splits a chunk if both halves get at least this much
+_ACCEL_MIN_STEAL = 256 * 1024
+
+
+class DownloadAccelerator:
+    """Decides which plain-HTTP downloads are split into Range requests.
+
+    hosts are fnmatch patterns ("*.example.com"); a response from a
+    matching host qualifies, and so does any response of min_size bytes
+    or more (0 = size alone never qualifies).  Either way the server must
+    advertise Accept-Ranges: bytes and send a Content-Length.  streams is
+    the number of parallel connections per download, 0 for two per NIC.
+    """
+
+    def __init__(self, hosts=(), min_size: int = 0, streams: int = 0,
+                 chunk_size: int = _ACCEL_CHUNK, window: int = _ACCEL_WINDOW):
+        self.hosts = [h.lower() for h in hosts]
+        self.min_size = max(0, int(min_size))
+        self.streams = max(0, int(streams))
+        self.chunk_size = max(64 * 1024, int(chunk_size))
+        self.window = max(2, int(window))
+
+    def eligible(self, method: str, status: int, request: _HTTPHead,
+                 response: _HTTPHead, host: str) -> Optional[int]:
+        """Body length if this response should be accelerated, else None."""
+        if method != "GET" or status != 200 or request.get("range") is not None:
+            return None
+        if "bytes" not in response.tokens("accept-ranges") or response.get("transfer-encoding"):
+            return None
+        try:
+            length = int(response.get("content-length") or "")
+        except ValueError:
+            return None
+        if length < 2 * self.chunk_size:
+            return None
+        host = host.lower()
+        if self.min_size and length >= self.min_size:
+            return length
+        return length if any(fnmatch.fnmatchcase(host, p) for p in self.hosts) else None
+
+
+class _Chunk:
+    """Byte range [start, end) of a download; end shrinks when stolen from."""
+
+    __slots__ = ("start", "end", "buf", "filled", "owner")
+
+    def __init__(self, start: int, end: int, buf: Optional[memoryview] = None):
+        self.start = start
+        self.end = end
+        self.buf = buf
+        self.filled = 0
+        self.owner: Optional[int] = None
+
+    def remaining(self) -> int:
+        return self.end - self.start - self.filled
+
+
+class RangeDownload:
+    """One accelerated download: parallel Range requests reassembled in order.
+
+    Each stream is a thread with its own lease, so the scheduler spreads
+    the streams over the NICs by weight.  A stream claims the next chunk
+    inside the reorder window (window * chunk_size bytes past the first
+    byte not yet sent), fetches it over a keep-alive connection and
+    claims the next.  When nothing is left to claim it steals the second
+    half of the chunk with the most bytes outstanding, so a slow link
+    cannot hold up the end of the transfer.  run() sends the bytes in
+    order as they arrive.  If-Range ties every request to the validator
+    of the first response; a server that answers with anything but the
+    expected 206 aborts the download.
+    """
+
+    def __init__(self, proxy: "MultiNICSOCKSProxy", accelerator: DownloadAccelerator,
+                 host: str, port: int, addrs: List[str], request: bytes,
+                 response: _HTTPHead, total: int, cid: int = -1, client: str = ""):
+        self.proxy = proxy
+        self.client = client
+        self.host = host
+        self.port = port
+        self.addrs = addrs
+        self.total = total
+        self.cid = cid
+        self.streams = accelerator.streams or 2 * len(proxy.scheduler.ips)
+        self.window = accelerator.window * accelerator.chunk_size
+        validator = response.get("etag")
+        if validator is None or validator.startswith("W/"):  # If-Range needs a strong validator
+            validator = response.get("last-modified")
+        extra = f"If-Range: {validator}\r\n" if validator else ""
+        # the request head ends in an empty line; Range fields go before it
+        self._request = request[:-2] + extra.encode("latin-1")
+        size = accelerator.chunk_size
+        self._chunks = [_Chunk(start, min(start + size, total)) for start in range(0, total, size)]
+        self._head = 0  # first chunk not yet completely sent
+        self._lock = threading.Lock()
+        self._data = threading.Condition(self._lock)  # the sender waits for bytes
+        self._work = threading.Condition(self._lock)  # idle streams wait for chunks
+        self._alive = 0
+        self._done = False
+        self._error: Optional[BaseException] = None
+        self._handed_back = threading.Event()  # the initial stream is done with its lease
+        self.bytes_by_nic: Dict[int, int] = {}
+
+    def run(self, send, initial: Optional[Tuple[_SockReader, _Lease]] = None) -> int:
+        """Fetch the whole body, passing it to send() in order.
+
+        initial is the connection carrying the original 200 response, if
+        any: it keeps serving the first chunks sequentially until it runs
+        into one another stream has claimed.  Returns the bytes sent.
+        """
+        workers = []
+        if initial is not None:
+            self._chunks[0].owner = 0
+            self._chunks[0].buf = memoryview(bytearray(self._chunks[0].end))
+            workers.append(threading.Thread(target=self._initial, args=initial, daemon=True))
+        for wid in range(len(workers), self.streams):
+            workers.append(threading.Thread(target=self._stream, args=(wid,), daemon=True))
+        self._alive = len(workers)
+        for t in workers:
+            t.start()
+        try:
+            return self._send_all(send)
+        finally:
+            with self._lock:
+                self._done = True
+                self._work.notify_all()
+            if initial is not None:
+                # the caller releases the initial lease once we return
+                try:
+                    initial[0].sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                self._handed_back.wait()
+
+    def _send_all(self, send) -> int:
+        offset = 0
+        while offset < self.total:
+            with self._lock:
+                while True:
+                    if self._error is not None:
+                        raise self._error
+                    chunk = self._chunks[self._head]
+                    if chunk.filled > offset - chunk.start:
+                        break
+                    if self._alive == 0:
+                        raise ConnectionResetError("every Range connection failed")
+                    self._data.wait(1.0)
+                data = chunk.buf[offset - chunk.start:chunk.filled]
+            send(data)  # the region below `filled` is never written again
+            offset += len(data)
+            with self._lock:
+                if offset == chunk.end:
+                    chunk.buf = None
+                    self._head += 1
+                    self._work.notify_all()
+        return offset
+
+    def _claim(self, wid: int) -> Optional[_Chunk]:
+        """Next chunk for stream wid, or None once the download is over."""
+        with self._lock:
+            while not (self._done or self._error or self.proxy._stop_event.is_set()):
+                limit = self._chunks[self._head].start + self.window
+                victim = None
+                pending = False
+                for i in range(self._head, len(self._chunks)):
+                    chunk = self._chunks[i]
+                    if chunk.remaining() <= 0:
+                        continue
+                    pending = True
+                    if chunk.start >= limit:
+                        break
+                    if chunk.owner is None:
+                        if chunk.buf is None:
+                            chunk.buf = memoryview(bytearray(chunk.end - chunk.start))
+                        chunk.owner = wid
+                        return chunk
+                    if chunk.remaining() >= 2 * _ACCEL_MIN_STEAL and \
+                            (victim is None or chunk.remaining() > victim[1].remaining()):
+                        victim = (i, chunk)
+                if victim is not None:
+                    i, chunk = victim
+                    split = chunk.end - chunk.remaining() // 2
+                    stolen = _Chunk(split, chunk.end, chunk.buf[split - chunk.start:])
+                    stolen.owner = wid
+                    chunk.end = split  # its stream stops there and drops the connection
+                    self._chunks.insert(i + 1, stolen)
+                    return stolen
+                if not pending:
+                    return None
+                self._work.wait(1.0)
+            return None
+
+    def _receive(self, reader: _SockReader, chunk: _Chunk, lease: _Lease) -> int:
+        """Read the chunk's bytes from reader; returns the stream offset reached."""
+        pos = chunk.start + chunk.filled
+        while True:
+            with self._lock:
+                end = chunk.end
+                if pos >= end or self._done or self._error is not None:
+                    return pos
+            view = chunk.buf[pos - chunk.start:end - chunk.start]
+            if reader.buf:
+                n = min(len(reader.buf), len(view))
+                view[:n] = reader.buf[:n]
+                del reader.buf[:n]
+            else:
+                n = reader.sock.recv_into(view)
+                if not n:
+                    raise ConnectionResetError("connection closed inside a download")
+            lease.add_bytes(n)
+            if self.proxy.shaper is not None:
+                delay = self.proxy.shaper.charge(lease, n)
+                if delay:
+                    time.sleep(delay)
+            with self._lock:
+                self.bytes_by_nic[lease.index] = self.bytes_by_nic.get(lease.index, 0) + n
+                # a steal may have moved the end meanwhile; bytes past it are dropped
+                chunk.filled += max(0, min(n, chunk.end - pos))
+                pos += n
+                self._data.notify()
+
+    def _initial(self, reader: _SockReader, lease: _Lease):
+        """Consume the original response for as long as it stays useful."""
+        chunk = self._chunks[0]
+        try:
+            while True:
+                pos = self._receive(reader, chunk, lease)
+                with self._lock:
+                    if pos != chunk.end or self._done:
+                        break
+                    i = self._chunks.index(chunk) + 1
+                    if i == len(self._chunks) or self._chunks[i].owner is not None \
+                            or self._chunks[i].start - self._chunks[self._head].start >= self.window:
+                        break
+                    chunk = self._chunks[i]
+                    chunk.owner = 0
+                    chunk.buf = memoryview(bytearray(chunk.end - chunk.start))
+        except (OSError, ValueError) as e:
+            self._lost(chunk, lease, e)
+        finally:
+            with self._lock:
+                if chunk.remaining() > 0:
+                    chunk.owner = None
+                    self._work.notify_all()
+            reader.sock.close()  # unread rest of the body; the caller drops the lease
+            self._handed_back.set()
+        self._stream(0)
+
+    def _stream(self, wid: int):
+        lease = self.proxy.scheduler.acquire(family=_family(self.addrs[0]))
+        conn: Optional[_SockReader] = None
+        chunk = None
+        try:
+            while lease is not None:
+                chunk = self._claim(wid)
+                if chunk is None:
+                    break
+                if conn is None:
+                    sock, lease = self.proxy._connect_upstream(lease, self.host, self.addrs,
+                                                               self.port, self.cid)
+                    sock.settimeout(_IDLE_TIMEOUT)
+                    conn = _SockReader(sock)
+                    lease.client = self.client
+                if not self._fetch(conn, chunk, lease):
+                    self._close(conn)
+                    conn = None
+                chunk = None
+        except (OSError, ValueError) as e:
+            self._lost(chunk, lease, e)
+        finally:
+            if conn is not None:
+                self._close(conn)
+            if lease is not None:
+                lease.release()
+            with self._lock:
+                if chunk is not None:
+                    chunk.owner = None  # for another stream to resume
+                self._alive -= 1
+                self._data.notify()
+                self._work.notify_all()
+
+    def _fetch(self, conn: _SockReader, chunk: _Chunk, lease: _Lease) -> bool:
+        """One Range request for the rest of chunk; True if conn is reusable."""
+        with self._lock:
+            first, stop = chunk.start + chunk.filled, chunk.end
+        conn.sock.sendall(self._request + f"Range: bytes={first}-{stop - 1}\r\n\r\n".encode("latin-1"))
+        data = conn.read_head()
+        if data is None:
+            raise ConnectionResetError("upstream closed the connection")
+        response = _HTTPHead(data)
+        expected = f"bytes {first}-{stop - 1}/{self.total}"
+        if response.start[1] != "206" or response.get("content-range") != expected \
+                or response.get("transfer-encoding"):
+            raise ValueError(f"{self.host} answered a Range request with "
+                             f"{response.start[1]} {response.get('content-range')!r}")
+        return self._receive(conn, chunk, lease) == stop and response.keep_alive()
+
+    def _lost(self, chunk: Optional[_Chunk], lease: Optional[_Lease], error: BaseException):
+        """A stream failed: connection trouble only ends that stream, a
+        protocol violation (ValueError) ends the whole download."""
+        if self._done or self.proxy._stop_event.is_set():
+            return
+        if isinstance(error, ValueError):
+            with self._lock:
+                self._error = error
+                self._data.notify()
+                self._work.notify_all()
+        self.proxy._log(f"[WARN] download stream via "
+                        f"{lease.ip if lease is not None else '?'} failed: {error}")
+
+    def _close(self, conn: _SockReader):
+        self.proxy._registry.detach(self.cid, conn.sock)
+        conn.sock.close()
+
+
+class _ConnRegistry:
+    """Live connections of the thread engine, keyed by connection id.
+
+    Entries are dropped as soon as a connection finishes, so the registry
+    only ever holds what is currently open.  close_all() shuts every socket
+    down, which wakes the relay threads out of select()/poll() at once, and
+    then waits on a single deadline: stop() costs the same with ten or ten
+    thousand clients.
+    """
+
+    def __init__(self, limit: int = 0):
+        self.limit = limit
+        self._cond = threading.Condition()
+        self._conns: Dict[int, List[socket.socket]] = {}
+        self._ids = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._conns)
+
+    def add(self, sock: socket.socket) -> Optional[int]:
+        """Register a client socket; return None if the limit is reached."""
+        with self._cond:
+            if self.limit and len(self._conns) >= self.limit:
+                return None
+            cid = next(self._ids)
+            self._conns[cid] = [sock]
+            return cid
+
+    def attach(self, cid: int, sock: socket.socket):
+        """Track an extra socket (the upstream side) for a connection."""
+        with self._cond:
+            if cid in self._conns:
+                self._conns[cid].append(sock)
+
+    def detach(self, cid: int, sock: socket.socket):
+        """Stop tracking an upstream socket, e.g. one handed back to a pool."""
+        with self._cond:
+            group = self._conns.get(cid)
+            if group is not None and sock in group:
+                group.remove(sock)
+
+    def remove(self, cid: int):
+        with self._cond:
+            self._conns.pop(cid, None)
+            self._cond.notify_all()
+
+    def wait_for_slot(self, timeout: float) -> bool:
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self.limit or len(self._conns) < self.limit, timeout)
+
+    def close_all(self, timeout: float = _STOP_GRACE):
+        with self._cond:
+            socks = [s for group in self._conns.values() for s in group]
+        for sock in socks:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        with self._cond:
+            self._cond.wait_for(lambda: not self._conns, timeout)
+
+
+class _Rejector:
+    """Refuse clients over the connection limit without a thread each.
+
+    The method-selection reply and a 0x01 (general failure) request reply
+    are pipelined in one write right after accept().  The socket is then
+    parked in a selector served by one shared thread until the client's
+    request has arrived (or a short timeout), so close() does not reset
+    the connection before the client could read the reply.
+    """
+
+    _HOLD = 2.0  # seconds to wait for the client's request
+    _MAX_PARKED = 1024
+
+    def __init__(self):
+        import selectors
+        self._sel = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._deadlines: Dict[socket.socket, List] = {}
+
+    def reject(self, client: socket.socket):
+        import selectors
+        try:
+            client.setblocking(False)
+            client.send(struct.pack("!BB", SOCKS_VERSION, 0x00) + _REPLY_FAILURE)
+        except OSError:
+            client.close()
+            return
+        with self._lock:
+            if len(self._deadlines) >= self._MAX_PARKED:
+                client.close()
+                return
+            # [deadline, bytes received so far]
+            self._deadlines[client] = [time.monotonic() + self._HOLD, 0]
+            self._sel.register(client, selectors.EVENT_READ)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            events = self._sel.select(0.5) if self._deadlines else (time.sleep(0.5) or [])
+            now = time.monotonic()
+            with self._lock:
+                done = []
+                for key, _ in events:
+                    sock = key.fileobj
+                    try:
+                        chunk = sock.recv(4096)
+                    except OSError:
+                        chunk = b""
+                    state = self._deadlines[sock]
+                    state[1] += len(chunk)
+                    # greeting (>= 3 bytes) + request header (>= 4 bytes) seen, or EOF
+                    if not chunk or state[1] >= 7:
+                        done.append(sock)
+                done.extend(s for s, (deadline, _) in self._deadlines.items()
+                            if deadline < now and s not in done)
+                for sock in done:
+                    self._sel.unregister(sock)
+                    del self._deadlines[sock]
+                    sock.close()
+
+
+class _UDPAssociation:
+    """One SOCKS5 UDP ASSOCIATE: a client-facing socket plus one upstream
+    socket per address family, each bound to a NIC of that family."""
+
+    __slots__ = ("client_sock", "remotes", "lease", "extra_leases", "client_ip",
+                 "client_addr", "last_active", "on_expire", "closed")
+
+    def __init__(self, client_sock: socket.socket, lease: _Lease,
+                 client_ip: str, client_port: int, on_expire):
+        self.client_sock = client_sock
+        # family -> (socket, lease); the first one uses the owner's lease
+        self.remotes: Dict[int, Tuple[socket.socket, _Lease]] = {}
+        self.lease = lease
+        self.extra_leases: List[_Lease] = []  # leases the relay took itself
+        self.client_ip = client_ip
+        # learnt from the first datagram when the request left the port open
+        self.client_addr = (client_ip, client_port) if client_port else None
+        self.last_active = time.monotonic()
+        self.on_expire = on_expire
+        self.closed = False
+
+
+class _UDPRelay:
+    """Datagram relay for every UDP association of a proxy.
+
+    A single selector thread serves all associations, so there is no
+    thread per association or per packet.  Each readiness event drains up
+    to BATCH datagrams with recvfrom_into() into one preallocated buffer;
+    the SOCKS header is parsed through a memoryview and written in place
+    in front of replies, so a datagram is never copied in userspace.
+    Associations idle for _UDP_IDLE_TIMEOUT seconds are closed and their
+    owner notified through on_expire.  Datagrams to domain names use the
+    resolver cache; a miss starts a background lookup and drops the
+    datagram, as the application will retransmit.  A datagram to the
+    other address family than the association's NIC opens a second
+    upstream socket on a NIC of that family.
+    """
+
+    BATCH = 64
+    _HEADROOM = 22  # largest reply header: atyp 4 (IPv6)
+
+    def __init__(self, scheduler: NICScheduler, resolver: DNSResolver,
+                 families: FamilyPreference, health: NICHealth, log):
+        import selectors
+        self.scheduler = scheduler
+        self.resolver = resolver
+        self.families = families
+        self.health = health
+        self._log = log
+        self._sel = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._assocs: Set[_UDPAssociation] = set()
+        self._resolving: Set[str] = set()
+        self._stop = False
+        self._buf = bytearray(65536 + self._HEADROOM)
+        self._view = memoryview(self._buf)
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+
+    def open(self, bind_host: str, lease: _Lease, client_ip: str, client_port: int,
+             on_expire) -> Tuple[_UDPAssociation, Tuple[str, int]]:
+        """Create an association; returns it and the address to tell the client."""
+        import selectors
+        client_sock = self._socket(_family(bind_host), bind_host, None)
+        assoc = _UDPAssociation(client_sock, lease, client_ip, client_port, on_expire)
+        try:
+            remote_sock = self._socket(lease.family, lease.ip, lease)
+        except OSError:
+            client_sock.close()
+            raise
+        assoc.remotes[lease.family] = (remote_sock, lease)
+        with self._lock:
+            self._assocs.add(assoc)
+            self._sel.register(client_sock, selectors.EVENT_READ, (assoc, None))
+            self._sel.register(remote_sock, selectors.EVENT_READ, (assoc, lease))
+            if self._thread is None:
+                self._stop = False
+                self._sel.register(self._wake_r, selectors.EVENT_READ, None)
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+                self._thread.start()
+        self._wake_w.send(b"\0")  # select() on Windows only sees sockets registered before it started
+        return assoc, client_sock.getsockname()[:2]
+
+    def _socket(self, family: int, ip: str, lease: Optional[_Lease]) -> socket.socket:
+        """A non-blocking datagram socket bound to ip (a NIC's when lease is given)."""
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            sock.bind((ip, 0))
+        except OSError as e:
+            if lease is None:
+                sock.close()
+                raise
+            self._log(f"[WARN] bind({lease.ip}) failed: {e}, falling back to default")
+            self.health.observe(lease.index, e)
+        sock.setblocking(False)
+        for opt in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, opt, _UDP_SOCKBUF)
+            except OSError:
+                pass  # capped by net.core.rmem_max / wmem_max
+        return sock
+
+    def _remote(self, assoc: _UDPAssociation, family: int) -> Optional[socket.socket]:
+        """The association's upstream socket for family, opened on first use.
+
+        Called from the relay thread with the lock held.
+        """
+        import selectors
+        entry = assoc.remotes.get(family)
+        if entry is not None:
+            return entry[0]
+        lease = self.scheduler.acquire(family=family)
+        if lease is None:
+            return None  # no NIC of that family
+        try:
+            sock = self._socket(family, lease.ip, lease)
+        except OSError:
+            lease.release()
+            return None
+        assoc.extra_leases.append(lease)
+        assoc.remotes[family] = (sock, lease)
+        self._sel.register(sock, selectors.EVENT_READ, (assoc, lease))
+        return sock
+
+    def close(self, assoc: _UDPAssociation):
+        with self._lock:
+            if assoc.closed:
+                return
+            assoc.closed = True
+            self._assocs.discard(assoc)
+            for sock in [assoc.client_sock] + [r[0] for r in assoc.remotes.values()]:
+                self._sel.unregister(sock)
+                sock.close()
+        for lease in assoc.extra_leases:
+            lease.release()
+
+    def close_all(self):
+        with self._lock:
+            assocs = list(self._assocs)
+            self._stop = self._thread is not None
+        for assoc in assocs:
+            self.close(assoc)
+        try:
+            self._wake_w.send(b"\0")
+        except OSError:
+            pass
+
+    def __len__(self) -> int:
+        return len(self._assocs)
+
+    def _loop(self):
+        next_sweep = time.monotonic() + 5
+        while not self._stop:
+            events = self._sel.select(1.0)
+            with self._lock:
+                for key, _ in events:
+                    if key.data is None:
+                        try:
+                            self._wake_r.recv(4096)
+                        except BlockingIOError:
+                            pass
+                        continue
+                    assoc, lease = key.data
+                    if assoc.closed:
+                        continue
+                    if lease is None:
+                        self._from_client(assoc)
+                    else:
+                        self._from_remote(assoc, key.fileobj, lease)
+            now = time.monotonic()
+            if now >= next_sweep:
+                next_sweep = now + 5
+                idle = [a for a in list(self._assocs) if now - a.last_active > _UDP_IDLE_TIMEOUT]
+                for assoc in idle:
+                    self.close(assoc)
+                    try:
+                        assoc.on_expire()
+                    except Exception:
+                        pass
+        with self._lock:
+            self._sel.unregister(self._wake_r)
+            self._thread = None
+
+    def _from_client(self, assoc: _UDPAssociation):
+        """Unwrap datagrams from the client and send them out through a NIC."""
+        buf, view = self._buf, self._view
+        sent: Dict[int, int] = {}
+        for _ in range(self.BATCH):
+            try:
+                n, addr = assoc.client_sock.recvfrom_into(buf)
+            except BlockingIOError:
+                break
+            except OSError:
+                continue  # e.g. ICMP port unreachable from an earlier reply
+            if _unmap(addr[0]) != assoc.client_ip:
+                continue  # RFC 1928: only the client that asked may use the relay
+            if assoc.client_addr is None:
+                assoc.client_addr = addr
+            elif addr[:2] != assoc.client_addr[:2]:
+                continue
+            # RSV(2) FRAG(1) ATYP(1) DST.ADDR DST.PORT DATA; fragments are dropped
+            if n < 10 or buf[2] != 0:
+                continue
+            atyp = buf[3]
+            if atyp == 1:
+                host = socket.inet_ntoa(view[4:8])
+                offset = 8
+            elif atyp == 4:
+                host = socket.inet_ntop(socket.AF_INET6, view[4:20])
+                offset = 20
+            elif atyp == 3:
+                offset = 5 + buf[4]
+                try:
+                    host = self._resolve(bytes(view[5:offset]).decode("ascii", "replace"))
+                except OSError:
+                    continue
+                if host is None:
+                    continue
+            else:
+                continue
+            if n < offset + 2:
+                continue
+            port = (buf[offset] << 8) | buf[offset + 1]
+            family = _family(host)
+            remote = self._remote(assoc, family)
+            if remote is None:
+                continue
+            try:
+                sent[family] = sent.get(family, 0) + remote.sendto(view[offset + 2:n], (host, port))
+            except BlockingIOError:
+                break  # socket buffer full: drop, as a router would
+            except OSError as e:
+                if _is_path_error(e):
+                    self.health.observe(assoc.remotes[family][1].index, e)
+        if sent:
+            assoc.last_active = time.monotonic()
+            for family, n in sent.items():
+                assoc.remotes[family][1].add_bytes(n, upload=True)
+
+    def _from_remote(self, assoc: _UDPAssociation, sock: socket.socket, lease: _Lease):
+        """Wrap datagrams from the internet in a SOCKS header for the client."""
+        buf, view = self._buf, self._view
+        room = self._HEADROOM
+        received = 0
+        for _ in range(self.BATCH):
+            try:
+                # leave room for the header in front of the payload
+                n, addr = sock.recvfrom_into(view[room:])
+            except BlockingIOError:
+                break
+            except OSError:
+                continue
+            if assoc.client_addr is None:
+                continue  # the client has not sent anything yet
+            header = b"\x00\x00\x00" + _socks5_addr(addr[0], addr[1])
+            start = room - len(header)
+            buf[start:room] = header
+            try:
+                assoc.client_sock.sendto(view[start:room + n], assoc.client_addr)
+            except BlockingIOError:
+                break
+            except OSError:
+                continue
+            received += n
+        if received:
+            assoc.last_active = time.monotonic()
+            lease.add_bytes(received)
+
+    def _resolve(self, host: str) -> Optional[str]:
+        """Cached address of host, or None while a lookup runs in the background."""
+        if _is_ip_literal(host):
+            return host
+        with self.resolver._lock:
+            addrs = self.resolver._cached(host)
+        if addrs is not None:
+            # stick to one family per host: a flow must not flip mid-stream
+            usable = [a for a in addrs if _family(a) in self.families.families]
+            if not usable:
+                raise OSError(errno.EAFNOSUPPORT, f"no NIC can reach {host}")
+            preferred = self.families.preferred(host)
+            return next((a for a in usable if _family(a) == preferred), usable[0])
+        if host not in self._resolving:
+            self._resolving.add(host)
+            threading.Thread(target=self._lookup, args=(host,), daemon=True).start()
+        return None
+
+    def _lookup(self, host: str):
+        try:
+            self.resolver.resolve(host)
+        except OSError:
+            pass
+        finally:
+            with self._lock:
+                self._resolving.discard(host)
+
+
+class MultiNICSOCKSProxy:
+    def __init__(self, listen_host: str, listen_port: int,
+                 ip_weights: List[Tuple[str, int]], quiet: bool = False,
+                 engine: str = "threads", relay: str = "auto",
+                 max_connections: int = 0, admission: str = "queue",
+                 scheduler="wrr", resolver: Optional[DNSResolver] = None,
+                 hedge_delay: float = 0, health: Optional[Dict] = None,
+                 auto_weights: str = "off", affinity_ttl: float = 0,
+                 shared: Optional[SharedNICTable] = None, worker: int = 0,
+                 metrics_port: int = 0, accelerate: Optional[Dict] = None,
+                 shaping: Optional[Dict] = None,
+                 profiles: Optional[Dict[str, SocketProfile]] = None,
+                 top_talkers: int = 0, access_log: Optional[Dict] = None, log=print):
+        """scheduler is a SCHEDULERS name or a NICScheduler instance;
+        resolver defaults to a DNSResolver using the system resolver.
+
+        hedge_delay (seconds, 0 = off) races a second connect attempt on
+        another NIC when the first has not completed within the delay.
+
+        health holds NICHealth keyword arguments (probe_target,
+        probe_interval, failure_threshold, ...).
+
+        auto_weights ("off", "prior" or "cap") lets AdaptiveWeights retune
+        the NIC weights from measured throughput and RTT.
+
+        affinity_ttl (seconds, 0 = off) pins each (client IP, destination
+        host) pair to one NIC via an AffinityRing.
+
+        shared makes this proxy worker number `worker` of a
+        WorkerSupervisor: the scheduler counts load in the SharedNICTable
+        and the listener binds with SO_REUSEPORT.
 
-SOCKS_VERSION = 5
+        metrics_port (0 = off) serves self.metrics in the Prometheus text
+        format at http://127.0.0.1:<port>/metrics.
 
-class _WeightedRoundRobin:
-    """Return items according to weight in a simple round-robin cycle."""
+        accelerate holds DownloadAccelerator keyword arguments (hosts,
+        min_size, streams, ...); qualifying HTTP downloads are then fetched
+        as parallel Range requests spread over the NICs.
 
-    def __init__(self, items: List[Tuple[str, int]]):
-        expanded = []
-        for ip, w in items:
-            expanded.extend([ip] * max(1, int(w)))
-        self._cycle = itertools.cycle(expanded)
+        shaping holds Shaper keyword arguments (nic_rates, client_rate,
+        bulk_rate in bytes/s) to cap bandwidth with token buckets.
 
-    def next(self) -> str:
-        return next(self._cycle)
+        profiles maps source IPs to the SocketProfile applied to their
+        upstream sockets (buffers, congestion control, TFO, keepalive,
+        connect timeout); NICs without one get the defaults.
 
-class MultiNICSOCKSProxy:
-    def __init__(self, listen_host: str, listen_port: int,
-                 ip_weights: List[Tuple[str, int]], quiet: bool = False):
+        top_talkers (0 = off) keeps a TopTalkers sketch with that many
+        counters per NIC and key kind in self.talkers.
+
+        access_log holds AccessLog keyword arguments (path, max_bytes,
+        rotate_interval, backups, ...) to write one JSON line per upstream
+        connection.
+
+        log receives every log line unless quiet is set; an embedding
+        application such as the GUI passes its own function.
+
+        max_connections caps concurrent clients (0 = unlimited).  Once it
+        is reached, admission="queue" makes new clients wait for a free slot
+        and admission="reject" answers them straight away with SOCKS reply
+        0x01."""
+        if engine not in ENGINES:
+            raise ValueError(f"unknown engine {engine!r}, expected one of {ENGINES}")
+        if relay not in RELAY_MODES:
+            raise ValueError(f"unknown relay mode {relay!r}, expected one of {RELAY_MODES}")
+        if relay == "splice" and not _SPLICE_AVAILABLE:
+            raise ValueError("splice relay requires Linux and Python 3.10+")
+        if admission not in ADMISSION_MODES:
+            raise ValueError(f"unknown admission mode {admission!r}, expected one of {ADMISSION_MODES}")
         self.listen_host = listen_host
         self.listen_port = listen_port
         self.ip_weights = ip_weights
         self.quiet = quiet
-        self._rr = _WeightedRoundRobin(ip_weights)
-        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.log = log
+        self.engine = engine
+        self.relay = relay
+        self._use_splice = relay != "copy" and _SPLICE_AVAILABLE
+        self.max_connections = max(0, int(max_connections))
+        self.admission = admission
+        self._async: Optional[_AsyncioEngine] = None
+        self.scheduler = make_scheduler(scheduler, ip_weights)
+        if affinity_ttl > 0:
+            self.scheduler.enable_affinity(affinity_ttl)
+        if shared is not None:
+            self.scheduler.share(shared, worker)
+        self.resolver = resolver if resolver is not None else DNSResolver()
+        self.families = FamilyPreference(self.scheduler.families)
+        self.hedge_delay = max(0.0, float(hedge_delay))
+        self.health = NICHealth(self.scheduler, log=self._log, **(health or {}))
+        if auto_weights not in AUTO_WEIGHT_MODES:
+            raise ValueError(f"unknown auto-weight mode {auto_weights!r}, expected one of {AUTO_WEIGHT_MODES}")
+        self.auto_weights = None if auto_weights == "off" else \
+            AdaptiveWeights(self.scheduler, mode=auto_weights, log=self._log)
+        self.metrics = Metrics(self)
+        self.metrics_port = metrics_port
+        self.accelerator = DownloadAccelerator(**accelerate) if accelerate is not None else None
+        self.shaper = Shaper(self.scheduler.ips, **shaping) if shaping else None
+        self.talkers = TopTalkers(self.scheduler.ips, top_talkers) if top_talkers > 0 else None
+        self.scheduler.talkers = self.talkers
+        self.access_log = AccessLog(log=self._log, **access_log) if access_log else None
+        self.scheduler.access_log = self.access_log
+        profiles = profiles or {}
+        unknown = set(profiles) - set(self.scheduler.ips)
+        if unknown:
+            raise ValueError(f"socket profile given for unknown NIC(s) {', '.join(sorted(unknown))}")
+        self.profiles = [profiles.get(ip) or SocketProfile() for ip in self.scheduler.ips]
+        self._profile_warned: Set[int] = set()
+        self._metrics_server: Optional[_MetricsServer] = None
+        self._server = socket.socket(_family(listen_host), socket.SOCK_STREAM)
         self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if shared is not None:
+            # the kernel spreads accepts over all workers listening on the port
+            self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        if _family(listen_host) == socket.AF_INET6:
+            try:
+                # "::" then accepts IPv4 clients too (as ::ffff:a.b.c.d)
+                self._server.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+            except (AttributeError, OSError):
+                pass
         self._stop_event = threading.Event()
-        self._threads: List[threading.Thread] = []
+        self._accept_thread: Optional[threading.Thread] = None
+        self._registry = _ConnRegistry(self.max_connections)
+        self._rejector = _Rejector()
+        self._http_pool = _UpstreamPool(close=lambda r: r.sock.close(), alive=_SockReader.idle)
+        self._udp = _UDPRelay(self.scheduler, self.resolver, self.families, self.health, self._log)
 
     # ------------------------------------------------------------
     # Public API
     # ------------------------------------------------------------
     def start(self):
         self._server.bind((self.listen_host, self.listen_port))
-        self._server.listen(128)
-        t = threading.Thread(target=self._accept_loop, daemon=True)
-        t.start()
-        self._threads.append(t)
-        if not self.quiet:
-            print(f"[INFO] SOCKS5 server started on {self.listen_host}:{self.listen_port}")
+        self.health.start()
+        if self.auto_weights is not None:
+            self.auto_weights.start()
+        for ip, profile in zip(self.scheduler.ips, self.profiles):
+            if str(profile) != str(SocketProfile()):
+                self._log(f"[INFO] {ip} socket profile: {profile}")
+        if self.access_log is not None:
+            self.access_log.start()
+            self._log(f"[INFO] access log: {self.access_log.path}")
+        if self.metrics_port:
+            self._metrics_server = _MetricsServer(self.metrics, "127.0.0.1", self.metrics_port)
+            self._log(f"[INFO] metrics at http://127.0.0.1:{self._metrics_server.port}/metrics")
+        if self.engine == "asyncio":
+            self._async = _AsyncioEngine(self)
+            self._async.start()
+        else:
+            self._server.listen(128)
+            self._accept_thread = threading.Thread(target=self._accept_loop, daemon=True)
+            self._accept_thread.start()
+        self._log(f"[INFO] SOCKS5/HTTP server started on {self.listen_host}:{self.listen_port} ({self.engine} engine)")
 
     def stop(self):
         self._stop_event.set()
+        self.health.stop()
+        if self.auto_weights is not None:
+            self.auto_weights.stop()
+        if self._metrics_server is not None:
+            self._metrics_server.close()
+            self._metrics_server = None
+        if self._async is not None:
+            self._async.stop()
+            self._async = None
+        try:
+            # shutdown() wakes a thread blocked in accept(); close() alone does not on Linux
+            self._server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
         try:
             self._server.close()
         except Exception:
             pass
-        for th in self._threads:
-            if th.is_alive():
-                th.join(timeout=0.2)
-        if not self.quiet:
-            print("[INFO] SOCKS5 server stopped")
+        self._udp.close_all()
+        self._registry.close_all()
+        self._http_pool.close_all()
+        if self._accept_thread is not None:
+            self._accept_thread.join(timeout=_STOP_GRACE)
+            self._accept_thread = None
+        if self.access_log is not None:
+            self.access_log.close()
+        self._log("[INFO] SOCKS5/HTTP server stopped")
+
+    def download(self, url: str, out, headers: Optional[Dict[str, str]] = None) -> int:
+        """Fetch an http:// URL into the binary file object `out`.
+
+        The body is fetched as parallel Range requests over the NICs when
+        the server supports them and the response is large enough for two
+        chunks; otherwise it is read over the one connection.  Uses the
+        proxy's accelerator settings, or the defaults when it has none.
+        Returns the number of bytes written; raises OSError or ValueError
+        (for HTTP errors and protocol violations).
+        """
+        host, port, path = _http_target("GET", url)
+        fields = "".join(f"{k}: {v}\r\n" for k, v in (headers or {}).items())
+        head = _HTTPHead(f"GET {path} HTTP/1.1\r\n{fields}\r\n".encode("latin-1"))
+        request = _http_upstream_head(head, path, host, port)
+        addrs = self.families.order(host, self._resolve(host))
+        lease = self.scheduler.acquire(family=_family(addrs[0]))
+        upstream: Optional[_SockReader] = None
+        try:
+            sock, lease = self._connect_upstream(lease, host, addrs, port, -1)
+            sock.settimeout(_IDLE_TIMEOUT)
+            upstream = _SockReader(sock, shaper=self.shaper)
+            sock.sendall(request)
+            while True:
+                data = upstream.read_head()
+                if data is None:
+                    raise ConnectionResetError("upstream closed the connection")
+                response = _HTTPHead(data)
+                status = int(response.start[1])
+                if status >= 200:
+                    break
+            if status != 200:
+                raise ValueError(f"{url}: HTTP {status} {response.start[2]}")
+            accelerator = self.accelerator or DownloadAccelerator(min_size=1)
+            size = accelerator.eligible("GET", status, head, response, host)
+            if size is not None:
+                download = RangeDownload(self, accelerator, host, port, addrs, request, response, size)
+                return download.run(out.write, initial=(upstream, lease))
+            written = 0
+
+            def write(data):
+                nonlocal written
+                out.write(data)
+                written += len(data)
+
+            upstream.read_body(write, _http_response_body("GET", status, response), lease)
+            return written
+        finally:
+            if upstream is not None:
+                upstream.sock.close()
+            if lease is not None:
+                lease.release()
 
     # ------------------------------------------------------------
     # Internal
     # ------------------------------------------------------------
+    def active_connections(self) -> int:
+        """Number of client connections currently open."""
+        if self._async is not None:
+            return len(self._async._conns)
+        return len(self._registry)
+
     def _accept_loop(self):
+        queue = self.admission == "queue"
         while not self._stop_event.is_set():
+            # in queue mode leave new clients in the kernel backlog until a slot frees up
+            if queue and not self._registry.wait_for_slot(0.5):
+                continue
             try:
                 client, addr = self._server.accept()
             except OSError:
                 break  # socket closed
-            t = threading.Thread(target=self._handle_client, args=(client,), daemon=True)
-            t.start()
-            self._threads.append(t)
+            cid = self._registry.add(client)
+            if cid is None:
+                self.metrics.error("rejected")
+                self._rejector.reject(client)
+                continue
+            try:
+                threading.Thread(target=self._handle_client, args=(client, cid), daemon=True).start()
+            except RuntimeError as e:  # can't start new thread
+                self._registry.remove(cid)
+                self._log(f"[WARN] rejecting client: {e}")
+                self.metrics.error("rejected")
+                self._rejector.reject(client)
 
     def _log(self, msg: str):
         if not self.quiet:
-            print(msg)
+            self.log(msg)
 
-    def _handle_client(self, client: socket.socket):
+    def _connected(self, index: int, sock: socket.socket, rtt: float):
+        """Bookkeeping for a completed upstream handshake through NIC `index`."""
+        self.health.observe_connected(index, sock)
+        self.metrics.observe(self.metrics.connect[index], rtt)
+        if self.auto_weights is not None:
+            self.auto_weights.record_rtt(index, rtt)
+
+    def _connect_failed(self, index: int, error: BaseException):
+        self.health.observe(index, error)
+        self.metrics.connect_failed(index)
+
+    def _resolve(self, host: str) -> List[str]:
+        """resolver.resolve() with the lookup time recorded in metrics.dns."""
+        if _is_ip_literal(host):
+            return self.resolver.resolve(host)
+        started = time.monotonic()
+        addrs = self.resolver.resolve(host)
+        self.metrics.observe(self.metrics.dns, time.monotonic() - started)
+        return addrs
+
+    def _handle_client(self, client: socket.socket, cid: int):
+        remote = None
+        lease = None
+        started = time.monotonic()
         try:
-            if not self._socks5_handshake(client):
-                client.close()
+            parser = _Socks5Parser()
+            n = client.recv_into(parser.space())
+            if not n:
                 return
-            dest_addr, dest_port = self._socks5_parse_request(client)
-            if dest_addr is None:
-                client.close()
+            if parser.buf[0] in _HTTP_METHOD_START:
+                self._handle_http(client, cid, started, bytes(parser.view[:n]))
                 return
-            # choose interface
-            src_ip = self._rr.next()
-            remote = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            parser.received(n)
             try:
-                # bind to chosen NIC
-                remote.bind((src_ip, 0))
-            except OSError as e:
-                self._log(f"[WARN] bind({src_ip}) failed: {e}, falling back to default")
-            remote.settimeout(10)
-            remote.connect((dest_addr, dest_port))
+                if not self._socks5_negotiate(client, parser):
+                    return
+            except ValueError:
+                self.metrics.error("protocol")
+                return
+            cmd, dest_addr, dest_port = parser.cmd, parser.host, parser.port
+            self.metrics.observe(self.metrics.handshake, time.monotonic() - started)
+            self.metrics.connection("udp" if cmd == _CMD_UDP_ASSOCIATE else "socks")
+            if cmd == _CMD_UDP_ASSOCIATE:
+                lease = self.scheduler.acquire()
+                self._udp_associate(client, lease, dest_port)
+                return
+            addrs = self.families.order(dest_addr, self._resolve(dest_addr))
+            # choose interface
+            peer = _unmap(client.getpeername()[0])
+            lease = self.scheduler.acquire(key=(peer, dest_addr), family=_family(addrs[0]))
+            lease.client = peer
+            remote, lease = self._connect_upstream(lease, dest_addr, addrs, dest_port, cid)
             # reply success to client
             reply = b"\x05\x00\x00\x01" + socket.inet_aton("0.0.0.0") + struct.pack("!H", 0)
             client.sendall(reply)
-            self._relay_tcp(client, remote)
+            early = parser.early
+            if early:  # payload the client pipelined behind its request
+                remote.sendall(early)
+                lease.add_bytes(len(early), upload=True)
+            self._relay_tcp(client, remote, lease)
         except Exception as e:
-            self._log(f"[ERR] client error: {e}")
+            if lease is not None:
+                lease.fail(e)
+            if not self._stop_event.is_set():
+                self.metrics.error(_error_cause(e))
+                self._log(f"[ERR] client error: {e}")
+        finally:
+            for sock in (client, remote):
+                if sock is not None:
+                    try:
+                        sock.close()
+                    except Exception:
+                        pass
+            if lease is not None:
+                lease.release()
+            self._registry.remove(cid)
+
+    def _connect_upstream(self, lease: _Lease, host: str, addrs: List[str], port: int,
+                          cid: int) -> Tuple[socket.socket, _Lease]:
+        """Connect to the first reachable address in addrs.
+
+        addrs comes from FamilyPreference.order(); when the attempts move
+        on to the other address family the lease is traded for a NIC of
+        that family, and each attempt's connect time feeds the preference.
+        Returns the socket and the lease of the NIC it went out on; the
+        given lease is released here if that is a different one.  On
+        failure the given lease is left to the caller.
+        """
+        hedge = self.hedge_delay and len(self.scheduler.ips) > 1
+        error: Optional[OSError] = None
+        current = lease
+        try:
+            for addr in addrs:
+                family = _family(addr)
+                if current.family != family:
+                    other = self.scheduler.acquire(family=family)
+                    if other is None:
+                        continue
+                    if current is not lease:
+                        current.release()
+                    current = other
+                started = time.monotonic()
+                try:
+                    if hedge:
+                        remote, won = self._connect_hedged(current, addr, port, cid)
+                    else:
+                        remote, won = self._connect_one(current, addr, port, cid), current
+                except OSError as e:
+                    error = e
+                    self.families.failed(host, family)
+                    continue
+                elapsed = time.monotonic() - started
+                self.families.record(host, family, elapsed)
+                if current is not lease:
+                    lease.release()
+                current = lease  # handed over to the caller as `won`
+                won.host, won.port, won.connect_time = host, port, elapsed
+                return remote, won
+            error = error or OSError(errno.EAFNOSUPPORT, f"no NIC can reach {host}")
+            lease.host, lease.port = host, port
+            lease.fail(error)
+            raise error
         finally:
+            if current is not lease:
+                current.release()
+
+    def _connect_one(self, lease: _Lease, addr: str, port: int, cid: int) -> socket.socket:
+        remote = self._bound_socket(lease, cid)
+        remote.settimeout(self.profiles[lease.index].connect_timeout)
+        started = time.monotonic()
+        try:
+            remote.connect((addr, port))
+        except OSError as e:
+            self._registry.detach(cid, remote)
+            remote.close()
+            self._connect_failed(lease.index, e)
+            raise
+        self._connected(lease.index, remote, time.monotonic() - started)
+        return remote
+
+    def _bound_socket(self, lease: _Lease, cid: int) -> socket.socket:
+        remote = socket.socket(lease.family, socket.SOCK_STREAM)
+        self._registry.attach(cid, remote)
+        try:
+            # bind to chosen NIC
+            remote.bind((lease.ip, 0))
+        except OSError as e:
+            self._log(f"[WARN] bind({lease.ip}) failed: {e}, falling back to default")
+            self.health.observe(lease.index, e)
+        self._tune(lease, remote)
+        return remote
+
+    def _tune(self, lease: _Lease, sock: socket.socket):
+        """Apply the NIC's SocketProfile; what fails is logged once per NIC."""
+        failed = self.profiles[lease.index].apply(sock)
+        if failed and lease.index not in self._profile_warned:
+            self._profile_warned.add(lease.index)
+            self._log(f"[WARN] {lease.ip}: socket options not applied: {', '.join(failed)}")
+
+    def _connect_hedged(self, lease: _Lease, addr: str, port: int,
+                        cid: int) -> Tuple[socket.socket, _Lease]:
+        """Race the handshake on a second NIC once hedge_delay has passed.
+
+        Both attempts are non-blocking connects waited on together, so no
+        extra thread is needed.  The hedge starts early if the first
+        attempt fails outright.
+        """
+        attempts: List[Tuple[socket.socket, _Lease, float]] = []
+        error: Optional[OSError] = None
+
+        def launch(l: _Lease):
+            sock = self._bound_socket(l, cid)
+            sock.setblocking(False)
+            err = sock.connect_ex((addr, port))
+            if err not in _CONNECT_PENDING:
+                self._registry.detach(cid, sock)
+                sock.close()
+                e = OSError(err, os.strerror(err))
+                self._connect_failed(l.index, e)
+                raise e
+            attempts.append((sock, l, time.monotonic()))
+
+        now = time.monotonic()
+        deadline = now + self.profiles[lease.index].connect_timeout
+        hedge_at = now + self.hedge_delay
+        hedged = False
+        winner = None
+        try:
             try:
-                client.close()
-            except Exception:
-                pass
+                launch(lease)
+            except OSError as e:
+                error = e
+            while winner is None:
+                now = time.monotonic()
+                if not hedged and (now >= hedge_at or not attempts):
+                    hedged = True
+                    extra = self.scheduler.acquire(exclude=(lease.index,), family=lease.family)
+                    if extra is not None:
+                        try:
+                            launch(extra)
+                        except OSError as e:
+                            extra.release()
+                            error = e
+                if not attempts:
+                    raise error
+                if now >= deadline:
+                    raise socket.timeout("connect timed out")
+                wait = (deadline if hedged else min(hedge_at, deadline)) - now
+                for sock in _wait_writable([a[0] for a in attempts], wait):
+                    err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    entry = next(a for a in attempts if a[0] is sock)
+                    if err == 0:
+                        winner = entry
+                        self._connected(entry[1].index, sock, time.monotonic() - entry[2])
+                        break
+                    attempts.remove(entry)
+                    self._registry.detach(cid, sock)
+                    sock.close()
+                    error = OSError(err, os.strerror(err))
+                    self._connect_failed(entry[1].index, error)
+                    if entry[1] is not lease:
+                        entry[1].release()
+        finally:
+            for sock, l, _ in attempts:
+                if winner is None or sock is not winner[0]:
+                    self._registry.detach(cid, sock)
+                    sock.close()
+                    if winner is None and time.monotonic() >= deadline:
+                        self._connect_failed(l.index, socket.timeout("connect timed out"))
+                    if l is not lease:
+                        l.release()
+        sock, won, _ = winner
+        if won is not lease:
+            lease.release()
+        sock.setblocking(True)
+        return sock, won
 
-    # ---- SOCKS5 helpers --------------------------------------------------
-    def _socks5_handshake(self, client: socket.socket) -> bool:
-        data = client.recv(2)
-        if len(data) < 2 or data[0] != SOCKS_VERSION:
-            return False
-        n_methods = data[1]
-        methods = client.recv(n_methods)
-        # we only support NO AUTH (0x00)
-        if 0x00 not in methods:
-            # no acceptable methods
-            client.sendall(struct.pack("!BB", SOCKS_VERSION, 0xFF))
+    # ---- HTTP proxy ------------------------------------------------------
+    def _handle_http(self, client: socket.socket, cid: int, started: float, first: bytes):
+        """Serve an HTTP/1.1 proxy client: CONNECT tunnels and absolute-URI
+        requests, the latter repeatedly while the client keeps the
+        connection alive.  first holds the bytes already read."""
+        client.settimeout(_IDLE_TIMEOUT)
+        reader = _SockReader(client, upload=True, shaper=self.shaper)
+        reader.buf += first
+        peer = _unmap(client.getpeername()[0])
+        self.metrics.connection("http")
+        while not self._stop_event.is_set():
+            try:
+                data = reader.read_head()
+                if data is None:
+                    return
+                head = _HTTPHead(data)
+                host, port, path = _http_target(head.start[0], head.start[1])
+            except socket.timeout:
+                return  # idle keep-alive connection
+            except ValueError:
+                self.metrics.error("protocol")
+                client.sendall(_http_error(400, "Bad Request"))
+                return
+            if started:
+                self.metrics.observe(self.metrics.handshake, time.monotonic() - started)
+                started = 0
+            if head.start[0] == "CONNECT":
+                self._http_tunnel(client, reader, cid, peer, host, port)
+                return
+            if not self._http_forward(client, reader, cid, peer, head, host, port, path):
+                return
+
+    def _http_tunnel(self, client: socket.socket, reader: _SockReader, cid: int,
+                     peer: str, host: str, port: int):
+        lease = None
+        remote = None
+        try:
+            try:
+                addrs = self.families.order(host, self._resolve(host))
+                lease = self.scheduler.acquire(key=(peer, host), family=_family(addrs[0]))
+                lease.client = peer
+                remote, lease = self._connect_upstream(lease, host, addrs, port, cid)
+            except OSError:
+                client.sendall(_http_error(502, "Bad Gateway"))
+                raise
+            client.sendall(_HTTP_ESTABLISHED)
+            if reader.buf:  # bytes the client pipelined behind the CONNECT head
+                remote.sendall(reader.buf)
+                lease.add_bytes(len(reader.buf), upload=True)
+            self._relay_tcp(client, remote, lease)
+        except Exception as e:
+            if lease is not None:
+                lease.fail(e)
+            raise
+        finally:
+            if remote is not None:
+                self._registry.detach(cid, remote)
+                remote.close()
+            if lease is not None:
+                lease.release()
+
+    def _http_forward(self, client: socket.socket, reader: _SockReader, cid: int,
+                      peer: str, head: _HTTPHead, host: str, port: int, path: str) -> bool:
+        """Forward one request over a pooled or new upstream connection.
+
+        Returns True if the client connection can carry another request.
+        A pooled connection the server has meanwhile closed is replaced
+        by a fresh one, as long as the request had no body to replay.
+        """
+        method = head.start[0]
+        try:
+            length = _http_request_body(head)
+        except ValueError:
+            client.sendall(_http_error(501, "Not Implemented"))
             return False
-        # reply NO AUTH
-        client.sendall(struct.pack("!BB", SOCKS_VERSION, 0x00))
-        return True
-
-    def _socks5_parse_request(self, client: socket.socket):
-        # request: ver, cmd, rsv, atyp
-        data = client.recv(4)
-        if len(data) < 4:
-            return None, None
-        ver, cmd, _, atyp = data
-        if ver != SOCKS_VERSION or cmd != 1:  # CONNECT only
-            return None, None
-        if atyp == 1:  # IPv4
-            addr = socket.inet_ntoa(client.recv(4))
-        elif atyp == 3:  # domain
-            domain_len = client.recv(1)[0]
-            addr = client.recv(domain_len).decode()
-        else:
-            return None, None
-        port = struct.unpack("!H", client.recv(2))[0]
-        return addr, port
+        if (head.get("expect") or "").lower() == "100-continue":
+            client.sendall(_HTTP_CONTINUE)
+        request = _http_upstream_head(head, path, host, port)
+        lease = None
+        upstream: Optional[_SockReader] = None
+        replied = False
+        try:
+            addrs = self.families.order(host, self._resolve(host))
+            lease = self.scheduler.acquire(key=(peer, host), family=_family(addrs[0]))
+            lease.client = peer
+            while True:
+                upstream = self._http_pool.get((lease.index, host, port))
+                reused = upstream is not None
+                if reused:
+                    self._registry.attach(cid, upstream.sock)
+                    lease.host, lease.port = host, port
+                else:
+                    sock, lease = self._connect_upstream(lease, host, addrs, port, cid)
+                    sock.settimeout(_IDLE_TIMEOUT)
+                    upstream = _SockReader(sock, shaper=self.shaper)
+                lease.client = peer
+                try:
+                    upstream.sock.sendall(request)
+                    if length:
+                        reader.copy_to(upstream.sock, length, lease)
+                    data = upstream.read_head()
+                    if data is None:
+                        raise ConnectionResetError("upstream closed the connection")
+                    break
+                except OSError:
+                    self._registry.detach(cid, upstream.sock)
+                    upstream.sock.close()
+                    upstream = None
+                    if not reused or length:
+                        raise
+            response = _HTTPHead(data)
+            status = int(response.start[1])
+            while status < 200 and status != 101:
+                client.sendall(data)  # interim 1xx response
+                data = upstream.read_head()
+                if data is None:
+                    raise ConnectionResetError("upstream closed the connection")
+                response = _HTTPHead(data)
+                status = int(response.start[1])
+            if status == 101:
+                client.sendall(response.rewrite(" ".join(response.start), "upgrade",
+                                                [f"Upgrade: {response.get('upgrade')}"]))
+                replied = True
+                if reader.buf:
+                    upstream.sock.sendall(reader.buf)
+                if upstream.buf:
+                    client.sendall(upstream.buf)
+                self._relay_tcp(client, upstream.sock, lease)
+                return False
+            size = None if self.accelerator is None else \
+                self.accelerator.eligible(method, status, head, response, host)
+            if size is not None:
+                keep = head.keep_alive()
+                client.sendall(response.rewrite(" ".join(response.start), "keep-alive" if keep else "close"))
+                replied = True
+                download = RangeDownload(self, self.accelerator, host, port, addrs,
+                                         request, response, size, cid, peer)
+                download.run(client.sendall, initial=(upstream, lease))
+                return keep
+            body = _http_response_body(method, status, response)
+            keep = body is not None and head.keep_alive()
+            client.sendall(response.rewrite(" ".join(response.start), "keep-alive" if keep else "close"))
+            replied = True
+            upstream.copy_to(client, body, lease)
+            if body is not None and response.keep_alive():
+                self._registry.detach(cid, upstream.sock)
+                self._http_pool.put((lease.index, host, port), upstream)
+                upstream = None
+            return keep
+        except (OSError, ValueError) as e:
+            if lease is not None:
+                lease.fail(e)
+            if not replied:
+                try:
+                    client.sendall(_http_error(502, "Bad Gateway"))
+                except OSError:
+                    pass
+            raise
+        finally:
+            if upstream is not None:
+                self._registry.detach(cid, upstream.sock)
+                upstream.sock.close()
+            if lease is not None:
+                lease.release()
+
+    # ---- SOCKS5 helpers --------------------------------------------------
+    def _socks5_negotiate(self, client: socket.socket, parser: _Socks5Parser) -> bool:
+        """Answer the greeting and read the request into parser.
+
+        Returns False if the client offers no acceptable method or hangs
+        up; raises ValueError on malformed messages.
+        """
+        replied = False
+        while True:
+            state = parser.parse()
+            if state != parser.GREETING and not replied:
+                # we only support NO AUTH (0x00)
+                if 0x00 not in parser.methods:
+                    client.sendall(struct.pack("!BB", SOCKS_VERSION, 0xFF))
+                    return False
+                client.sendall(struct.pack("!BB", SOCKS_VERSION, 0x00))
+                replied = True
+            if state == parser.DONE:
+                return True
+            n = client.recv_into(parser.space())
+            if not n:
+                return False
+            parser.received(n)
+
+    def _udp_associate(self, client: socket.socket, lease: _Lease, client_port: int):
+        """Relay the client's datagrams through the leased NIC until its
+        control connection closes (RFC 1928) or the association idles out."""
+        def expire():
+            try:
+                client.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        assoc, (host, port) = self._udp.open(_unmap(client.getsockname()[0]), lease,
+                                             _unmap(client.getpeername()[0]), client_port, expire)
+        try:
+            client.sendall(b"\x05\x00\x00" + _socks5_addr(host, port))
+            while client.recv(4096):
+                pass
+        finally:
+            self._udp.close(assoc)
 
     # ---- Data relay ------------------------------------------------------
-    def _relay_tcp(self, sock1: socket.socket, sock2: socket.socket):
+    def _relay_tcp(self, sock1: socket.socket, sock2: socket.socket, lease: _Lease):
+        """Relay between client (sock1) and upstream (sock2) until both
+        directions have reached EOF.  An EOF is passed on with
+        shutdown(SHUT_WR) (half-close), so protocols that finish sending
+        and then wait for the answer keep working."""
+        try:
+            lease.client = _unmap(sock1.getpeername()[0])
+            for sock in (sock1, sock2):
+                try:
+                    # forward small writes at once; bulk writes are full segments anyway
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                except OSError:
+                    pass
+            if not (self._use_splice and self._relay_splice(sock1, sock2, lease)):
+                self._relay_copy(sock1, sock2, lease)
+        finally:
+            try:
+                sock1.close()
+            except Exception:
+                pass
+            try:
+                sock2.close()
+            except Exception:
+                pass
+
+    def _relay_copy(self, sock1: socket.socket, sock2: socket.socket, lease: _Lease):
+        """Portable relay: recv_into() a pooled buffer, send() it on.
+
+        A direction reads again only after everything it holds has been
+        sent, and waits for the destination to become writable when a
+        send() is partial, so a slow receiver throttles its sender instead
+        of failing it.  Buffers come from _BUFFERS and grow from 16 KiB to
+        256 KiB while reads keep filling them.  A direction the shaper
+        holds back is simply not read until its pause is over.
+        """
+        sock1.setblocking(False)
+        sock2.setblocking(False)
+        shaper = self.shaper
+        # per direction: [src, dst, buf, start, end, eof, upload, last read filled buf,
+        #                 shaped until (monotonic time)]
+        dirs = [[sock1, sock2, _BUFFERS.get(_COPY_SIZES[0]), 0, 0, False, True, False, 0.0],
+                [sock2, sock1, _BUFFERS.get(_COPY_SIZES[0]), 0, 0, False, False, False, 0.0]]
+        try:
+            while True:
+                now = time.monotonic() if shaper is not None else 0.0
+                paused = [d[8] - now for d in dirs if d[8] > now]
+                readers = [d[0] for d in dirs if not d[5] and d[3] == d[4] and d[8] <= now]
+                writers = [d[1] for d in dirs if d[3] < d[4]]
+                if not readers and not writers and not paused:
+                    return  # both directions done
+                readable, writable = _wait_ready(readers, writers, min(paused, default=_IDLE_TIMEOUT))
+                if not readable and not writable and not paused:
+                    return  # idle timeout
+                for d in dirs:
+                    src, dst, buf, start, end, eof, upload, _, _ = d
+                    if start == end:
+                        if eof or src.fileno() not in readable:
+                            continue
+                        try:
+                            n = src.recv_into(buf)
+                        except BlockingIOError:
+                            continue
+                        if n == 0:
+                            d[5] = True
+                            try:
+                                dst.shutdown(socket.SHUT_WR)
+                            except OSError:
+                                pass
+                            continue
+                        start, end = 0, n
+                        d[7] = n == len(buf)
+                        if shaper is not None:
+                            delay = shaper.charge(lease, n)
+                            if delay:
+                                d[8] = time.monotonic() + delay
+                    elif dst.fileno() not in writable:
+                        continue
+                    # send straight away; wait for writability only when it would block
+                    try:
+                        sent = dst.send(memoryview(buf)[start:end])
+                    except BlockingIOError:
+                        sent = 0
+                    if sent:
+                        lease.add_bytes(sent, upload)
+                    start += sent
+                    if start < end:
+                        d[3], d[4] = start, end
+                        continue
+                    d[3] = d[4] = 0
+                    if d[7] and len(buf) < _COPY_SIZES[-1]:
+                        # reads fill the buffer: a bulk flow, move up to the next size
+                        d[2] = _BUFFERS.swap(buf, _COPY_SIZES[_COPY_SIZES.index(len(buf)) + 1])
+        finally:
+            for d in dirs:
+                _BUFFERS.put(d[2])
+
+    def _relay_splice(self, sock1: socket.socket, sock2: socket.socket, lease: _Lease) -> bool:
+        """Zero-copy relay: socket -> pipe -> socket with os.splice().
+
+        Each direction owns a kernel pipe.  Bytes parked in a pipe because
+        the destination is not writable are flushed before more is read
+        from the source, so at most one pipe's worth is buffered per
+        direction.  Returns False without touching the stream if the kernel
+        refuses to splice these sockets, letting the caller fall back to
+        the copy loop.  poll() is used instead of select() because the two
+        pipes per connection push descriptor numbers past FD_SETSIZE long
+        before the thread engine runs out of threads.
+        """
         sock1.setblocking(False)
         sock2.setblocking(False)
+        flags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+        shaper = self.shaper
+        # per direction: [src_fd, dst_fd, pipe_r, pipe_w, pending, eof, dst_sock, shaped until]
+        dirs = []
+        try:
+            for src, dst in ((sock1, sock2), (sock2, sock1)):
+                pr, pw = os.pipe()
+                _grow_pipe(pw)
+                dirs.append([src.fileno(), dst.fileno(), pr, pw, 0, False, dst, 0.0])
+            poller = select.poll()
+            moved = False
+            while True:
+                now = time.monotonic() if shaper is not None else 0.0
+                paused = [d[7] - now for d in dirs if d[7] > now]
+                events = {}
+                for d in dirs:
+                    if d[4]:
+                        events[d[1]] = events.get(d[1], 0) | select.POLLOUT
+                    elif not d[5] and d[7] <= now:
+                        events[d[0]] = events.get(d[0], 0) | select.POLLIN
+                if not events and not paused:
+                    return True  # both directions done
+                for fd, mask in events.items():
+                    poller.register(fd, mask)
+                ready = dict(poller.poll(min(paused, default=_IDLE_TIMEOUT) * 1000))
+                for fd in events:
+                    poller.unregister(fd)
+                if not ready and not paused:
+                    break  # timeout
+                for upload, d in zip((True, False), dirs):
+                    src, dst, pr, pw, pending, eof, _, _ = d
+                    src_ready = pending == 0 and not eof and \
+                        ready.get(src, 0) & (select.POLLIN | select.POLLHUP | select.POLLERR)
+                    if src_ready:
+                        try:
+                            n = os.splice(src, pw, _SPLICE_CHUNK, flags=flags)
+                        except BlockingIOError:
+                            continue
+                        except OSError as e:
+                            if not moved and e.errno in (errno.EINVAL, errno.ENOSYS):
+                                return False
+                            raise
+                        if n == 0:  # EOF: pass it on, keep the other direction going
+                            d[5] = True
+                            try:
+                                d[6].shutdown(socket.SHUT_WR)
+                            except OSError:
+                                pass
+                            continue
+                        moved = True
+                        d[4] = pending = n
+                        if shaper is not None:
+                            delay = shaper.charge(lease, n)
+                            if delay:
+                                d[7] = time.monotonic() + delay
+                    if pending and (src_ready or ready.get(dst, 0) & (select.POLLOUT | select.POLLHUP | select.POLLERR)):
+                        # try to flush straight away; poll() only when it would block
+                        try:
+                            sent = os.splice(pr, dst, pending, flags=flags)
+                        except BlockingIOError:
+                            continue
+                        d[4] -= sent
+                        lease.add_bytes(sent, upload)
+            return True
+        finally:
+            for d in dirs:
+                os.close(d[2])
+                os.close(d[3])
+
+
+def _wait_writable(socks: List[socket.socket], timeout: float) -> List[socket.socket]:
+    """Wait until some of socks finished a non-blocking connect()."""
+    if hasattr(select, "poll"):
+        poller = select.poll()
+        by_fd = {}
+        for sock in socks:
+            by_fd[sock.fileno()] = sock
+            poller.register(sock, select.POLLOUT)
+        return [by_fd[fd] for fd, _ in poller.poll(max(0.0, timeout) * 1000)]
+    # Windows reports a failed connect in the exception set, not the write set
+    _, w, x = select.select([], socks, socks, max(0.0, timeout))
+    return list(dict.fromkeys(w + x))
+
+
+def _wait_ready(readers: List[socket.socket], writers: List[socket.socket],
+                timeout: float) -> Tuple[Set[int], Set[int]]:
+    """Wait for readable/writable sockets; returns their file descriptors."""
+    if not readers and not writers:
+        time.sleep(timeout)  # only shaped directions left: select() rejects empty sets on Windows
+        return set(), set()
+    if hasattr(select, "poll"):
+        poller = select.poll()
+        masks: Dict[int, int] = {}
+        for sock in readers:
+            masks[sock.fileno()] = select.POLLIN
+        for sock in writers:
+            masks[sock.fileno()] = masks.get(sock.fileno(), 0) | select.POLLOUT
+        for fd, mask in masks.items():
+            poller.register(fd, mask)
+        readable, writable = set(), set()
+        for fd, ev in poller.poll(timeout * 1000):
+            # errors and hangups are reported to whichever side is waiting; recv/send raise them
+            if ev & (select.POLLIN | select.POLLHUP | select.POLLERR) and masks[fd] & select.POLLIN:
+                readable.add(fd)
+            if ev & (select.POLLOUT | select.POLLHUP | select.POLLERR) and masks[fd] & select.POLLOUT:
+                writable.add(fd)
+        return readable, writable
+    r, w, _ = select.select(readers, writers, [], timeout)
+    return {s.fileno() for s in r}, {s.fileno() for s in w}
+
+
+class _BufferPool:
+    """Free lists of relay buffers by size, shared by all connections.
+
+    list.append() and list.pop() are atomic, so no lock is needed.
+    """
+
+    def __init__(self, keep: int = 64):
+        self.keep = keep  # free buffers kept per size
+        self._free: Dict[int, List[bytearray]] = {}
+
+    def get(self, size: int) -> bytearray:
+        try:
+            return self._free[size].pop()
+        except (KeyError, IndexError):
+            return bytearray(size)
+
+    def put(self, buf: bytearray):
+        free = self._free.setdefault(len(buf), [])
+        if len(free) < self.keep:
+            free.append(buf)
+
+    def swap(self, buf: bytearray, size: int) -> bytearray:
+        """Return buf to the pool and get one of another size."""
+        self.put(buf)
+        return self.get(size)
+
+
+_BUFFERS = _BufferPool()
+
+
+def _grow_pipe(fd: int):
+    """Enlarge a pipe to _SPLICE_CHUNK bytes so a splice() moves more per call."""
+    try:
+        import fcntl
+        fcntl.fcntl(fd, getattr(fcntl, "F_SETPIPE_SZ", 1031), _SPLICE_CHUNK)
+    except (ImportError, OSError):
+        pass  # keep the default 64 KiB pipe
+
+
+# ---------------------------------------------------------------------
+# asyncio engine
+# ---------------------------------------------------------------------
+def _raise_nofile_limit():
+    """Lift the soft RLIMIT_NOFILE to the hard limit (POSIX only, best effort).
+
+    Every proxied connection holds two sockets, so 10k clients need ~20k
+    descriptors while most distributions default the soft limit to 1024.
+    """
+    try:
+        import resource
+    except ImportError:
+        return  # Windows: no per-process descriptor limit to lift
+    try:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard == resource.RLIM_INFINITY or soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ValueError, OSError):
+        pass
+
+
+class _AsyncConn:
+    """Per-connection state tracked by the asyncio engine."""
+
+    __slots__ = ("task", "last_active", "writers", "peer")
+
+    def __init__(self, task: "asyncio.Task", now: float, peer: str = ""):
+        self.task = task
+        self.last_active = now
+        self.writers: List[asyncio.StreamWriter] = []
+        self.peer = peer  # client IP
+
+
+class _AsyncioEngine:
+    """Serve the proxy's listening socket from one asyncio event loop.
+
+    The loop runs in a background thread so that start()/stop() keep the
+    same non-blocking semantics as the thread engine.  Memory per
+    connection is bounded by the StreamReader limit and the transport
+    write-buffer high-water mark, which pause the producing side instead of
+    buffering without limit.
+    """
+
+    def __init__(self, proxy: "MultiNICSOCKSProxy"):
+        self.proxy = proxy
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._conns: Set[_AsyncConn] = set()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._ready = threading.Event()
+        self._error: Optional[BaseException] = None
+        self._http_pool = _UpstreamPool(close=lambda c: c[1].transport.abort(),
+                                        alive=lambda c: not (c[1].is_closing() or c[0].at_eof()))
+
+    # ---- lifecycle -------------------------------------------------------
+    def start(self):
+        _raise_nofile_limit()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+
+    def stop(self):
+        loop = self._loop
+        if loop is None or not loop.is_running():
+            return
+        fut = asyncio.run_coroutine_threadsafe(self._shutdown(), loop)
+        try:
+            fut.result(timeout=5)
+        except Exception:
+            pass
+        loop.call_soon_threadsafe(loop.stop)
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        self._loop = loop
+        asyncio.set_event_loop(loop)
+        try:
+            if self.proxy.max_connections:
+                self._slots = asyncio.Semaphore(self.proxy.max_connections)
+            self.proxy._server.setblocking(False)
+            self._server = loop.run_until_complete(asyncio.start_server(
+                self._handle_client, sock=self.proxy._server,
+                limit=_ASYNC_READ_LIMIT, backlog=_ASYNC_BACKLOG))
+            loop.create_task(self._idle_sweeper())
+        except BaseException as e:
+            self._error = e
+            self._ready.set()
+            loop.close()
+            return
+        self._ready.set()
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+    async def _shutdown(self):
+        if self._server is not None:
+            self._server.close()
+        self._http_pool.close_all()
+        for conn in self._conns:
+            for w in conn.writers:
+                w.transport.abort()
+        others = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in others:
+            task.cancel()
+        if others:
+            await asyncio.wait(others, timeout=_STOP_GRACE)
+
+    async def _idle_sweeper(self):
+        """Close relays that saw no traffic for _IDLE_TIMEOUT seconds.
+
+        A single periodic task is far cheaper than one timer per read when
+        thousands of connections are open.
+        """
+        loop = asyncio.get_running_loop()
         while True:
-            r, _, _ = select.select([sock1, sock2], [], [], 60)
-            if not r:
-                break  # timeout
-            if sock1 in r:
-                data = sock1.recv(4096)
-                if not data:
+            await asyncio.sleep(5)
+            deadline = loop.time() - _IDLE_TIMEOUT
+            for conn in list(self._conns):
+                if conn.last_active < deadline:
+                    conn.task.cancel()
+
+    # ---- per-client coroutine --------------------------------------------
+    async def _handle_client(self, reader: asyncio.StreamReader,
+                             writer: asyncio.StreamWriter):
+        if self._slots is not None and not await self._admit():
+            self.proxy.metrics.error("rejected")
+            await self._reject(reader, writer)
+            return
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        conn = _AsyncConn(asyncio.current_task(), loop.time(),
+                          _unmap(writer.get_extra_info("peername")[0]))
+        conn.writers.append(writer)
+        self._conns.add(conn)
+        lease = None
+        failed = False
+        try:
+            first = await reader.readexactly(1)
+            if first[0] in _HTTP_METHOD_START:
+                await self._handle_http(first, reader, writer, conn, started)
+                return
+            parser = _Socks5Parser()
+            parser.feed(first)
+            try:
+                if not await self._socks5_negotiate(parser, reader, writer):
+                    return
+            except ValueError:
+                self.proxy.metrics.error("protocol")
+                return
+            cmd, dest_addr, dest_port = parser.cmd, parser.host, parser.port
+            metrics = self.proxy.metrics
+            metrics.observe(metrics.handshake, time.monotonic() - started)
+            metrics.connection("udp" if cmd == _CMD_UDP_ASSOCIATE else "socks")
+            if cmd == _CMD_UDP_ASSOCIATE:
+                lease = self.proxy.scheduler.acquire()
+                await self._udp_associate(reader, writer, conn, lease, dest_port)
+                return
+            addrs = self.proxy.families.order(dest_addr, await self._resolve(dest_addr))
+            lease = self.proxy.scheduler.acquire(key=(conn.peer, dest_addr), family=_family(addrs[0]))
+            lease.client = conn.peer
+            r_reader, r_writer, lease = await self._open_upstream(lease, dest_addr, addrs, dest_port)
+            conn.writers.append(r_writer)
+            writer.write(b"\x05\x00\x00\x01" + socket.inet_aton("0.0.0.0") + struct.pack("!H", 0))
+            early = parser.early
+            if early:  # payload the client pipelined behind its request
+                r_writer.write(early)
+                lease.add_bytes(len(early), upload=True)
+            await writer.drain()
+            conn.last_active = loop.time()
+            await asyncio.gather(self._pipe(reader, r_writer, conn, lease, upload=True),
+                                 self._pipe(r_reader, writer, conn, lease))
+        except asyncio.CancelledError:
+            failed = True
+        except asyncio.IncompleteReadError:
+            failed = True  # client went away mid-handshake
+        except ConnectionError as e:
+            # client or upstream went away mid-handshake/relay
+            failed = True
+            if lease is not None:
+                lease.fail(e)
+            self.proxy.metrics.error(_error_cause(e))
+        except Exception as e:
+            failed = True
+            if lease is not None:
+                lease.fail(e)
+            self.proxy.metrics.error(_error_cause(e))
+            self.proxy._log(f"[ERR] client error: {e}")
+        finally:
+            try:
+                if not failed:
+                    await self._close_writers(conn)
+            except asyncio.CancelledError:
+                pass  # shutdown or idle sweep while flushing: abort below
+            finally:
+                self._conns.discard(conn)
+                for w in conn.writers:
+                    w.transport.abort()
+                if lease is not None:
+                    lease.release()
+                if self._slots is not None:
+                    self._slots.release()
+
+    @staticmethod
+    async def _close_writers(conn: _AsyncConn):
+        """Close a connection that ended normally without losing data.
+
+        drain() only waits for the write buffer to fall below its high-water
+        mark, so up to _ASYNC_READ_LIMIT bytes may still be queued; close()
+        sends them first and wait_closed() returns once they are out.  A
+        peer that stops reading is cut off by the idle sweeper.
+        """
+        for w in conn.writers:
+            w.close()
+        for w in conn.writers:
+            try:
+                await w.wait_closed()
+            except (OSError, ConnectionError):
+                pass
+
+    async def _resolve(self, host: str) -> List[str]:
+        """Coroutine version of MultiNICSOCKSProxy._resolve."""
+        resolver = self.proxy.resolver
+        if _is_ip_literal(host):
+            return await resolver.resolve_async(host)
+        started = time.monotonic()
+        addrs = await resolver.resolve_async(host)
+        metrics = self.proxy.metrics
+        metrics.observe(metrics.dns, time.monotonic() - started)
+        return addrs
+
+    async def _admit(self) -> bool:
+        """Take a connection slot, waiting in queue mode."""
+        if not self._slots.locked():
+            await self._slots.acquire()  # never blocks: a slot is free
+            return True
+        if self.proxy.admission == "reject":
+            return False
+        try:
+            await asyncio.wait_for(self._slots.acquire(), _QUEUE_TIMEOUT)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _reject(self, reader, writer):
+        """Complete the greeting and answer the request with reply 0x01
+        (or 503 Service Unavailable for an HTTP client)."""
+        try:
+            first = await asyncio.wait_for(reader.readexactly(1), 5)
+            if first[0] in _HTTP_METHOD_START:
+                writer.write(_http_error(503, "Service Unavailable"))
+                await writer.drain()
+            else:
+                parser = _Socks5Parser()
+                parser.feed(first)
+                if await asyncio.wait_for(self._socks5_negotiate(parser, reader, writer, request=False), 5):
+                    writer.write(_REPLY_FAILURE)
+                    await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.transport.abort()
+
+    async def _socks5_negotiate(self, parser: _Socks5Parser, reader, writer,
+                                request: bool = True) -> bool:
+        """Coroutine version of MultiNICSOCKSProxy._socks5_negotiate;
+        with request=False it returns right after the greeting reply."""
+        replied = False
+        while True:
+            state = parser.parse()
+            if state != parser.GREETING and not replied:
+                if 0x00 not in parser.methods:
+                    writer.write(struct.pack("!BB", SOCKS_VERSION, 0xFF))
+                    await writer.drain()
+                    return False
+                writer.write(struct.pack("!BB", SOCKS_VERSION, 0x00))
+                await writer.drain()
+                replied = True
+                if not request:
+                    return True
+            if state == parser.DONE:
+                return True
+            data = await reader.read(len(parser.space()))
+            if not data:
+                return False
+            parser.feed(data)
+
+    async def _udp_associate(self, reader, writer, conn: _AsyncConn,
+                             lease: _Lease, client_port: int):
+        """Coroutine version of MultiNICSOCKSProxy._udp_associate."""
+        loop = asyncio.get_running_loop()
+        assoc, (host, port) = self.proxy._udp.open(
+            _unmap(writer.get_extra_info("sockname")[0]), lease,
+            _unmap(writer.get_extra_info("peername")[0]),
+            client_port, lambda: loop.call_soon_threadsafe(conn.task.cancel))
+        # the UDP relay expires idle associations itself
+        conn.last_active = float("inf")
+        try:
+            writer.write(b"\x05\x00\x00" + _socks5_addr(host, port))
+            await writer.drain()
+            while await reader.read(4096):
+                pass
+        finally:
+            self.proxy._udp.close(assoc)
+
+    # ---- HTTP proxy ------------------------------------------------------
+    async def _handle_http(self, first: bytes, reader, writer, conn: _AsyncConn, started: float):
+        """Coroutine version of MultiNICSOCKSProxy._handle_http."""
+        loop = asyncio.get_running_loop()
+        peer = _unmap(writer.get_extra_info("peername")[0])
+        metrics = self.proxy.metrics
+        metrics.connection("http")
+        while True:
+            try:
+                data = first + await reader.readuntil(b"\r\n\r\n")
+                head = _HTTPHead(data)
+                host, port, path = _http_target(head.start[0], head.start[1])
+            except asyncio.IncompleteReadError:
+                return
+            except (asyncio.LimitOverrunError, ValueError):
+                metrics.error("protocol")
+                writer.write(_http_error(400, "Bad Request"))
+                await writer.drain()
+                return
+            if started:
+                metrics.observe(metrics.handshake, time.monotonic() - started)
+                started = 0
+            first = b""
+            conn.last_active = loop.time()
+            if head.start[0] == "CONNECT":
+                await self._http_tunnel(reader, writer, conn, peer, host, port)
+                return
+            if not await self._http_forward(reader, writer, conn, peer, head, host, port, path):
+                return
+
+    async def _http_tunnel(self, reader, writer, conn: _AsyncConn,
+                           peer: str, host: str, port: int):
+        lease = None
+        try:
+            try:
+                addrs = self.proxy.families.order(host, await self._resolve(host))
+                lease = self.proxy.scheduler.acquire(key=(peer, host), family=_family(addrs[0]))
+                lease.client = peer
+                r_reader, r_writer, lease = await self._open_upstream(lease, host, addrs, port)
+            except (OSError, asyncio.TimeoutError):
+                writer.write(_http_error(502, "Bad Gateway"))
+                raise
+            conn.writers.append(r_writer)
+            writer.write(_HTTP_ESTABLISHED)
+            await writer.drain()
+            await asyncio.gather(self._pipe(reader, r_writer, conn, lease, upload=True),
+                                 self._pipe(r_reader, writer, conn, lease))
+        except Exception as e:
+            if lease is not None:
+                lease.fail(e)
+            raise
+        finally:
+            if lease is not None:
+                lease.release()
+
+    async def _http_forward(self, reader, writer, conn: _AsyncConn, peer: str,
+                            head: _HTTPHead, host: str, port: int, path: str) -> bool:
+        """Coroutine version of MultiNICSOCKSProxy._http_forward."""
+        method = head.start[0]
+        try:
+            length = _http_request_body(head)
+        except ValueError:
+            writer.write(_http_error(501, "Not Implemented"))
+            await writer.drain()
+            return False
+        if (head.get("expect") or "").lower() == "100-continue":
+            writer.write(_HTTP_CONTINUE)
+        request = _http_upstream_head(head, path, host, port)
+        lease = None
+        upstream = None
+        replied = False
+        try:
+            addrs = self.proxy.families.order(host, await self._resolve(host))
+            lease = self.proxy.scheduler.acquire(key=(peer, host), family=_family(addrs[0]))
+            lease.client = peer
+            while True:
+                upstream = self._http_pool.get((lease.index, host, port))
+                reused = upstream is not None
+                if reused:
+                    lease.host, lease.port = host, port
+                else:
+                    r_reader, r_writer, lease = await self._open_upstream(lease, host, addrs, port)
+                    upstream = (r_reader, r_writer)
+                r_reader, r_writer = upstream
+                conn.writers.append(r_writer)
+                lease.client = peer
+                try:
+                    r_writer.write(request)
+                    if length:
+                        await self._http_copy_body(reader, r_writer, length, conn, lease, upload=True)
+                    await r_writer.drain()
+                    data = await r_reader.readuntil(b"\r\n\r\n")
                     break
-                sock2.sendall(data)
-            if sock2 in r:
-                data = sock2.recv(4096)
-                if not data:
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    conn.writers.remove(r_writer)
+                    r_writer.transport.abort()
+                    upstream = None
+                    if not reused or length:
+                        raise
+            response = _HTTPHead(data)
+            status = int(response.start[1])
+            while status < 200 and status != 101:
+                writer.write(data)  # interim 1xx response
+                data = await r_reader.readuntil(b"\r\n\r\n")
+                response = _HTTPHead(data)
+                status = int(response.start[1])
+            if status == 101:
+                writer.write(response.rewrite(" ".join(response.start), "upgrade",
+                                              [f"Upgrade: {response.get('upgrade')}"]))
+                replied = True
+                await asyncio.gather(self._pipe(reader, r_writer, conn, lease, upload=True),
+                                     self._pipe(r_reader, writer, conn, lease))
+                return False
+            accelerator = self.proxy.accelerator
+            size = None if accelerator is None else \
+                accelerator.eligible(method, status, head, response, host)
+            if size is not None:
+                # the Range streams are threads; chunk 0 is fetched again rather
+                # than read from this connection
+                conn.writers.remove(r_writer)
+                r_writer.transport.abort()
+                upstream = None
+                keep = head.keep_alive()
+                writer.write(response.rewrite(" ".join(response.start), "keep-alive" if keep else "close"))
+                replied = True
+                await writer.drain()
+                loop = asyncio.get_running_loop()
+                download = RangeDownload(self.proxy, accelerator, host, port, addrs,
+                                         request, response, size, client=peer)
+
+                def send(data):
+                    asyncio.run_coroutine_threadsafe(self._send(writer, conn, data), loop).result()
+
+                await loop.run_in_executor(None, download.run, send)
+                return keep
+            body = _http_response_body(method, status, response)
+            keep = body is not None and head.keep_alive()
+            writer.write(response.rewrite(" ".join(response.start), "keep-alive" if keep else "close"))
+            replied = True
+            await self._http_copy_body(r_reader, writer, body, conn, lease)
+            if body is not None and response.keep_alive():
+                conn.writers.remove(r_writer)
+                self._http_pool.put((lease.index, host, port), upstream)
+                upstream = None
+            return keep
+        except (OSError, ValueError, asyncio.TimeoutError,
+                asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+            if lease is not None:
+                lease.fail(e)
+            if not replied:
+                writer.write(_http_error(502, "Bad Gateway"))
+            raise
+        finally:
+            if upstream is not None:
+                if upstream[1] in conn.writers:
+                    conn.writers.remove(upstream[1])
+                upstream[1].transport.abort()
+            if lease is not None:
+                lease.release()
+
+    async def _send(self, writer: asyncio.StreamWriter, conn: _AsyncConn, data):
+        conn.last_active = asyncio.get_running_loop().time()
+        writer.write(data)
+        await writer.drain()
+
+    async def _http_copy_body(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                              length: Optional[int], conn: _AsyncConn, lease: _Lease,
+                              upload: bool = False):
+        """Coroutine version of _SockReader.copy_to."""
+        if length != _BODY_CHUNKED:
+            await self._http_copy(reader, writer, length, conn, lease, upload)
+            return
+        while True:
+            line = await reader.readuntil(b"\n")
+            writer.write(line)
+            size = int(line.split(b";", 1)[0], 16)
+            if size == 0:
+                break
+            await self._http_copy(reader, writer, size + 2, conn, lease, upload)
+        while True:  # trailer fields up to the empty line
+            line = await reader.readuntil(b"\n")
+            writer.write(line)
+            if line in (b"\r\n", b"\n"):
+                break
+        await writer.drain()
+
+    async def _http_copy(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                         n: Optional[int], conn: _AsyncConn, lease: _Lease, upload: bool):
+        """Copy n bytes (None: until EOF)."""
+        loop = asyncio.get_running_loop()
+        while n is None or n > 0:
+            data = await reader.read(_ASYNC_CHUNK if n is None else min(n, _ASYNC_CHUNK))
+            if not data:
+                if n is None:
                     break
-                sock1.sendall(data)
+                raise asyncio.IncompleteReadError(b"", n)
+            conn.last_active = loop.time()
+            writer.write(data)
+            lease.add_bytes(len(data), upload)
+            if self.proxy.shaper is not None:
+                delay = self.proxy.shaper.charge(lease, len(data))
+                if delay:
+                    await asyncio.sleep(delay)
+            if n is not None:
+                n -= len(data)
+            await writer.drain()
+        await writer.drain()
+
+    async def _open_upstream(self, lease: _Lease, host: str, addrs: List[str], dest_port: int):
+        """Connect to the first reachable address; see MultiNICSOCKSProxy._connect_upstream."""
+        proxy = self.proxy
+        hedge = proxy.hedge_delay and len(proxy.scheduler.ips) > 1
+        error: Optional[BaseException] = None
+        current = lease
         try:
-            sock1.close()
-        except Exception:
-            pass
+            for addr in addrs:
+                family = _family(addr)
+                if current.family != family:
+                    other = proxy.scheduler.acquire(family=family)
+                    if other is None:
+                        continue
+                    if current is not lease:
+                        current.release()
+                    current = other
+                started = time.monotonic()
+                try:
+                    if hedge:
+                        remote, won = await self._connect_hedged(current, addr, dest_port)
+                    else:
+                        remote, won = await self._connect_one(current, addr, dest_port), current
+                except (OSError, asyncio.TimeoutError) as e:
+                    error = e
+                    proxy.families.failed(host, family)
+                    continue
+                elapsed = time.monotonic() - started
+                proxy.families.record(host, family, elapsed)
+                try:
+                    reader, writer = await asyncio.open_connection(sock=remote, limit=_ASYNC_READ_LIMIT)
+                except BaseException:
+                    remote.close()
+                    if won is not current:
+                        won.release()
+                    raise
+                if current is not won and current is not lease:
+                    current.release()
+                if lease is not won:
+                    lease.release()
+                current = lease  # nothing left for the finally clause
+                won.host, won.port, won.connect_time = host, dest_port, elapsed
+                return reader, writer, won
+            error = error or OSError(errno.EAFNOSUPPORT, f"no NIC can reach {host}")
+            lease.host, lease.port = host, dest_port
+            lease.fail(error)
+            raise error
+        finally:
+            if current is not lease:
+                current.release()
+
+    async def _connect_one(self, lease: _Lease, addr: str, port: int) -> socket.socket:
+        remote = socket.socket(lease.family, socket.SOCK_STREAM)
+        remote.setblocking(False)
+        started = time.monotonic()
         try:
-            sock2.close()
-        except Exception:
+            try:
+                remote.bind((lease.ip, 0))
+            except OSError as e:
+                self.proxy._log(f"[WARN] bind({lease.ip}) failed: {e}, falling back to default")
+                self.proxy.health.observe(lease.index, e)
+            self.proxy._tune(lease, remote)
+            await asyncio.wait_for(asyncio.get_running_loop().sock_connect(remote, (addr, port)),
+                                   self.proxy.profiles[lease.index].connect_timeout)
+        except asyncio.CancelledError:
+            remote.close()  # lost a hedge race or shutting down: no verdict on the NIC
+            raise
+        except BaseException as e:
+            remote.close()
+            self.proxy._connect_failed(lease.index, e)
+            raise
+        self.proxy._connected(lease.index, remote, time.monotonic() - started)
+        return remote
+
+    async def _connect_hedged(self, lease: _Lease, addr: str, port: int):
+        """Coroutine version of MultiNICSOCKSProxy._connect_hedged.
+
+        Unlike the thread version the losing primary lease is not released
+        here but by _open_upstream, once the stream is set up.
+        """
+        primary = asyncio.ensure_future(self._connect_one(lease, addr, port))
+        tasks: Dict[asyncio.Future, _Lease] = {primary: lease}
+        error: Optional[BaseException] = None
+        winner = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=self.proxy.hedge_delay)
+            if not done or primary.exception() is not None:
+                extra = self.proxy.scheduler.acquire(exclude=(lease.index,), family=lease.family)
+                if extra is not None:
+                    tasks[asyncio.ensure_future(self._connect_one(extra, addr, port))] = extra
+            while winner is None and tasks:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and winner is None:
+                        winner = (task.result(), tasks.pop(task))
+                        continue
+                    l = tasks.pop(task)
+                    if task.exception() is None:
+                        task.result().close()  # both finished at once; keep the first
+                    else:
+                        error = task.exception()
+                    if l is not lease:
+                        l.release()
+        finally:
+            for task, l in tasks.items():
+                task.cancel()
+                if l is not lease:
+                    l.release()
+        if winner is None:
+            raise error
+        return winner
+
+    async def _pipe(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                    conn: _AsyncConn, lease: _Lease, upload: bool = False):
+        loop = asyncio.get_running_loop()
+        writer.transport.set_write_buffer_limits(high=_ASYNC_READ_LIMIT)
+        shaper = self.proxy.shaper
+        lease.client = conn.peer
+        try:
+            while True:
+                data = await reader.read(_ASYNC_CHUNK)
+                if not data:
+                    break
+                conn.last_active = loop.time()
+                writer.write(data)
+                lease.add_bytes(len(data), upload)
+                await writer.drain()
+                if shaper is not None:
+                    delay = shaper.charge(lease, len(data))
+                    if delay:
+                        await asyncio.sleep(delay)
+        except Exception as e:
+            lease.fail(e)
+            conn.task.cancel()  # a reset ends both directions
+            raise
+        # half-close: pass the EOF on and let the other direction finish
+        if writer.can_write_eof():
+            writer.write_eof()
+        else:
+            conn.task.cancel()
+
+
+class WorkerSupervisor:
+    """Run the proxy in several forked processes sharing one listen port.
+
+    Each worker binds the port with SO_REUSEPORT, so the kernel balances
+    incoming connections across processes and the relay work is no longer
+    bound to one core by the GIL.  Scheduler load and NIC health go
+    through a SharedNICTable, so weights and least-conn/least-bytes hold
+    across all workers.  The supervisor only waits for its children,
+    restarts any that die and forwards SIGINT/SIGTERM.  POSIX only.
+
+    make_proxy(port, table, worker) builds a worker's (not yet started)
+    MultiNICSOCKSProxy.
+    """
+
+    RESTART_DELAY = 1.0  # seconds; also the pause before restarting a worker that died at once
+
+    def __init__(self, workers: int, nics: int, make_proxy, listen_host: str,
+                 listen_port: int, log=print):
+        if not (hasattr(os, "fork") and hasattr(socket, "SO_REUSEPORT")):
+            raise ValueError("worker processes require os.fork() and SO_REUSEPORT (Linux, BSD, macOS)")
+        if workers < 1:
+            raise ValueError("at least one worker is required")
+        self.workers = workers
+        self.table = SharedNICTable(nics, workers)
+        self.listen_host = listen_host
+        self.listen_port = listen_port
+        self._make_proxy = make_proxy
+        self._log = log
+        self._pids: Dict[int, int] = {}  # pid -> worker number
+        self._started = [0.0] * workers
+        self._stopping = False
+        self._reserve: Optional[socket.socket] = None
+
+    def run(self):
+        """Start the workers and supervise them until stop() or a signal."""
+        family = _family(self.listen_host)
+        # a bound but not listening socket holds the port across worker
+        # restarts (and turns port 0 into a real one) without taking connections
+        self._reserve = socket.socket(family, socket.SOCK_STREAM)
+        self._reserve.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._reserve.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        if family == socket.AF_INET6:
+            try:
+                self._reserve.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+            except (AttributeError, OSError):
+                pass
+        self._reserve.bind((self.listen_host, self.listen_port))
+        self.listen_port = self._reserve.getsockname()[1]
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: self.stop())
+        for w in range(self.workers):
+            self._spawn(w)
+        self._log(f"[INFO] {self.workers} workers serving {self.listen_host}:{self.listen_port}")
+        try:
+            while self._pids:
+                try:
+                    pid, status = os.wait()
+                except ChildProcessError:
+                    break
+                w = self._pids.pop(pid, None)
+                if w is None:
+                    continue
+                self.table.reset(w)
+                if self._stopping:
+                    continue
+                code = os.waitstatus_to_exitcode(status)
+                reason = f"signal {-code}" if code < 0 else f"exit code {code}"
+                self._log(f"[WARN] worker {w} (pid {pid}) died with {reason}, restarting")
+                if time.monotonic() - self._started[w] < self.RESTART_DELAY:
+                    time.sleep(self.RESTART_DELAY)
+                if not self._stopping:
+                    self._spawn(w)
+        finally:
+            self._reserve.close()
+
+    def stop(self):
+        """Ask every worker to shut down; run() returns once they have."""
+        self._stopping = True
+        for pid in list(self._pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _spawn(self, w: int):
+        # anything still buffered would otherwise be printed by the child too
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = self._serve(w)
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        self._pids[pid] = w
+        self._started[w] = time.monotonic()
+
+    def _serve(self, w: int) -> int:
+        """Body of a worker process."""
+        self._reserve.close()
+        stop = threading.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: stop.set())
+        proxy = self._make_proxy(self.listen_port, self.table, w)
+        proxy.start()
+        while not stop.wait(60):
             pass
+        proxy.stop()
+        return 0
+
 
 # ---------------------------------------------------------------------
 # CLI helper
 # ---------------------------------------------------------------------
 if __name__ == "__main__":
-    import argparse, sys
+    import argparse
+
+    def parse_host_port(arg: str, default_port: int):
+        """Parse host, host:port, [v6addr]:port or a bare IPv6 address."""
+        if arg.startswith("["):
+            host, _, rest = arg[1:].partition("]")
+            return host, int(rest.lstrip(":") or default_port)
+        if arg.count(":") == 1:
+            host, port = arg.split(":")
+            return host, int(port)
+        return arg, default_port
 
-    def parse_ip_weight(arg: str):
+    def parse_nic(arg: str):
+        """IP[@weight][/profile]: profile as in SocketProfile.parse()."""
+        arg, _, profile = arg.partition("/")
         if "@" in arg:
             ip, w = arg.split("@", 1)
-            return ip, int(w)
-        return arg, 1
+            return ip, int(w), profile
+        return arg, 1, profile
 
-    p = argparse.ArgumentParser(description="Multi-NIC SOCKS5 proxy")
-    p.add_argument("ips", nargs="+", help="IP[@weight] list for NICs")
+    p = argparse.ArgumentParser(description="Multi-NIC SOCKS5/HTTP proxy")
+    p.add_argument("ips", nargs="+",
+                   help="IP[@weight][/profile] list for NICs; profile is a preset (" + ", ".join(PROFILE_PRESETS) +
+                        ") and/or key=value options: buf, sndbuf, rcvbuf, cc, tfo, keepalive, timeout "
+                        "(e.g. 10.0.0.2@2/satellite,cc=cubic)")
     p.add_argument("--lhost", default="127.0.0.1", help="Listen host (default 127.0.0.1)")
     p.add_argument("--lport", type=int, default=1080, help="Listen port (default 1080)")
     p.add_argument("--quiet", action="store_true", help="Suppress logs")
+    p.add_argument("--engine", choices=ENGINES, default="threads",
+                   help="Connection engine: one thread per client or a single asyncio loop (default threads)")
+    p.add_argument("--relay", choices=RELAY_MODES, default="auto",
+                   help="TCP relay of the thread engine: splice (Linux zero-copy), copy, or auto (default)")
+    p.add_argument("--scheduler", choices=tuple(SCHEDULERS), default="wrr",
+                   help="NIC selection strategy (default wrr)")
+    p.add_argument("--hedge-delay", type=float, default=0, metavar="MS",
+                   help="Start a second connect on another NIC if the first has not completed after MS milliseconds (default 0 = off)")
+    p.add_argument("--probe-target", metavar="HOST:PORT",
+                   help="Health-probe every NIC with a TCP connect to this address (e.g. 1.1.1.1:443)")
+    p.add_argument("--probe-interval", type=float, default=10,
+                   help="Seconds between health probes (default 10)")
+    p.add_argument("--fail-threshold", type=int, default=3,
+                   help="Consecutive connect failures that take a NIC out of rotation (default 3)")
+    p.add_argument("--auto-weights", choices=AUTO_WEIGHT_MODES, default="off",
+                   help="Retune NIC weights from measured throughput/RTT; manual weights act as priors or caps (default off)")
+    p.add_argument("--affinity-ttl", type=float, default=0, metavar="S",
+                   help="Keep each (client, destination host) on one NIC via consistent hashing; "
+                        "pins expire S seconds after last use (default 0 = off)")
+    p.add_argument("--dns-server", metavar="HOST[:PORT]",
+                   help="Query this DNS server over UDP instead of the system resolver")
+    p.add_argument("--dns-cache-size", type=int, default=1024,
+                   help="Maximum number of cached host names (default 1024)")
+    p.add_argument("--max-connections", type=int, default=0,
+                   help="Maximum concurrent client connections (default 0 = unlimited)")
+    p.add_argument("--admission", choices=ADMISSION_MODES, default="queue",
+                   help="At the connection limit: queue new clients or reject them with SOCKS reply 0x01 (default queue)")
+    p.add_argument("--workers", type=int, default=1, metavar="N",
+                   help="Serve from N processes sharing the port via SO_REUSEPORT; crashed workers are restarted "
+                        "(POSIX only, default 1)")
+    p.add_argument("--metrics-port", type=int, default=0, metavar="PORT",
+                   help="Serve Prometheus metrics at http://127.0.0.1:PORT/metrics; "
+                        "worker N of --workers uses PORT+N (default 0 = off)")
+    p.add_argument("--accelerate-hosts", metavar="PATTERNS",
+                   help="Comma-separated host patterns (e.g. '*.example.com') whose HTTP downloads are split "
+                        "into parallel Range requests across the NICs")
+    p.add_argument("--accelerate-min-size", type=float, default=0, metavar="MB",
+                   help="Also accelerate HTTP downloads of at least MB megabytes from any host (default 0 = off)")
+    p.add_argument("--accelerate-streams", type=int, default=0, metavar="N",
+                   help="Parallel Range connections per accelerated download (default 0 = two per NIC)")
+    p.add_argument("--nic-rate", metavar="IP=MBPS[,IP=MBPS...]",
+                   help="Cap the traffic through these NICs (megabits/s)")
+    p.add_argument("--client-rate", type=float, default=0, metavar="MBPS",
+                   help="Cap the traffic of each client IP (megabits/s, default 0 = off)")
+    p.add_argument("--bulk-rate", type=float, default=0, metavar="MBPS",
+                   help="Cap the combined traffic of bulk connections, those past their first 256 KiB "
+                        "(megabits/s, default 0 = off)")
+    p.add_argument("--top-talkers", type=int, default=0, metavar="N",
+                   help="Rank destination hosts and client IPs by bytes per NIC with N counters each; "
+                        "served as JSON at /talkers on --metrics-port (default 0 = off)")
+    p.add_argument("--access-log", metavar="PATH",
+                   help="Write one JSON line per upstream connection to PATH; "
+                        "worker N of --workers writes PATH.wN")
+    p.add_argument("--access-log-max-size", type=float, default=100, metavar="MB",
+                   help="Rotate the access log when it reaches MB megabytes (default 100, 0 = never)")
+    p.add_argument("--access-log-rotate", type=float, default=0, metavar="SECONDS",
+                   help="Also rotate the access log every SECONDS (default 0 = off)")
+    p.add_argument("--access-log-backups", type=int, default=5, metavar="N",
+                   help="Rotated access logs to keep as PATH.1 ... PATH.N (default 5)")
     args = p.parse_args()
 
-    ip_weights = [parse_ip_weight(a) for a in args.ips]
-    proxy = MultiNICSOCKSProxy(args.lhost, args.lport, ip_weights, quiet=args.quiet)
+    nics = [parse_nic(a) for a in args.ips]
+    ip_weights = [(ip, w) for ip, w, _ in nics]
+    try:
+        profiles = {ip: SocketProfile.parse(spec) for ip, _, spec in nics if spec}
+    except ValueError as e:
+        p.error(str(e))
+    nameserver = parse_host_port(args.dns_server, 53) if args.dns_server else None
+    resolver = DNSResolver(nameserver=nameserver, max_entries=args.dns_cache_size)
+    health = {"probe_interval": args.probe_interval, "failure_threshold": args.fail_threshold}
+    if args.probe_target:
+        health["probe_target"] = parse_host_port(args.probe_target, 443)
+    shaping = None
+    if args.nic_rate or args.client_rate > 0 or args.bulk_rate > 0:
+        # Mbit/s to bytes/s; with --workers each process enforces its share
+        scale = 1_000_000 / 8 / max(1, args.workers)
+        try:
+            nic_rates = {ip.strip(): float(mbps) * scale for ip, mbps in
+                         (item.rsplit("=", 1) for item in (args.nic_rate or "").split(",") if item.strip())}
+        except ValueError:
+            p.error(f"--nic-rate expects IP=MBPS pairs, got {args.nic_rate!r}")
+        unknown = set(nic_rates) - {ip for ip, _ in ip_weights}
+        if unknown:
+            p.error(f"--nic-rate names IPs that are not proxy NICs: {', '.join(sorted(unknown))}")
+        shaping = {"nic_rates": nic_rates, "client_rate": args.client_rate * scale,
+                   "bulk_rate": args.bulk_rate * scale}
+    accelerate = None
+    if args.accelerate_hosts or args.accelerate_min_size > 0:
+        accelerate = {"hosts": [h.strip() for h in (args.accelerate_hosts or "").split(",") if h.strip()],
+                      "min_size": int(args.accelerate_min_size * 1024 * 1024),
+                      "streams": args.accelerate_streams}
+
+    def make_proxy(port: int, shared: Optional[SharedNICTable] = None, worker: int = 0):
+        access_log = None
+        if args.access_log:
+            access_log = {"path": f"{args.access_log}.w{worker}" if args.workers > 1 else args.access_log,
+                          "max_bytes": int(args.access_log_max_size * 1024 * 1024),
+                          "rotate_interval": args.access_log_rotate, "backups": args.access_log_backups}
+        return MultiNICSOCKSProxy(args.lhost, port, ip_weights, quiet=args.quiet,
+                                  engine=args.engine, relay=args.relay,
+                                  max_connections=args.max_connections, admission=args.admission,
+                                  scheduler=args.scheduler, resolver=resolver,
+                                  hedge_delay=args.hedge_delay / 1000, health=health,
+                                  auto_weights=args.auto_weights, affinity_ttl=args.affinity_ttl,
+                                  shared=shared, worker=worker,
+                                  metrics_port=args.metrics_port + worker if args.metrics_port else 0,
+                                  accelerate=accelerate, shaping=shaping, profiles=profiles,
+                                  top_talkers=args.top_talkers, access_log=access_log)
+
+    if args.workers > 1:
+        try:
+            supervisor = WorkerSupervisor(args.workers, len(ip_weights), make_proxy, args.lhost, args.lport)
+        except ValueError as e:
+            p.error(str(e))
+        supervisor.run()
+        sys.exit(0)
+    proxy = make_proxy(args.lport)
     proxy.start()
     try:
         while True:
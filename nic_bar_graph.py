@@ -9,9 +9,11 @@ class BarGraph(ctk.CTkFrame):
         self.bar_color = bar_color
         self.canvas = ctk.CTkCanvas(self, width=width, height=height, bg=bg_color, highlightthickness=0)
         self.canvas.pack(fill="both", expand=True)
-        self.bar = None
+        # Both items are created once; updates only move the bar with coords
+        self.canvas.create_rectangle(0, 0, self.width, self.height, fill="#333", outline="#555", width=1)
+        self.bar = self.canvas.create_rectangle(1, 1, 1, self.height-1, fill=self.bar_color, width=0, state="hidden")
         self.value = 0
-        self._draw_bar(0)
+        self.fill_width = 0
 
     def set_value(self, value, max_value=None):
         if max_value is not None:
@@ -22,21 +24,21 @@ class BarGraph(ctk.CTkFrame):
     def set_color(self, color):
         """Change the bar color"""
         self.bar_color = color
-        self._draw_bar(self.value)
+        self.canvas.itemconfigure(self.bar, fill=color)
 
     def _draw_bar(self, value):
-        self.canvas.delete("all")
         if self.max_value == 0:
             fill_width = 0
         else:
             fill_width = int(self.width * value / self.max_value)
-        
-        # Draw background
-        self.canvas.create_rectangle(0, 0, self.width, self.height, fill="#333", outline="#555", width=1)
-        
-        # Draw filled bar
+        if fill_width == self.fill_width:
+            return
+        self.fill_width = fill_width
         if fill_width > 0:
-            self.canvas.create_rectangle(1, 1, fill_width-1, self.height-1, fill=self.bar_color, width=0)
+            self.canvas.coords(self.bar, 1, 1, fill_width-1, self.height-1)
+            self.canvas.itemconfigure(self.bar, state="normal")
+        else:
+            self.canvas.itemconfigure(self.bar, state="hidden")
 
 
 class MiniLineGraph(ctk.CTkFrame):
@@ -49,34 +51,30 @@ class MiniLineGraph(ctk.CTkFrame):
         self.line_color = line_color
         self.canvas = ctk.CTkCanvas(self, width=width, height=height, bg=bg_color, highlightthickness=0)
         self.canvas.pack(fill="both", expand=True)
-        self.history = []
+        # A single polyline, moved with coords on every update
+        self.line = self.canvas.create_line(0, height, 0, height, fill=line_color, width=1, state="hidden")
         self.max_points = width  # one point per pixel approx
 
-    def add_value(self, value, max_value=None):
+    def set_series(self, times, values, span, max_value=None):
+        """Plot values against their timestamps; the newest sample is at the right edge
+        and the graph covers the last span seconds."""
         if max_value is not None:
             self.max_value = max_value
-        value = max(0, min(value, self.max_value))
-        self.history.append(value)
-        if len(self.history) > self.max_points:
-            self.history.pop(0)
-        self._draw()
+        n = min(len(times), len(values), self.max_points)
+        if n < 2 or self.max_value == 0 or span <= 0:
+            self.canvas.itemconfigure(self.line, state="hidden")
+            return
+        times, values = times[-n:], values[-n:]
+        newest = times[-1]
+        scale_x = self.width / span
+        scale_y = self.height / self.max_value
+        points = []
+        for t, value in zip(times, values):
+            points.append(self.width - (newest - t) * scale_x)
+            points.append(self.height - max(0, min(value, self.max_value)) * scale_y)
+        self.canvas.coords(self.line, points)
+        self.canvas.itemconfigure(self.line, state="normal")
 
     def set_color(self, color):
         self.line_color = color
-        self._draw()
-
-    def _draw(self, *args, **kwargs):
-        no_color_updates = kwargs.get('no_color_updates', False)
-        if not hasattr(self, 'canvas'):
-            return
-        self.canvas.delete("all")
-        if len(self.history) < 2 or self.max_value == 0:
-            return
-        scale_y = self.height / self.max_value
-        step_x = self.width / (self.max_points - 1)
-        for i in range(len(self.history) - 1):
-            x1 = i * step_x
-            y1 = self.height - self.history[i] * scale_y
-            x2 = (i + 1) * step_x
-            y2 = self.height - self.history[i + 1] * scale_y
-            self.canvas.create_line(x1, y1, x2, y2, fill=self.line_color, width=1)
+        self.canvas.itemconfigure(self.line, fill=color)
@@ -0,0 +1,104 @@
+import threading
+import time
+from array import array
+
+import psutil
+
+
+class RingBuffer:
+    """Fixed-size float ring backed by a preallocated array('d')."""
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.data = array('d', bytes(8 * capacity))
+        self.pos = 0  # next slot to write
+        self.count = 0
+
+    def append(self, value):
+        self.data[self.pos] = value
+        self.pos = (self.pos + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def last(self, n=None):
+        """The newest n values (all stored values by default), oldest first."""
+        n = self.count if n is None else min(n, self.count)
+        start = (self.pos - n) % self.capacity
+        if start + n <= self.capacity:
+            return self.data[start:start + n]
+        return self.data[start:] + self.data[:self.pos]
+
+    def __len__(self):
+        return self.count
+
+
+class NICSampler(threading.Thread):
+    """Samples psutil.net_io_counters off the Tk thread.
+
+    One counters call and one time.monotonic() per tick; rates use the
+    measured interval between samples, so a late tick does not skew them.
+    Per NIC it keeps RingBuffers of timestamps and up/down rates in Mb/s,
+    plus the latest byte totals. Readers take a short lock and copy.
+    """
+    def __init__(self, interval=0.5, capacity=240):
+        super().__init__(daemon=True, name="nic-sampler")
+        self.interval = interval
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.seq = 0  # completed samples, lets readers skip unchanged data
+        self.prev = {}  # nic -> (t, bytes_sent, bytes_recv)
+        self.times = {}
+        self.up = {}
+        self.down = {}
+
+    def run(self):
+        deadline = time.monotonic()
+        while not self.stopped.is_set():
+            try:
+                self.sample()
+            except Exception:
+                pass  # best effort, try again next tick
+            # fixed schedule: a slow counters call does not push later ticks back
+            deadline += self.interval
+            delay = deadline - time.monotonic()
+            if delay < 0:
+                deadline, delay = time.monotonic(), 0
+            self.stopped.wait(delay)
+
+    def stop(self):
+        self.stopped.set()
+
+    def sample(self):
+        counters = psutil.net_io_counters(pernic=True)
+        now = time.monotonic()
+        with self.lock:
+            for nic, data in counters.items():
+                prev = self.prev.get(nic)
+                self.prev[nic] = (now, data.bytes_sent, data.bytes_recv)
+                if prev is None:
+                    self.times[nic] = RingBuffer(self.capacity)
+                    self.up[nic] = RingBuffer(self.capacity)
+                    self.down[nic] = RingBuffer(self.capacity)
+                    continue
+                elapsed = max(now - prev[0], 1e-6)
+                self.times[nic].append(now)
+                # counters can go backwards when a NIC is reset
+                self.up[nic].append(max(data.bytes_sent - prev[1], 0) * 8 / 1_000_000 / elapsed)
+                self.down[nic].append(max(data.bytes_recv - prev[2], 0) * 8 / 1_000_000 / elapsed)
+            self.seq += 1
+
+    def latest(self, nic):
+        """(up Mb/s, down Mb/s, bytes_sent, bytes_recv) or None before the first sample."""
+        with self.lock:
+            prev = self.prev.get(nic)
+            if prev is None:
+                return None
+            up, down = self.up[nic], self.down[nic]
+            return (up.last(1)[0] if up else 0.0, down.last(1)[0] if down else 0.0, prev[1], prev[2])
+
+    def history(self, nic, n=None):
+        """Timestamps and down rates of the newest n samples of a NIC, oldest first."""
+        with self.lock:
+            if nic not in self.down:
+                return array('d'), array('d')
+            return self.times[nic].last(n), self.down[nic].last(n)
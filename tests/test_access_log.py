@@ -0,0 +1,110 @@
+import json
+import os
+
+import pytest
+
+import multipath_proxy as mp
+
+
+def _lease(sched, host="example.com", up=100, total=1100, reason=""):
+    lease = sched.acquire()
+    lease.client, lease.host, lease.port = "192.168.1.7", host, 443
+    lease.connect_time = 0.0123
+    lease.uploaded = up
+    lease.reason = reason
+    return lease, total
+
+
+def _lines(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+@pytest.fixture
+def sched():
+    return mp.SmoothWeightedRoundRobin([("10.0.0.1", 1)])
+
+
+def test_record_fields(tmp_path, sched):
+    log = mp.AccessLog(str(tmp_path / "access.jsonl"))
+    log._open()
+    log.record(*_lease(sched))
+    log.record(*_lease(sched, reason="refused"))
+    log._flush()
+    log.close()
+    first, second = _lines(log.path)
+    assert {k: first[k] for k in ("client", "host", "port", "nic", "connect_ms", "up", "down", "reason")} == {
+        "client": "192.168.1.7", "host": "example.com", "port": 443, "nic": "10.0.0.1",
+        "connect_ms": 12.3, "up": 100, "down": 1000, "reason": "closed"}
+    assert first["duration_ms"] >= 0 and first["ts"] > 0
+    assert second["reason"] == "refused"
+
+
+def test_drops_are_counted_and_reported(tmp_path, sched):
+    log = mp.AccessLog(str(tmp_path / "access.jsonl"), max_queue=3)
+    log._open()
+    for _ in range(10):
+        log.record(*_lease(sched))
+    assert log.dropped == 7
+    log._flush()
+    log._flush()  # reported once only
+    log.close()
+    lines = _lines(log.path)
+    assert len(lines) == 4
+    assert lines[-1]["dropped"] == 7
+
+
+def test_rotation_by_size_keeps_the_newest_backups(tmp_path, sched):
+    path = str(tmp_path / "access.jsonl")
+    log = mp.AccessLog(path, max_bytes=1, backups=2)
+    log._open()
+    for host in ("a.example", "b.example", "c.example", "d.example"):
+        log.record(*_lease(sched, host=host))
+        log._flush()
+    log.close()
+    assert os.path.getsize(path) == 0
+    assert [r["host"] for r in _lines(path + ".1")] == ["d.example"]
+    assert [r["host"] for r in _lines(path + ".2")] == ["c.example"]
+    assert not os.path.exists(path + ".3")
+
+
+def test_rotation_by_age(tmp_path, sched, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(mp.time, "monotonic", lambda: now[0])
+    path = str(tmp_path / "access.jsonl")
+    log = mp.AccessLog(path, rotate_interval=60)
+    log._open()
+    log.record(*_lease(sched, host="old.example"))
+    log._flush()
+    assert not os.path.exists(path + ".1")
+    now[0] += 61
+    log.record(*_lease(sched, host="new.example"))
+    log._flush()
+    log.record(*_lease(sched, host="newer.example"))
+    log._flush()
+    log.close()
+    assert [r["host"] for r in _lines(path + ".1")] == ["old.example", "new.example"]
+    assert [r["host"] for r in _lines(path)] == ["newer.example"]
+
+
+def test_write_errors_are_logged_and_the_file_reopened(tmp_path, sched):
+    messages = []
+    log = mp.AccessLog(str(tmp_path / "access.jsonl"), log=messages.append)
+    log._open()
+    log._file.close()  # writes now raise ValueError
+    log.record(*_lease(sched, host="lost.example"))
+    log._flush()  # fails and reopens the file
+    log.record(*_lease(sched, host="after.example"))
+    log._flush()
+    log.close()
+    assert len(messages) == 1 and messages[0].startswith("[WARN] access log")
+    assert [r["host"] for r in _lines(log.path)] == ["after.example"]
+
+
+def test_background_writer_flushes_on_close(tmp_path, sched):
+    log = mp.AccessLog(str(tmp_path / "access.jsonl"), flush_interval=60)
+    log.start()
+    for _ in range(50):
+        log.record(*_lease(sched))
+    log.close()
+    assert len(_lines(log.path)) == 50
@@ -0,0 +1,95 @@
+import time
+from collections import Counter
+
+import multipath_proxy as mp
+
+IPS = ["10.0.0.1", "10.0.0.2", "10.0.0.3", "10.0.0.4"]
+KEYS = [("192.168.1.%d" % (i % 50), "host%d.example" % i) for i in range(4000)]
+
+
+def _ring(weights, ttl=60.0, **kwargs):
+    return mp.AffinityRing(list(IPS), weights, ttl, **kwargs)
+
+
+def test_ring_lookup_is_deterministic():
+    a, b = _ring([1, 1, 1, 1]), _ring([1, 1, 1, 1])
+    all_nics = list(range(len(IPS)))
+    assert [a._ring_lookup(k, all_nics) for k in KEYS] == [b._ring_lookup(k, all_nics) for k in KEYS]
+
+
+def test_points_follow_weights():
+    ring = _ring([4, 2, 1, 1])
+    points = Counter(ring._owners)
+    assert points[0] == mp.AffinityRing.POINTS
+    assert points[1] == mp.AffinityRing.POINTS // 2
+    assert points[2] == points[3] == mp.AffinityRing.POINTS // 4
+    assert ring._hashes == sorted(ring._hashes)
+
+
+def test_placement_roughly_follows_weights():
+    ring = _ring([3, 1, 1, 1])
+    all_nics = list(range(len(IPS)))
+    share = Counter(ring._ring_lookup(k, all_nics) for k in KEYS)
+    assert share[0] > 2 * max(share[1], share[2], share[3])
+    assert all(share[i] for i in all_nics)
+
+
+def test_removing_a_nic_only_moves_its_keys():
+    ring = _ring([1, 1, 1, 1])
+    before = {k: ring._ring_lookup(k, [0, 1, 2, 3]) for k in KEYS}
+    after = {k: ring._ring_lookup(k, [0, 1, 3]) for k in KEYS}
+    for k in KEYS:
+        if before[k] != 2:
+            assert after[k] == before[k]
+        else:
+            assert after[k] in (0, 1, 3)
+
+
+def test_sticky_survives_weight_changes():
+    ring = _ring([1, 1, 1, 1])
+    all_nics = list(range(len(IPS)))
+    chosen = {k: ring.lookup(k, all_nics) for k in KEYS[:500]}
+    ring.rebuild([1, 1, 1, 8])
+    assert {k: ring.lookup(k, all_nics) for k in KEYS[:500]} == chosen
+    # new keys see the new weights
+    fresh = Counter(ring.lookup(k, all_nics) for k in KEYS[500:])
+    assert fresh[3] > fresh[0] + fresh[1] + fresh[2]
+
+
+def test_sticky_entry_moves_when_its_nic_leaves_rotation():
+    ring = _ring([1, 1, 1, 1])
+    key = KEYS[0]
+    first = ring.lookup(key, [0, 1, 2, 3])
+    others = [i for i in range(4) if i != first]
+    moved = ring.lookup(key, others)
+    assert moved in others
+    # the new placement is sticky too, even once the old NIC is back
+    assert ring.lookup(key, [0, 1, 2, 3]) == moved
+
+
+def test_sticky_entry_expires_after_ttl():
+    ring = _ring([1, 1, 1, 1], ttl=0.05)
+    key = KEYS[0]
+    first = ring.lookup(key, [0, 1, 2, 3])
+    moved = ring.lookup(key, [i for i in range(4) if i != first])
+    assert ring.lookup(key, [0, 1, 2, 3]) == moved
+    time.sleep(0.1)
+    assert ring.lookup(key, [0, 1, 2, 3]) == first
+
+
+def test_sticky_table_is_bounded_lru():
+    ring = _ring([1, 1, 1, 1], max_entries=100)
+    for k in KEYS[:300]:
+        ring.lookup(k, [0, 1, 2, 3])
+    assert len(ring._sticky) == 100
+    assert list(ring._sticky) == KEYS[200:300]
+
+
+def test_scheduler_routes_keys_through_the_ring():
+    sched = mp.NICScheduler([(ip, 1) for ip in IPS])
+    sched.enable_affinity(60.0)
+    leases = [sched.acquire(key=k) for k in KEYS[:50]]
+    again = [sched.acquire(key=k) for k in KEYS[:50]]
+    assert [l.index for l in leases] == [l.index for l in again]
+    for l in leases + again:
+        l.release()
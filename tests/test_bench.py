@@ -0,0 +1,49 @@
+import collections
+
+import pytest
+
+import bench_multipath_proxy as bench
+
+
+def test_percentile_is_nearest_rank():
+    values = [i / 1000 for i in range(1, 101)]  # 1..100 ms
+    assert bench._percentile_ms(values, 0.50) == 50.0
+    assert bench._percentile_ms(values, 0.99) == 99.0
+    assert bench._percentile_ms(values, 1.0) == 100.0
+    assert bench._percentile_ms(values, 0.0) == 1.0
+    assert bench._percentile_ms([0.25], 0.99) == 250.0
+    assert bench._percentile_ms([], 0.5) is None
+
+
+def test_distribution_error_against_weights():
+    weights = [("127.0.0.1", 1), ("127.0.0.2", 3)]
+    dist = bench._distribution(weights, collections.Counter({"127.0.0.1": 30, "127.0.0.2": 70}))
+    assert dist["nics"]["127.0.0.1"] == {"connections": 30, "share": 0.3, "expected": 0.25}
+    assert dist["nics"]["127.0.0.2"]["expected"] == 0.75
+    assert dist["distribution_error_pp"] == 5.0
+    empty = bench._distribution(weights, collections.Counter())
+    assert empty["nics"]["127.0.0.2"]["connections"] == 0
+    assert empty["distribution_error_pp"] == 75.0
+
+
+def test_compare_prints_relative_change(capsys):
+    old = [{"scenario": "bulk", "relay": "copy", "engine": "threads", "throughput_mbps": 1000.0,
+            "cpu_s_per_gb": 2.0},
+           {"scenario": "connect", "engine": "threads", "scheduler": "wrr", "conn_per_s": 100.0}]
+    new = [{"scenario": "bulk", "relay": "copy", "engine": "threads", "throughput_mbps": 1250.0,
+            "cpu_s_per_gb": 1.0},
+           {"scenario": "http", "engine": "threads", "scheduler": "wrr", "conn_per_s": 50.0}]
+    bench.compare(old, new)
+    out = capsys.readouterr().out.splitlines()
+    assert out == ["bulk/copy/threads: throughput_mbps +25.0%, cpu_s_per_gb -50.0%"]
+
+
+@pytest.mark.parametrize("protocol", ["connect", "http"])
+def test_load_bench_smoke(protocol):
+    result = bench.run_load_bench(protocol, [("127.0.0.1", 1)], requests=20, concurrency=4,
+                                  response_bytes=1024)
+    assert result["scenario"] == protocol
+    assert result["requests"] == 20 and result["errors"] == 0
+    assert result["nics"]["127.0.0.1"]["connections"] == 20
+    assert result["distribution_error_pp"] == 0.0
+    assert result["ttfb_p50_ms"] <= result["ttfb_p99_ms"]
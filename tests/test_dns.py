@@ -0,0 +1,133 @@
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+import multipath_proxy as mp
+
+
+def _question(query):
+    """(id, question section) of a query."""
+    end = 12
+    while query[end]:
+        end += query[end] + 1
+    return struct.unpack_from("!H", query)[0], query[12:end + 5]
+
+
+def _answer(query, flags=0x8180, records=True, question=None):
+    qid, q = _question(query)
+    qtype = struct.unpack_from("!H", q, len(q) - 4)[0]
+    rr = b""
+    if records:
+        rdata = socket.inet_aton("10.0.0.1") if qtype == 1 else socket.inet_pton(socket.AF_INET6, "fd00::1")
+        rr = b"\xc0\x0c" + struct.pack("!HHIH", qtype, 1, 300, len(rdata)) + rdata
+    return struct.pack("!HHHHHH", qid, flags, 1, 1 if records else 0, 0, 0) + (question or q) + rr
+
+
+class StubDNS:
+    """UDP server answering every query with reply(query) after delay seconds."""
+
+    def __init__(self, reply, delay=0.0):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.address = self.sock.getsockname()
+        self.reply, self.delay = reply, delay
+        self.queries = 0
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                query, peer = self.sock.recvfrom(512)
+            except OSError:
+                return
+            self.queries += 1
+            time.sleep(self.delay)
+            self.sock.sendto(self.reply(query), peer)
+
+    def close(self):
+        self.sock.close()
+
+
+@pytest.fixture
+def stub(request):
+    servers = []
+
+    def make(reply, delay=0.0):
+        server = StubDNS(reply, delay)
+        servers.append(server)
+        return server
+
+    yield make
+    for server in servers:
+        server.close()
+
+
+def test_valid_answer(stub):
+    server = stub(_answer)
+    resolver = mp.DNSResolver(nameserver=server.address, timeout=1)
+    assert resolver.resolve("example.test") == ["fd00::1", "10.0.0.1"]
+    assert resolver.resolve("example.test") == ["fd00::1", "10.0.0.1"]
+    assert resolver.stats()["hits"] == 1
+
+
+@pytest.mark.parametrize("reply", [
+    lambda q: _answer(q)[:-3],                                    # truncated record data
+    lambda q: _answer(q)[:14],                                    # truncated question
+    lambda q: _answer(q, flags=0x8380),                           # TC bit
+    lambda q: _answer(q, flags=0x0100),                           # QR bit missing
+    lambda q: _answer(q, question=b"\x05other\x04test\x00\x00\x01\x00\x01"),  # wrong question
+    lambda q: _answer(q)[:6] + b"\x00\x05" + _answer(q)[8:],      # answer count past the end
+])
+def test_bad_replies_fail_cleanly(stub, reply):
+    server = stub(reply)
+    resolver = mp.DNSResolver(nameserver=server.address, timeout=0.5)
+    with pytest.raises(socket.gaierror):
+        resolver.resolve("example.test")
+    assert resolver.stats()["failures"] == 1
+    # negatively cached: no new query
+    queries = server.queries
+    with pytest.raises(socket.gaierror):
+        resolver.resolve("example.test")
+    assert server.queries == queries
+
+
+def test_coalesced_waiters_share_the_error(stub):
+    server = stub(lambda q: _answer(q)[:20], delay=0.2)
+    resolver = mp.DNSResolver(nameserver=server.address, timeout=1)
+    results = []
+
+    def lookup():
+        try:
+            results.append(("ok", resolver.resolve("example.test")))
+        except OSError as e:
+            results.append(("error", type(e)))
+
+    threads = [threading.Thread(target=lookup) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [("error", socket.gaierror)] * 4
+    assert resolver.stats()["coalesced"] == 3
+
+
+def test_waiters_get_an_error_when_the_owner_crashes(monkeypatch):
+    resolver = mp.DNSResolver()
+    started = threading.Event()
+
+    def query(host):
+        started.set()
+        time.sleep(0.2)
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(resolver, "_query", query)
+    owner_error = []
+    owner = threading.Thread(target=lambda: owner_error.append(pytest.raises(RuntimeError, resolver.resolve, "x.test")))
+    owner.start()
+    started.wait()
+    with pytest.raises(socket.gaierror):
+        resolver.resolve("x.test")
+    owner.join()
@@ -0,0 +1,114 @@
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+import multipath_proxy as mp
+
+
+def _echo_server():
+    srv = socket.socket()
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(16)
+
+    def handle(conn):
+        with conn:
+            while True:
+                data = conn.recv(65536)
+                if not data:
+                    return
+                conn.sendall(data)
+
+    def accept():
+        while True:
+            try:
+                conn, _ = srv.accept()
+            except OSError:
+                return
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return srv
+
+
+def _socks_connect(proxy_addr, port):
+    c = socket.create_connection(proxy_addr)
+    c.sendall(b"\x05\x01\x00")
+    assert c.recv(2) == b"\x05\x00"
+    c.sendall(b"\x05\x01\x00\x01" + socket.inet_aton("127.0.0.1") + struct.pack("!H", port))
+    reply = b""
+    while len(reply) < 10:
+        reply += c.recv(10 - len(reply))
+    assert reply[1] == 0
+    return c
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.01)
+
+
+@pytest.mark.parametrize("engine", mp.ENGINES)
+def test_log_callable_receives_the_lines(engine):
+    lines = []
+    proxy = mp.MultiNICSOCKSProxy("127.0.0.1", 0, [("127.0.0.1", 1)], engine=engine, log=lines.append)
+    proxy.start()
+    proxy.stop()
+    assert any(line.startswith("[INFO] SOCKS5/HTTP server started") for line in lines)
+    assert lines[-1] == "[INFO] SOCKS5/HTTP server stopped"
+
+
+def test_quiet_suppresses_the_log_callable():
+    lines = []
+    proxy = mp.MultiNICSOCKSProxy("127.0.0.1", 0, [("127.0.0.1", 1)], quiet=True, log=lines.append)
+    proxy.start()
+    proxy.stop()
+    assert lines == []
+
+
+@pytest.mark.parametrize("engine", mp.ENGINES)
+def test_stop_frees_the_port(engine):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    for _ in range(2):
+        proxy = mp.MultiNICSOCKSProxy("127.0.0.1", port, [("127.0.0.1", 1)], quiet=True, engine=engine)
+        proxy.start()
+        proxy.stop()
+
+
+@pytest.mark.parametrize("engine", mp.ENGINES)
+def test_nics_reports_live_connections_and_bytes(engine):
+    srv = _echo_server()
+    proxy = mp.MultiNICSOCKSProxy("127.0.0.1", 0, [("127.0.0.1", 2), ("127.0.0.2", 1)], quiet=True,
+                                  engine=engine)
+    proxy.start()
+    try:
+        addr = proxy._server.getsockname()
+        conns = [_socks_connect(addr, srv.getsockname()[1]) for _ in range(3)]
+        _wait_for(lambda: sum(n["active"] for n in proxy.metrics.nics()) == 3)
+        nics = proxy.metrics.nics()
+        assert [n["ip"] for n in nics] == ["127.0.0.1", "127.0.0.2"]
+        assert [n["weight"] for n in nics] == [2, 1]
+        assert [n["active"] for n in nics] == [2, 1]
+        assert all(n["health"] == "up" for n in nics)
+        for c in conns:
+            c.sendall(b"x" * 1000)
+            got = 0
+            while got < 1000:
+                got += len(c.recv(4096))
+            c.close()
+        _wait_for(lambda: sum(n["active"] for n in proxy.metrics.nics()) == 0)
+        nics = proxy.metrics.nics()
+        assert sum(n["bytes_up"] for n in nics) == 3000
+        assert sum(n["bytes_down"] for n in nics) == 3000
+        assert sum(n["picks"] for n in nics) == 3
+        assert "connect" not in nics[0]  # the histograms stay in snapshot()
+        assert "connect" in proxy.metrics.snapshot()["nics"][0]
+    finally:
+        proxy.stop()
+        srv.close()
@@ -0,0 +1,118 @@
+import importlib.util
+import os
+import threading
+import types
+from collections import deque
+
+import pytest
+
+pytest.importorskip("customtkinter")
+pytest.importorskip("psutil")
+
+_spec = importlib.util.spec_from_file_location(
+    "go_dispatch_proxy_gui", os.path.join(os.path.dirname(__file__), "..", "go-dispatch-proxy-gui.py"))
+gui = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(gui)
+
+
+class FakeVar:
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+class FakeTextbox:
+    def __init__(self):
+        self.lines = []
+        self.inserts = 0
+
+    def configure(self, **kwargs):
+        pass
+
+    def insert(self, index, text):
+        self.inserts += 1
+        self.lines.extend(text.splitlines())
+
+    def index(self, index):
+        return f"{len(self.lines) + 1}.0"
+
+    def delete(self, first, last):
+        del self.lines[:int(last.split(".")[0]) - 1]
+
+    def see(self, index):
+        pass
+
+
+def _window(filter_="All", paused=False):
+    w = types.SimpleNamespace(log_queue=deque(maxlen=gui.LOG_MAX_LINES), output_textbox=FakeTextbox(),
+                              log_pause_var=FakeVar(paused), log_filter_var=FakeVar(filter_),
+                              scheduled=[])
+    w.after = lambda ms, func, *args: w.scheduled.append((ms, func))
+    w.flush_output = lambda: None
+    return w
+
+
+def _flush(w):
+    gui.GoDispatchProxyGUI.flush_output(w)
+
+
+def test_one_insert_per_flush():
+    w = _window()
+    for i in range(100):
+        gui.GoDispatchProxyGUI.update_output(w, f"[INFO] line {i}\n")
+    _flush(w)
+    assert w.output_textbox.inserts == 1
+    assert w.output_textbox.lines == [f"[INFO] line {i}" for i in range(100)]
+    assert not w.log_queue
+    assert w.scheduled == [(gui.LOG_FLUSH_MS, w.flush_output)]
+
+
+def test_textbox_is_trimmed_to_the_limit():
+    w = _window()
+    for i in range(3):
+        w.log_queue.extend(f"{k}\n" for k in range(i * 4000, (i + 1) * 4000))
+        _flush(w)
+    assert len(w.output_textbox.lines) == gui.LOG_MAX_LINES - 1
+    assert w.output_textbox.lines[-1] == "11999"
+
+
+def test_queue_drops_the_oldest_lines_when_flooded():
+    w = _window()
+    threads = [threading.Thread(target=lambda: [gui.GoDispatchProxyGUI.update_output(w, "x\n")
+                                                for _ in range(5000)]) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(w.log_queue) == gui.LOG_MAX_LINES
+
+
+def test_pause_keeps_the_queue():
+    w = _window(paused=True)
+    w.log_queue.append("[INFO] held\n")
+    _flush(w)
+    assert w.output_textbox.inserts == 0 and list(w.log_queue) == ["[INFO] held\n"]
+    w.log_pause_var.value = False
+    _flush(w)
+    assert w.output_textbox.lines == ["[INFO] held"]
+
+
+@pytest.mark.parametrize("filter_,shown", [
+    ("All", ["[INFO] a", "[WARN] b", "[ERR] c", "[HEALTH] 10.0.0.1 down", "plain"]),
+    ("Warnings", ["[WARN] b", "[ERR] c", "[HEALTH] 10.0.0.1 down", "plain"]),
+    ("Errors", ["[ERR] c", "plain"]),
+])
+def test_level_filters(filter_, shown):
+    w = _window(filter_)
+    w.log_queue.append("[INFO] a\n[WARN] b\n[ERR] c\n")
+    w.log_queue.append("[HEALTH] 10.0.0.1 down\nplain\n")
+    _flush(w)
+    assert w.output_textbox.lines == shown
+
+
+def test_health_line_pattern():
+    m = gui.HEALTH_LINE.match("[HEALTH] 192.168.1.5 probing (connect timed out)\n")
+    assert m.groups() == ("192.168.1.5", "probing")
+    assert gui.HEALTH_LINE.match("[HEALTH] 192.168.1.5 upward") is None
@@ -0,0 +1,99 @@
+from array import array
+from collections import namedtuple
+
+import pytest
+
+pytest.importorskip("psutil")
+
+import nic_sampler  # noqa: E402
+from nic_sampler import NICSampler, RingBuffer  # noqa: E402
+
+Counters = namedtuple("Counters", "bytes_sent bytes_recv")
+
+
+def test_ring_buffer_before_wrapping():
+    ring = RingBuffer(4)
+    assert len(ring) == 0 and ring.last() == array("d")
+    ring.append(1)
+    ring.append(2)
+    assert len(ring) == 2
+    assert list(ring.last()) == [1, 2]
+    assert list(ring.last(1)) == [2]
+    assert list(ring.last(10)) == [1, 2]
+
+
+@pytest.mark.parametrize("count", range(4, 13))
+def test_ring_buffer_wraparound(count):
+    ring = RingBuffer(4)
+    for v in range(count):
+        ring.append(v)
+    assert len(ring) == 4
+    assert list(ring.last()) == list(range(count - 4, count))
+    for n in range(5):
+        assert list(ring.last(n)) == list(range(count - n, count))
+    assert isinstance(ring.last(), array)
+
+
+class FakeCounters:
+    def __init__(self):
+        self.now = 100.0
+        self.nics = {}
+
+    def net_io_counters(self, pernic=False):
+        return dict(self.nics)
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    f = FakeCounters()
+    monkeypatch.setattr(nic_sampler.psutil, "net_io_counters", f.net_io_counters, raising=False)
+    monkeypatch.setattr(nic_sampler.time, "monotonic", f.monotonic)
+    return f
+
+
+def test_rates_use_the_measured_interval(fake):
+    s = NICSampler(interval=0.5, capacity=8)
+    fake.nics = {"eth0": Counters(0, 0)}
+    s.sample()
+    assert s.latest("eth0") == (0.0, 0.0, 0, 0)
+    assert s.history("eth0") == (array("d"), array("d"))
+    fake.now += 2.0  # a late tick
+    fake.nics = {"eth0": Counters(1_000_000, 4_000_000)}
+    s.sample()
+    assert s.latest("eth0") == (4.0, 16.0, 1_000_000, 4_000_000)
+    times, down = s.history("eth0")
+    assert list(times) == [102.0] and list(down) == [16.0]
+    assert s.seq == 2
+
+
+def test_counter_reset_gives_zero_not_negative(fake):
+    s = NICSampler(capacity=8)
+    fake.nics = {"eth0": Counters(5_000_000, 5_000_000)}
+    s.sample()
+    fake.now += 1.0
+    fake.nics = {"eth0": Counters(10, 125_000)}
+    s.sample()
+    assert s.latest("eth0")[:2] == (0.0, 0.0)
+
+
+def test_history_is_bounded_and_ordered(fake):
+    s = NICSampler(capacity=5)
+    fake.nics = {"eth0": Counters(0, 0)}
+    s.sample()
+    for k in range(1, 9):
+        fake.now += 1.0
+        fake.nics = {"eth0": Counters(0, k * 125_000 * k)}  # growing rate
+        s.sample()
+    times, down = s.history("eth0")
+    assert list(times) == [104.0, 105.0, 106.0, 107.0, 108.0]
+    assert list(down) == sorted(down)
+    assert list(s.history("eth0", 2)[0]) == [107.0, 108.0]
+
+
+def test_unknown_nic(fake):
+    s = NICSampler()
+    assert s.latest("wlan0") is None
+    assert s.history("wlan0") == (array("d"), array("d"))
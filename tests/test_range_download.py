@@ -0,0 +1,172 @@
+import os
+import re
+import socket
+import threading
+import time
+import types
+
+import pytest
+
+import multipath_proxy as mp
+
+MiB = 1024 * 1024
+
+
+def _download(total, chunk_size=MiB, window=4, streams=2):
+    proxy = types.SimpleNamespace(scheduler=types.SimpleNamespace(ips=["127.0.0.1"]),
+                                  _stop_event=threading.Event(), shaper=None)
+    accel = mp.DownloadAccelerator(hosts=["*"], streams=streams, chunk_size=chunk_size, window=window)
+    response = mp._HTTPHead(b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\nETag: "v1"\r\n\r\n' % total)
+    request = b"GET /f HTTP/1.1\r\nHost: example.com\r\n\r\n"
+    return mp.RangeDownload(proxy, accel, "example.com", 80, ["127.0.0.1"], request, response, total)
+
+
+def _fill(d, chunk, n=None):
+    n = chunk.remaining() if n is None else n
+    chunk.filled += n
+
+
+def test_chunks_cover_the_body():
+    d = _download(5 * MiB + 1)
+    assert [(c.start, c.end) for c in d._chunks] == [
+        (0, MiB), (MiB, 2 * MiB), (2 * MiB, 3 * MiB), (3 * MiB, 4 * MiB), (4 * MiB, 5 * MiB),
+        (5 * MiB, 5 * MiB + 1)]
+    assert d._request.endswith(b'If-Range: "v1"\r\n')
+
+
+def test_claims_in_order_within_the_window():
+    d = _download(8 * MiB, window=3)
+    claimed = [d._claim(w) for w in range(3)]
+    assert [c.start for c in claimed] == [0, MiB, 2 * MiB]
+    assert [c.owner for c in claimed] == [0, 1, 2]
+    # the fourth chunk lies past the window: the next claim steals instead
+    stolen = d._claim(3)
+    assert stolen.end == MiB and stolen.start == MiB // 2
+    assert d._chunks[0].end == MiB // 2
+    assert [(c.start, c.end) for c in d._chunks[:2]] == [(0, MiB // 2), (MiB // 2, MiB)]
+
+
+def test_steals_half_of_the_largest_remainder():
+    d = _download(4 * MiB, window=4)
+    chunks = [d._claim(w) for w in range(4)]
+    _fill(d, chunks[0], MiB // 4)
+    _fill(d, chunks[1])
+    _fill(d, chunks[2], MiB // 8)
+    _fill(d, chunks[3], 3 * MiB // 4)
+    stolen = d._claim(9)
+    # chunk 2 has the most left: 7/8 MiB, of which the second half moves
+    left = MiB - MiB // 8
+    assert (stolen.start, stolen.end) == (2 * MiB + MiB - left // 2, 3 * MiB)
+    assert chunks[2].end == stolen.start
+    assert stolen.owner == 9
+    # the stolen chunk writes straight into the victim's buffer
+    stolen.buf[:4] = b"abcd"
+    assert bytes(chunks[2].buf[stolen.start - chunks[2].start:][:4]) == b"abcd"
+
+
+def test_small_remainders_are_not_stolen():
+    d = _download(2 * MiB, window=2)
+    a, b = d._claim(0), d._claim(1)
+    _fill(d, a, MiB - 2 * mp._ACCEL_MIN_STEAL + 1)
+    _fill(d, b)
+    threading.Timer(0.2, lambda: _finish(d)).start()
+    assert d._claim(2) is None
+
+
+def _finish(d):
+    with d._lock:
+        d._done = True
+        d._work.notify_all()
+
+
+def test_claim_returns_none_when_everything_is_fetched():
+    d = _download(2 * MiB, window=2)
+    for w in range(2):
+        _fill(d, d._claim(w))
+    assert d._claim(5) is None
+
+
+# ---------------------------------------------------------------------
+# End to end through the HTTP frontend
+# ---------------------------------------------------------------------
+BODY = os.urandom(6 * MiB + 12345)
+RANGE = re.compile(rb"\r\nRange: bytes=(\d+)-(\d+)\r\n", re.I)
+
+
+def _range_server(slow_ip=None):
+    srv = socket.socket()
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(64)
+
+    def handle(conn, peer):
+        with conn:
+            buf = b""
+            while True:
+                while b"\r\n\r\n" not in buf:
+                    try:
+                        data = conn.recv(65536)
+                    except OSError:
+                        return
+                    if not data:
+                        return
+                    buf += data
+                head, _, buf = buf.partition(b"\r\n\r\n")
+                m = RANGE.search(head + b"\r\n")
+                if m:
+                    first, last = int(m.group(1)), int(m.group(2))
+                    conn.sendall(b"HTTP/1.1 206 Partial Content\r\nContent-Range: bytes %d-%d/%d\r\n"
+                                 b"Content-Length: %d\r\nETag: \"v1\"\r\n\r\n"
+                                 % (first, last, len(BODY), last - first + 1))
+                else:
+                    first, last = 0, len(BODY) - 1
+                    conn.sendall(b"HTTP/1.1 200 OK\r\nAccept-Ranges: bytes\r\nContent-Length: %d\r\n"
+                                 b"ETag: \"v1\"\r\n\r\n" % len(BODY))
+                for pos in range(first, last + 1, 64 * 1024):
+                    try:
+                        conn.sendall(BODY[pos:min(pos + 64 * 1024, last + 1)])
+                    except OSError:
+                        return
+                    if peer == slow_ip:
+                        time.sleep(0.02)
+
+    def accept():
+        while True:
+            try:
+                conn, addr = srv.accept()
+            except OSError:
+                return
+            threading.Thread(target=handle, args=(conn, addr[0]), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return srv
+
+
+def _get(proxy_addr, port):
+    c = socket.create_connection(proxy_addr)
+    c.sendall(b"GET http://127.0.0.1:%d/f HTTP/1.1\r\nHost: 127.0.0.1:%d\r\nConnection: close\r\n\r\n"
+              % (port, port))
+    data = b""
+    while True:
+        chunk = c.recv(1 << 20)
+        if not chunk:
+            break
+        data += chunk
+    c.close()
+    head, _, body = data.partition(b"\r\n\r\n")
+    return head, body
+
+
+@pytest.mark.parametrize("slow", [False, True])
+def test_accelerated_download_is_reassembled(slow):
+    srv = _range_server(slow_ip="127.0.0.2" if slow else None)
+    proxy = mp.MultiNICSOCKSProxy("127.0.0.1", 0, [("127.0.0.1", 1), ("127.0.0.2", 1)], quiet=True,
+                                  accelerate={"hosts": ["127.0.0.1"], "streams": 4,
+                                              "chunk_size": 512 * 1024, "window": 4})
+    proxy.start()
+    try:
+        head, body = _get(proxy._server.getsockname(), srv.getsockname()[1])
+        assert head.startswith(b"HTTP/1.1 200")
+        assert len(body) == len(BODY) and body == BODY
+    finally:
+        proxy.stop()
+        srv.close()
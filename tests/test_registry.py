@@ -0,0 +1,103 @@
+import socket
+import threading
+
+import pytest
+
+import multipath_proxy as mp
+
+
+def _closed_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def _listener():
+    srv = socket.socket()
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(16)
+    return srv
+
+
+def _proxy(nics, **kwargs):
+    return mp.MultiNICSOCKSProxy("127.0.0.1", 0, [(ip, 1) for ip in nics], quiet=True, **kwargs)
+
+
+def _group(proxy, cid):
+    return proxy._registry._conns[cid]
+
+
+def test_failed_connects_are_detached():
+    proxy = _proxy(["127.0.0.1"])
+    client = socket.socket()
+    cid = proxy._registry.add(client)
+    port = _closed_port()
+    for _ in range(5):
+        lease = proxy.scheduler.acquire()
+        with pytest.raises(OSError):
+            proxy._connect_upstream(lease, "localhost", ["127.0.0.1", "127.0.0.1"], port, cid)
+        lease.release()
+    assert _group(proxy, cid) == [client]
+    client.close()
+
+
+@pytest.mark.parametrize("reachable", [True, False])
+def test_hedged_attempts_keep_only_the_winner(reachable):
+    proxy = _proxy(["127.0.0.1", "127.0.0.2"], hedge_delay=0.001)
+    srv = _listener()
+    port = srv.getsockname()[1] if reachable else _closed_port()
+    client = socket.socket()
+    cid = proxy._registry.add(client)
+    lease = proxy.scheduler.acquire()
+    try:
+        remote, won = proxy._connect_upstream(lease, "localhost", ["127.0.0.1"], port, cid)
+    except OSError:
+        assert not reachable
+        lease.release()
+        assert _group(proxy, cid) == [client]
+    else:
+        assert reachable
+        assert _group(proxy, cid) == [client, remote]
+        remote.close()
+        won.release()
+    client.close()
+    srv.close()
+
+
+def test_keep_alive_client_does_not_accumulate_upstreams():
+    srv = _listener()
+
+    def serve():
+        while True:
+            try:
+                conn, _ = srv.accept()
+            except OSError:
+                return
+            with conn:
+                data = b""
+                while b"\r\n\r\n" not in data:
+                    chunk = conn.recv(4096)
+                    if not chunk:
+                        break
+                    data += chunk
+                conn.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: close\r\n\r\nok")
+
+    threading.Thread(target=serve, daemon=True).start()
+    proxy = _proxy(["127.0.0.1"])
+    proxy.start()
+    try:
+        c = socket.create_connection(proxy._server.getsockname())
+        port = srv.getsockname()[1]
+        for _ in range(10):
+            c.sendall(f"GET http://127.0.0.1:{port}/ HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n\r\n".encode())
+            data = b""
+            while not data.endswith(b"ok"):
+                data += c.recv(4096)
+        groups = list(proxy._registry._conns.values())
+        assert len(groups) == 1 and len(groups[0]) == 1
+        c.close()
+    finally:
+        proxy.stop()
+        srv.close()
@@ -0,0 +1,73 @@
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+import multipath_proxy as mp
+
+RESPONSE = 8 * 1024 * 1024
+
+
+def _server():
+    """Reads the request until the client half-closes, then answers RESPONSE bytes and closes."""
+    srv = socket.socket()
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(16)
+
+    def handle(conn):
+        with conn:
+            while conn.recv(65536):
+                pass
+            conn.sendall(b"z" * RESPONSE)
+
+    def accept():
+        while True:
+            try:
+                conn, _ = srv.accept()
+            except OSError:
+                return
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return srv
+
+
+def _socks_connect(proxy_port, port):
+    c = socket.socket()
+    c.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 16384)
+    c.connect(("127.0.0.1", proxy_port))
+    c.sendall(b"\x05\x01\x00")
+    assert c.recv(2) == b"\x05\x00"
+    c.sendall(b"\x05\x01\x00\x01" + socket.inet_aton("127.0.0.1") + struct.pack("!H", port))
+    reply = b""
+    while len(reply) < 10:
+        reply += c.recv(10 - len(reply))
+    assert reply[1] == 0
+    return c
+
+
+@pytest.mark.parametrize("engine,relay", [("threads", "copy"), ("threads", "auto"), ("asyncio", "auto")])
+def test_half_close_slow_reader_gets_every_byte(engine, relay):
+    srv = _server()
+    proxy = mp.MultiNICSOCKSProxy("127.0.0.1", 0, [("127.0.0.1", 1)], quiet=True, engine=engine, relay=relay)
+    proxy.start()
+    try:
+        port = proxy._server.getsockname()[1]
+        for _ in range(3):
+            c = _socks_connect(port, srv.getsockname()[1])
+            c.sendall(b"request")
+            c.shutdown(socket.SHUT_WR)
+            time.sleep(0.2)  # let the response pile up in the proxy
+            got = 0
+            while True:
+                data = c.recv(8192)
+                if not data:
+                    break
+                got += len(data)
+            c.close()
+            assert got == RESPONSE
+    finally:
+        proxy.stop()
+        srv.close()
@@ -0,0 +1,121 @@
+import pytest
+
+import multipath_proxy as mp
+
+MB = 1_000_000
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(mp.time, "monotonic", c)
+    return c
+
+
+def test_burst_has_a_floor():
+    assert mp.TokenBucket(10 * MB).burst == 10 * MB * mp._QOS_BURST
+    assert mp.TokenBucket(1000).burst == mp._QOS_MIN_BURST
+
+
+def test_take_within_burst_is_free(clock):
+    b = mp.TokenBucket(8 * MB)
+    assert b.take(b.burst // 2) == 0.0
+    assert b.take(b.burst // 2) == 0.0
+    assert b.level == pytest.approx(0)
+
+
+def test_overdraft_returns_the_time_to_repay(clock):
+    b = mp.TokenBucket(8 * MB)
+    delay = b.take(b.burst + 4 * MB)
+    assert delay == pytest.approx(0.5)
+    assert b.level == pytest.approx(-4 * MB)
+
+
+def test_refill_is_linear_and_capped(clock):
+    b = mp.TokenBucket(8 * MB)
+    b.take(b.burst)
+    clock.now += 0.125
+    assert b.take(0) == 0.0
+    assert b.level == pytest.approx(1 * MB)
+    clock.now += 3600
+    b.take(0)
+    assert b.level == b.burst
+
+
+def test_average_rate_holds_over_many_chunks(clock):
+    b = mp.TokenBucket(4 * MB)
+    sent = 0
+    while sent < 40 * MB:
+        clock.now += b.take(64 * 1024)
+        sent += 64 * 1024
+    elapsed = clock.now - 1000.0
+    # the initial burst is the only credit beyond the rate
+    assert (sent - b.burst) / elapsed == pytest.approx(4 * MB, rel=0.01)
+
+
+def test_reserve_keeps_headroom(clock):
+    b = mp.TokenBucket(8 * MB)
+    floor = mp._QOS_RESERVE * b.burst
+    b.take(b.burst - floor - 1)
+    assert b.take(1, mp._QOS_RESERVE) == 0.0
+    delay = b.take(MB, mp._QOS_RESERVE)
+    assert delay == pytest.approx(MB / (8 * MB))
+    # callers without a reserve still have the reserved share
+    assert b.take(floor - MB) == 0.0
+
+
+def _lease(sched, client="10.0.0.9", sent=0):
+    lease = sched.acquire()
+    lease.client = client
+    lease.bytes = sent
+    return lease
+
+
+def test_shaper_rejects_unknown_nics():
+    with pytest.raises(ValueError):
+        mp.Shaper(["10.0.0.1"], {"10.0.0.2": MB})
+
+
+def test_shaper_takes_the_longest_delay(clock):
+    sched = mp.SmoothWeightedRoundRobin([("10.0.0.1", 1)])
+    shaper = mp.Shaper(sched.ips, {"10.0.0.1": 8 * MB}, client_rate=4 * MB)
+    lease = _lease(sched)
+    n = shaper.nics[0].burst + MB
+    # the NIC bucket is 1 MB over at 8 MB/s, the client bucket far more at 4 MB/s
+    assert shaper.charge(lease, n) == pytest.approx((n - mp._QOS_MIN_BURST) / (4 * MB))
+    clock.now += 10
+    shaper.client_rate = 0
+    assert shaper.charge(lease, n) == pytest.approx(MB / (8 * MB))
+
+
+def test_bulk_flows_leave_the_reserve(clock):
+    sched = mp.SmoothWeightedRoundRobin([("10.0.0.1", 1)])
+    shaper = mp.Shaper(sched.ips, {"10.0.0.1": 8 * MB}, bulk_rate=100 * MB)
+    burst = shaper.nics[0].burst
+    interactive = _lease(sched)
+    bulk = _lease(sched, sent=mp._QOS_INTERACTIVE_BYTES)
+    assert shaper.charge(bulk, burst * (1 - mp._QOS_RESERVE)) == 0.0
+    assert shaper.charge(bulk, 1) > 0
+    # the interactive flow may still use the reserve
+    assert shaper.charge(interactive, burst * mp._QOS_RESERVE - 1) == 0.0
+    assert shaper.bulk.level < shaper.bulk.burst
+
+
+def test_client_buckets_are_bounded(clock, monkeypatch):
+    monkeypatch.setattr(mp, "_QOS_MAX_CLIENTS", 4)
+    sched = mp.SmoothWeightedRoundRobin([("10.0.0.1", 1)])
+    shaper = mp.Shaper(sched.ips, client_rate=MB)
+    for i in range(4):
+        shaper.charge(_lease(sched, client=f"10.0.1.{i}"), 1)
+    clock.now += mp._QOS_CLIENT_IDLE + 1
+    shaper.charge(_lease(sched, client="10.0.1.3"), 1)  # refreshes its stamp
+    shaper.charge(_lease(sched, client="10.0.2.1"), 1)
+    assert sorted(shaper._clients) == ["10.0.1.3", "10.0.2.1"]
@@ -0,0 +1,77 @@
+import socket
+
+import pytest
+
+import multipath_proxy as mp
+
+MiB = 1024 * 1024
+
+
+def _fields(profile):
+    return {k: getattr(profile, k) for k in ("sndbuf", "rcvbuf", "congestion", "fastopen",
+                                             "keepalive", "keepintvl", "keepcnt", "connect_timeout")}
+
+
+def test_empty_spec_is_the_default():
+    assert _fields(mp.SocketProfile.parse("")) == _fields(mp.SocketProfile())
+    assert _fields(mp.SocketProfile.parse("default")) == _fields(mp.SocketProfile())
+
+
+@pytest.mark.parametrize("name", list(mp.PROFILE_PRESETS))
+def test_presets(name):
+    profile = mp.SocketProfile.parse(name.upper())
+    assert _fields(profile) == _fields(mp.SocketProfile(**mp.PROFILE_PRESETS[name]))
+
+
+def test_later_items_override_the_preset():
+    p = mp.SocketProfile.parse("satellite, cc=cubic, tfo=off, buf=512K, rcvbuf=2M, timeout=7.5")
+    assert p.congestion == "cubic"
+    assert p.fastopen is False
+    assert (p.sndbuf, p.rcvbuf) == (512 * 1024, 2 * MiB)
+    assert p.connect_timeout == 7.5
+    assert (p.keepalive, p.keepintvl, p.keepcnt) == (60, 20, 4)  # untouched preset values
+
+
+@pytest.mark.parametrize("value,expected", [("30", (30, 0, 0)), ("30/5", (30, 5, 0)),
+                                            ("30/5/3", (30, 5, 3)), ("0", (0, 0, 0))])
+def test_keepalive_forms(value, expected):
+    p = mp.SocketProfile.parse(f"keepalive={value}")
+    assert (p.keepalive, p.keepintvl, p.keepcnt) == expected
+
+
+@pytest.mark.parametrize("value,expected", [("4096", 4096), ("64K", 64 * 1024), ("1.5M", 3 * MiB // 2),
+                                            ("2mb", 2 * MiB), ("8kB", 8 * 1024)])
+def test_sizes(value, expected):
+    assert mp._parse_size(value) == expected
+
+
+def test_bare_tfo_turns_fast_open_on():
+    assert mp.SocketProfile.parse("fibre,tfo").fastopen is True
+
+
+@pytest.mark.parametrize("spec", ["turbo", "buf=lots", "keepalive=a/b", "timeout=", "mtu=1400",
+                                  "keepalive=1/2/3.5", "buf=4G"])
+def test_bad_specs_raise_value_error(spec):
+    with pytest.raises(ValueError):
+        mp.SocketProfile.parse(spec)
+
+
+def test_str_summarises_the_options():
+    assert str(mp.SocketProfile.parse("lte")) == \
+        "buffers 4096K/4096K, cc bbr, fast open, keepalive 30/10/3, connect timeout 15s"
+    assert str(mp.SocketProfile(connect_timeout=10)) == "connect timeout 10s"
+
+
+def test_apply_reports_what_failed(monkeypatch):
+    monkeypatch.setitem(mp._SYSCTL_CACHE, "/proc/sys/net/core/wmem_max", 1 * MiB)
+    monkeypatch.setitem(mp._SYSCTL_CACHE, "/proc/sys/net/core/rmem_max", 8 * MiB)
+    profile = mp.SocketProfile(sndbuf=4 * MiB, rcvbuf=256 * 1024, congestion="no-such-cc",
+                               keepalive=30, keepintvl=5, keepcnt=2)
+    with socket.socket() as s:
+        failed = profile.apply(s)
+        assert any(f.startswith("sndbuf (above net.core.wmem_max") for f in failed)
+        assert not any(f.startswith("rcvbuf") for f in failed)
+        assert any(f.startswith("cc no-such-cc") for f in failed)
+        assert s.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+        if hasattr(socket, "TCP_KEEPCNT"):
+            assert s.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT) == 2
@@ -0,0 +1,182 @@
+import itertools
+import random
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+import multipath_proxy as mp
+
+PAYLOAD = b"GET / HTTP/1.1\r\n\r\n"
+
+TARGETS = {
+    "ipv4": (b"\x01" + socket.inet_aton("192.0.2.7"), "192.0.2.7"),
+    "domain": (b"\x03\x0bexample.com", "example.com"),
+    "ipv6": (b"\x04" + socket.inet_pton(socket.AF_INET6, "2001:db8::7"), "2001:db8::7"),
+}
+
+
+def _stream(target, methods=b"\x00", cmd=1, port=8443, early=PAYLOAD):
+    addr = TARGETS[target][0]
+    return (b"\x05" + bytes([len(methods)]) + methods
+            + b"\x05" + bytes([cmd]) + b"\x00" + addr + struct.pack("!H", port) + early)
+
+
+def _parse_pieces(pieces, use_feed):
+    """Deliver pieces one by one like recv_into()/feed() would; parse after each."""
+    parser = mp._Socks5Parser()
+    states = []
+    for piece in pieces:
+        if use_feed:
+            parser.feed(piece)
+        else:
+            parser.space()[:len(piece)] = piece
+            parser.received(len(piece))
+        states.append(parser.parse())
+    assert states == sorted(states), "state went backwards"
+    return parser
+
+
+def _splits(data, cuts):
+    bounds = [0, *cuts, len(data)]
+    return [data[a:b] for a, b in zip(bounds, bounds[1:])]
+
+
+def _check(parser, target, early=PAYLOAD, methods=b"\x00"):
+    assert parser.state == parser.DONE
+    assert parser.methods == methods
+    assert parser.cmd == 1
+    assert parser.host == TARGETS[target][1]
+    assert parser.port == 8443
+    assert parser.early == early
+
+
+@pytest.mark.parametrize("use_feed", [False, True])
+@pytest.mark.parametrize("target", sorted(TARGETS))
+def test_every_single_and_double_cut(target, use_feed):
+    data = _stream(target)
+    for k in (1, 2):
+        for cuts in itertools.combinations(range(1, len(data)), k):
+            _check(_parse_pieces(_splits(data, cuts), use_feed), target)
+
+
+@pytest.mark.parametrize("target", sorted(TARGETS))
+def test_random_multi_cut(target):
+    rng = random.Random(target)
+    data = _stream(target, methods=b"\x02\x01\x00")
+    for _ in range(500):
+        cuts = sorted(rng.sample(range(1, len(data)), rng.randint(3, 12)))
+        _check(_parse_pieces(_splits(data, cuts), rng.random() < 0.5), target, methods=b"\x02\x01\x00")
+
+
+@pytest.mark.parametrize("target", sorted(TARGETS))
+def test_one_byte_at_a_time_without_early_data(target):
+    data = _stream(target, early=b"")
+    _check(_parse_pieces([data[i:i + 1] for i in range(len(data))], False), target, early=b"")
+
+
+def test_early_is_empty_until_done():
+    parser = _parse_pieces([_stream("ipv4")[:6]], True)
+    assert parser.state == parser.REQUEST
+    assert parser.early == b""
+
+
+def test_udp_associate():
+    parser = _parse_pieces([_stream("ipv4", cmd=3, early=b"")], True)
+    assert parser.cmd == 3
+
+
+@pytest.mark.parametrize("data", [
+    b"\x04\x01\x00\x50\x7f\x00\x00\x01\x00",                  # SOCKS4
+    b"\x05\x01\x00\x04\x01\x00\x01\x7f\x00\x00\x01\x00\x50",  # request version 4
+    b"\x05\x01\x00\x05\x02\x00\x01\x7f\x00\x00\x01\x00\x50",  # BIND
+    b"\x05\x01\x00\x05\x01\x00\x02\x7f\x00\x00\x01\x00\x50",  # address type 2
+    b"\x05\x01\x00\x05\x01\x00\x03\x02\xff\xfe\x00\x50",      # domain is not UTF-8
+    b"GET / HTTP/1.1\r\n\r\n",
+])
+def test_invalid_handshakes_raise_value_error(data):
+    with pytest.raises(ValueError):
+        _parse_pieces([data], True)
+
+
+def test_oversized_handshake_is_rejected():
+    parser = mp._Socks5Parser()
+    with pytest.raises(ValueError):
+        parser.feed(b"\x05" * (mp._Socks5Parser.SIZE + 1))
+
+
+def test_garbage_never_raises_anything_but_value_error():
+    rng = random.Random(1)
+    for _ in range(5000):
+        data = bytes(rng.randrange(256) for _ in range(rng.randint(0, 80)))
+        if rng.random() < 0.5:  # plausible prefix, random tail
+            data = b"\x05\x01\x00\x05" + data
+        cuts = sorted(rng.sample(range(1, len(data)), min(3, len(data) - 1))) if len(data) > 1 else []
+        parser = mp._Socks5Parser()
+        try:
+            for piece in _splits(data, cuts):
+                parser.feed(piece)
+                parser.parse()
+        except ValueError:
+            continue
+        assert parser.state in (parser.GREETING, parser.REQUEST, parser.DONE)
+
+
+# ---- through the proxy ------------------------------------------------------
+def _echo_server():
+    srv = socket.socket()
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(16)
+
+    def handle(conn):
+        with conn:
+            while True:
+                data = conn.recv(65536)
+                if not data:
+                    return
+                conn.sendall(data)
+
+    def accept():
+        while True:
+            try:
+                conn, _ = srv.accept()
+            except OSError:
+                return
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return srv
+
+
+@pytest.mark.parametrize("engine", ["threads", "asyncio"])
+def test_fragmented_handshake_with_early_data(engine):
+    srv = _echo_server()
+    proxy = mp.MultiNICSOCKSProxy("127.0.0.1", 0, [("127.0.0.1", 1)], quiet=True, engine=engine)
+    proxy.start()
+    try:
+        port = srv.getsockname()[1]
+        data = (b"\x05\x01\x00\x05\x01\x00\x01" + socket.inet_aton("127.0.0.1")
+                + struct.pack("!H", port) + PAYLOAD)
+        rng = random.Random(engine)
+        splits = [[], [1], [3], [4], [10], [len(data) - len(PAYLOAD)], [1, 2, 3, 5, 8, 13]]
+        splits += [sorted(rng.sample(range(1, len(data)), 4)) for _ in range(5)]
+        for cuts in splits:
+            c = socket.create_connection(("127.0.0.1", proxy._server.getsockname()[1]))
+            c.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            for piece in _splits(data, cuts):
+                c.sendall(piece)
+                time.sleep(0.01)
+            expected = b"\x05\x00" + b"\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00" + PAYLOAD
+            got = b""
+            c.settimeout(5)
+            while len(got) < len(expected):
+                chunk = c.recv(4096)
+                assert chunk, f"connection closed after {got!r} for cuts {cuts}"
+                got += chunk
+            assert got == expected, cuts
+            c.close()
+    finally:
+        proxy.stop()
+        srv.close()
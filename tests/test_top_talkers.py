@@ -0,0 +1,88 @@
+import random
+from collections import Counter
+
+import pytest
+
+import multipath_proxy as mp
+
+
+def _stream(seed, keys=500, events=20000):
+    """Zipf-like traffic: a few heavy keys and a long tail."""
+    rng = random.Random(seed)
+    weights = [1 / (k + 1) ** 1.2 for k in range(keys)]
+    names = [f"host{k}.example" for k in range(keys)]
+    return [(key, rng.randint(1, 1500)) for key in rng.choices(names, weights, k=events)]
+
+
+def test_exact_below_capacity():
+    s = mp.SpaceSaving(8)
+    for key, n in [("a", 5), ("b", 3), ("a", 2), ("c", 1)]:
+        s.add(key, n)
+    assert s.top(10) == [("a", 7, 0), ("b", 3, 0), ("c", 1, 0)]
+    assert s.top(1) == [("a", 7, 0)]
+
+
+def test_new_key_inherits_the_smallest_count_as_error():
+    s = mp.SpaceSaving(2)
+    s.add("a", 10)
+    s.add("b", 4)
+    s.add("c", 1)
+    assert sorted(s.top(5)) == [("a", 10, 0), ("c", 5, 4)]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_error_bounds(seed):
+    capacity = 32
+    s = mp.SpaceSaving(capacity)
+    truth = Counter()
+    for key, n in _stream(seed):
+        s.add(key, n)
+        truth[key] += n
+    total = sum(truth.values())
+    assert len(s.counts) == capacity
+    assert sum(c for c, _ in s.counts.values()) == total  # counts always sum to the stream
+    for key, (count, error) in s.counts.items():
+        # never underestimates, and overestimates by at most its error
+        assert truth[key] <= count <= truth[key] + error
+        assert error <= total / capacity
+    # every key above total/capacity is tracked
+    for key, n in truth.items():
+        if n > total / capacity:
+            assert key in s.counts
+    # the true heavy hitters head the ranking
+    top = [key for key, _, _ in s.top(3)]
+    assert top == [key for key, _ in truth.most_common(3)]
+
+
+def test_scale_keeps_the_bounds_proportional():
+    s = mp.SpaceSaving(2)
+    for key, n in [("a", 100), ("b", 40), ("c", 10)]:
+        s.add(key, n)
+    s.scale(0.5)
+    assert sorted(s.top(2)) == [("a", 50, 0), ("c", 25, 20)]
+
+
+class Clock:
+    now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_top_talkers_per_nic_and_decay(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(mp.time, "monotonic", clock)
+    sched = mp.SmoothWeightedRoundRobin([("10.0.0.1", 1), ("10.0.0.2", 1)])
+    talkers = mp.TopTalkers(sched.ips, capacity=4)
+    a, b = sched.acquire(), sched.acquire()
+    a.host, a.client = "big.example", "192.168.1.2"
+    talkers.add(a, 4000)
+    talkers.add(b, 100)  # no host: a UDP association
+    top = talkers.top()
+    assert top[a.index]["hosts"] == [("big.example", 4000, 0)]
+    assert top[a.index]["clients"] == [("192.168.1.2", 4000, 0)]
+    assert top[b.index]["hosts"] == [("-", 100, 0)]
+    clock.now += mp._TALKER_HALF_LIFE
+    assert talkers.top()[a.index]["hosts"] == [("big.example", 2000, 0)]
+    a.release()
+    b.release()
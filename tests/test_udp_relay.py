@@ -0,0 +1,128 @@
+import socket
+import struct
+import threading
+
+import pytest
+
+import multipath_proxy as mp
+
+
+def _has_ipv6():
+    try:
+        with socket.socket(socket.AF_INET6, socket.SOCK_DGRAM) as s:
+            s.bind(("::1", 0))
+        return True
+    except OSError:
+        return False
+
+
+def _echo(family, host):
+    """UDP server that sends every datagram back prefixed with b'echo:'."""
+    srv = socket.socket(family, socket.SOCK_DGRAM)
+    srv.bind((host, 0))
+
+    def run():
+        while True:
+            try:
+                data, addr = srv.recvfrom(65536)
+            except OSError:
+                return
+            srv.sendto(b"echo:" + data, addr)
+
+    threading.Thread(target=run, daemon=True).start()
+    return srv
+
+
+@pytest.mark.parametrize("host,port", [("10.1.2.3", 53), ("::1", 8080), ("2001:db8::1", 65535)])
+def test_socks5_addr_packing(host, port):
+    packed = mp._socks5_addr(host, port)
+    if ":" in host:
+        assert packed[0] == 4 and len(packed) == 19
+        assert socket.inet_ntop(socket.AF_INET6, packed[1:17]) == host
+    else:
+        assert packed[0] == 1 and len(packed) == 7
+        assert socket.inet_ntoa(packed[1:5]) == host
+    assert struct.unpack("!H", packed[-2:])[0] == port
+    assert len(b"\x00\x00\x00" + packed) <= mp._UDPRelay._HEADROOM
+
+
+@pytest.fixture
+def relay():
+    nics = [("127.0.0.1", 1)] + ([("::1", 1)] if _has_ipv6() else [])
+    proxy = mp.MultiNICSOCKSProxy("127.0.0.1", 0, nics, quiet=True)
+    proxy.start()
+    ctrl = socket.create_connection(proxy._server.getsockname())
+    ctrl.sendall(b"\x05\x01\x00")
+    assert ctrl.recv(2) == b"\x05\x00"
+    ctrl.sendall(b"\x05\x03\x00\x01\x00\x00\x00\x00\x00\x00")
+    reply = b""
+    while len(reply) < 10:
+        reply += ctrl.recv(10 - len(reply))
+    assert reply[:4] == b"\x05\x00\x00\x01"
+    bound = (socket.inet_ntoa(reply[4:8]), struct.unpack("!H", reply[8:10])[0])
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.bind(("127.0.0.1", 0))
+    client.settimeout(0.5)
+    yield client, bound
+    client.close()
+    ctrl.close()
+    proxy.stop()
+
+
+def _exchange(client, bound, header, payload, attempts=10):
+    """Send until a reply arrives (a domain target's first datagram is dropped while it resolves)."""
+    for _ in range(attempts):
+        client.sendto(header + payload, bound)
+        try:
+            return client.recvfrom(65536)[0]
+        except socket.timeout:
+            continue
+    raise AssertionError("no reply through the relay")
+
+
+def test_ipv4_datagram_round_trip(relay):
+    client, bound = relay
+    srv = _echo(socket.AF_INET, "127.0.0.1")
+    port = srv.getsockname()[1]
+    header = b"\x00\x00\x00" + mp._socks5_addr("127.0.0.1", port)
+    data = _exchange(client, bound, header, b"ping")
+    assert data == header + b"echo:ping"
+    srv.close()
+
+
+@pytest.mark.skipif(not _has_ipv6(), reason="no IPv6 loopback")
+def test_ipv6_datagram_round_trip(relay):
+    client, bound = relay
+    srv = _echo(socket.AF_INET6, "::1")
+    port = srv.getsockname()[1]
+    header = b"\x00\x00\x00" + mp._socks5_addr("::1", port)
+    data = _exchange(client, bound, header, b"ping6")
+    assert data == header + b"echo:ping6"
+    srv.close()
+
+
+def test_domain_datagram_gets_an_ip_header(relay):
+    client, bound = relay
+    srv = _echo(socket.AF_INET, "127.0.0.1")
+    port = srv.getsockname()[1]
+    name = b"127.0.0.1"  # a literal in the domain form skips the resolver
+    header = b"\x00\x00\x00\x03" + bytes([len(name)]) + name + struct.pack("!H", port)
+    data = _exchange(client, bound, header, b"x" * 1400)
+    assert data == b"\x00\x00\x00" + mp._socks5_addr("127.0.0.1", port) + b"echo:" + b"x" * 1400
+    srv.close()
+
+
+def test_fragments_and_short_headers_are_dropped(relay):
+    client, bound = relay
+    srv = _echo(socket.AF_INET, "127.0.0.1")
+    port = srv.getsockname()[1]
+    addr = mp._socks5_addr("127.0.0.1", port)
+    for bad in (b"\x00\x00\x01" + addr + b"frag",   # FRAG != 0
+                b"\x00\x00\x00" + addr[:5],           # header cut short
+                b"\x00\x00\x00\x09" + addr[1:] + b"atyp"):
+        client.sendto(bad, bound)
+    with pytest.raises(socket.timeout):
+        client.recvfrom(65536)
+    # the association still works afterwards
+    assert _exchange(client, bound, b"\x00\x00\x00" + addr, b"ok").endswith(b"echo:ok")
+    srv.close()